@@ -1,13 +1,14 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from typing import List
+from fastapi import APIRouter, UploadFile, File, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from typing import List, Optional
 from ..utils.config import settings
 import logging
 import cv2
-import numpy as np
-import io
-from PIL import Image
-from ..utils.util import extract_fish_region
+import asyncio
 from .. import state
+from ..services.inference_executor import InferenceQueueFull
+from ..services.identify_pipeline import segment_image, build_file_result
+from ..services.registry import services
 import json
 from pathlib import Path
 import time
@@ -17,168 +18,232 @@ router = APIRouter()
 
 logging.basicConfig(level=getattr(logging, settings.LOG_LEVEL))
 
-reg_path = BASE_DIR / "references" / "regulation" / "regulations.json"
-with open(reg_path, 'r', encoding='utf-8') as f:
-    REGULATIONS = json.load(f)["regulations"]
-
-categories_path = BASE_DIR / "models" / "classification" / "categories.json"
-with open(categories_path, 'r', encoding='utf-8') as f:
-    CATEGORIES = json.load(f)
-
 def find_regulation(common_name, scientific_name):
-    try:
-        for reg in REGULATIONS:
-            if reg.get('species', '').lower() == common_name.lower() or reg.get('latin_name', '').lower() == scientific_name.lower():
-                return reg
-        return {}        
-    except Exception as e:
-        logging.error(f"Error in find_regulation: {e}")
-        return {}
+    return services.species_index.find_regulation(common_name, scientific_name)
 
 def find_category(common_name, scientific_name):
+    return services.species_index.find_category(common_name, scientific_name)
+
+async def _identify_file(models, filename: str, content_type: str, image_data: bytes, use_process_pool: bool = False) -> dict:
+    if not content_type or not content_type.startswith('image/'):
+        return {"error": "File must be an image", "filename": filename}
+
     try:
-        for cat in CATEGORIES['categories'].values():
-            if cat.get('name', '').lower() == common_name.lower() or cat.get('species_id', '').lower() == scientific_name.lower():
-                return cat
-        return ""
+        if use_process_pool:
+            return await models.process_pool.identify(image_data, filename, top_k=3)
+
+        image_np, fish_ids, fish_regions = await state.inference_executor.run(models.segmenter_pool.run, segment_image, image_data, filename)
+
+        # Classify all fish of this image (or the whole image as fallback) in one batched forward pass
+        crops = [image_np] if fish_ids is None else fish_regions
+        batch_classifications = await models.classification_batcher.classify_batch(crops, top_k=3)
+        return build_file_result(filename, fish_ids, batch_classifications)
+
     except Exception as e:
-        logging.error(f"Error in find_category: {e}")
-        return ""
+        return {"error": str(e), "filename": filename}
+
+async def _get_cached_results(models, uploads: List[tuple]) -> List[Optional[dict]]:
+    """Look up every image upload in the result cache with one round trip"""
+    cached = [None] * len(uploads)
+    if not settings.CACHE_ENABLED:
+        return cached
+
+    # Re-uploads of the same photo are answered from the cache, under their own filename
+    positions = [i for i, (_, content_type, _) in enumerate(uploads) if content_type and content_type.startswith('image/')]
+    results = await services.cache.get_many([uploads[i][2] for i in positions], version=models.version)
+    for i, result in zip(positions, results):
+        if result is not None:
+            cached[i] = {**result, "filename": uploads[i][0]}
+    return cached
+
+async def _cache_results(models, uploads: List[tuple], results: List[dict]):
+    """Store the successful results of the given uploads with one round trip"""
+    if settings.CACHE_ENABLED:
+        items = [(upload[2], result) for upload, result in zip(uploads, results) if 'error' not in result]
+        await services.cache.set_many(items, version=models.version)
+
+async def _read_uploads(files: List[UploadFile]) -> List[tuple]:
+    return [(file.filename, file.content_type, await file.read()) for file in files]
+
+def _upload_key(models, upload: tuple, position: int) -> str:
+    """Identical images share a key; anything that isn't an image is keyed by its position"""
+    _, content_type, image_data = upload
+    if content_type and content_type.startswith('image/'):
+        return services.cache.key_for(image_data, models.version)
+    return f"upload:{position}"
+
+async def _identify_shared(models, upload: tuple, use_process_pool: bool = False) -> dict:
+    """Identify an upload, sharing the run with concurrent requests for the same image"""
+    filename, content_type, image_data = upload
+    if not settings.COALESCE_IDENTICAL_REQUESTS or not content_type or not content_type.startswith('image/'):
+        return await _identify_file(models, *upload, use_process_pool=use_process_pool)
+
+    result = await services.cache.coalesce(
+        image_data,
+        lambda: _identify_file(models, *upload, use_process_pool=use_process_pool),
+        version=models.version
+    )
+    return {**result, "filename": filename}
+
+async def _identify_files(models, uploads: List[tuple]) -> List[dict]:
+    batch_results = await _get_cached_results(models, uploads)
+
+    # Identical images within the upload are identified once
+    pending = {}
+    for i, result in enumerate(batch_results):
+        if result is None:
+            pending.setdefault(_upload_key(models, uploads[i], i), []).append(i)
+    pending_uploads = [uploads[positions[0]] for positions in pending.values()]
+
+    # Spread multi-file uploads across worker processes; gather keeps the original order
+    if models.process_pool is not None and len(pending_uploads) > 1:
+        results = list(await asyncio.gather(*[_identify_shared(models, upload, use_process_pool=True) for upload in pending_uploads]))
+    else:
+        results = []
+        for upload in pending_uploads:
+            results.append(await _identify_shared(models, upload))
+
+    for positions, result in zip(pending.values(), results):
+        for i in positions:
+            batch_results[i] = {**result, "filename": uploads[i][0]}
+    await _cache_results(models, pending_uploads, results)
+    return batch_results
+
+def _format_result(result: dict) -> Optional[dict]:
+    """Turn a per-file pipeline result into its response entry (None for failed files)"""
+    if 'success' not in result:
+        return None
+
+    all_classifications = []
+    for detection in result['detections']:
+        for c in detection['classifications']:
+            if c['common_name'] != "Unknown":
+                all_classifications.append(c)
+
+    # Sort by confidence
+    all_classifications.sort(key=lambda x: x['confidence'], reverse=True)
+
+    # Get top 3 distinct species
+    unique_species = set()
+    top_3 = []
+    for c in all_classifications:
+        if c['common_name'] not in unique_species:
+            unique_species.add(c['common_name'])
+            top_3.append({
+                "common_name": c['common_name'],
+                "scientific_name": c['scientific_name'],
+                "confidence": c['confidence'],
+                **services.species_index.fragment(c['common_name'], c['scientific_name'])
+            })
+        if len(top_3) == 3:
+            break
+
+    if not top_3:
+        print(f"[INFO] No confident classifications found for {result['filename']}")
+
+    return {
+        "filename": result['filename'],
+        "success": result['success'],
+        "total_fish_detected": result['total_fish_detected'],
+        "detections": top_3
+    }
+
+def _busy_exception(e: InferenceQueueFull) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="Server is busy, please retry later",
+        headers={"Retry-After": str(e.retry_after)}
+    )
 
 @router.post("/identify")
 async def detect_and_classify_batch(files: List[UploadFile] = File(...)):
-    if state.classifier is None or state.segmenter is None:
+    # The whole request runs on the models that were current when it arrived
+    models = state.models
+    if models is None:
         raise HTTPException(status_code=503, detail="AI models not loaded")
 
-    batch_results = []
-    for file in files:
-        if not file.content_type.startswith('image/'):
-            batch_results.append({"error": "File must be an image", "filename": file.filename})
-            continue
-
-        try:
-            image_data = await file.read()
-            image = Image.open(io.BytesIO(image_data)).convert("RGB")
-            image_np = np.array(image)
-
-            print(f"[DEBUG] Processing {file.filename}, shape={image_np.shape}")
-
-            if len(image_np.shape) != 3:
-                batch_results.append({"error": "Image must be RGB", "filename": file.filename})
-                continue
-
-            polygons, masks = state.segmenter.segment(image_np)
-            print(f"[DEBUG] Segmented {len(polygons)} fish in {file.filename}")
-
-            # Fallback if no valid fish masks or polygons
-            if not polygons or not masks or len(polygons) != len(masks):
-                print("[DEBUG] No valid segmentation. Falling back to whole image classification.")
-                classifications = state.classifier.classify(image_np, top_k=3)
-                if not classifications or all(c['common_name'] == "Unknown" for c in classifications):
-                    print(f"[INFO] No confident fallback classification for {file.filename}")
-                    batch_results.append({
-                        "filename": file.filename,
-                        "success": True,
-                        "total_fish_detected": 0,
-                        "detections": []
-                    })
-                else:
-                    batch_results.append({
-                        "filename": file.filename,
-                        "success": True,
-                        "total_fish_detected": 1,
-                        "detections": [{
-                            "fish_id": 0,
-                            "bounding_box": None,
-                            "polygon": None,
-                            "classifications": classifications,
-                            "mask_area": None
-                        }]
-                    })
-                continue
-
-
-            detections = []
-            for i, (polygon, mask) in enumerate(zip(polygons, masks)):
-                try:
-                    fish_region = extract_fish_region(image_np, mask)
-                    print(f"[DEBUG] Fish region shape: {fish_region.shape}")
-                    if fish_region.shape[0] < 50 or fish_region.shape[1] < 50:
-                        print(f"[DEBUG] Skipping small fish region in {file.filename}")
-                        continue
-
-                    classifications = state.classifier.classify(fish_region, top_k=3)
-
-                    if not classifications or all(c['common_name'] == "Unknown" for c in classifications):
-                        print(f"[DEBUG] No valid classification for fish {i} in {file.filename}")
-
-                    print(f"[DEBUG] Classifications for fish {i} in {file.filename}:")
-                    for c in classifications:
-                        print(f"  → {c['common_name']} ({c['confidence']:.4f}) via {c['method']}")
-
-                    detections.append({
-                        "fish_id": i,
-                        "classifications": classifications
-                    })
-                except Exception as e:
-                    logging.error(f"Error processing fish {i}: {e}")
-                    continue
-
-            batch_results.append({
-                "filename": file.filename,
-                "success": True,
-                "total_fish_detected": len(detections),
-                "detections": detections
-            })
-
-        except Exception as e:
-            batch_results.append({"error": str(e), "filename": file.filename})
+    try:
+        with models.use():
+            async with state.inference_executor.admit():
+                batch_results = await _identify_files(models, await _read_uploads(files))
+    except InferenceQueueFull as e:
+        raise _busy_exception(e)
 
     # Final result formatting
     ret_results = []
     for result in batch_results:
-        if 'success' not in result:
-            continue
-
-        all_classifications = []
-        for detection in result['detections']:
-            for c in detection['classifications']:
-                if c['common_name'] != "Unknown":
-                    all_classifications.append(c)
-
-        # Sort by confidence
-        all_classifications.sort(key=lambda x: x['confidence'], reverse=True)
-
-        # Get top 3 distinct species
-        unique_species = set()
-        top_3 = []
-        for c in all_classifications:
-            if c['common_name'] not in unique_species:
-                unique_species.add(c['common_name'])
-                regulation = find_regulation(c['common_name'], c['scientific_name'])
-                category = find_category(c['common_name'], c['scientific_name'])
-                top_3.append({
-                    "common_name": c['common_name'],
-                    "scientific_name": c['scientific_name'],
-                    "confidence": c['confidence'],
-                    "image_url": category.get('image_url', ''),
-                    "more_info": regulation
-                })
-            if len(top_3) == 3:
-                break
-
-        if not top_3:
-            print(f"[INFO] No confident classifications found for {result['filename']}")
-
-        ret_results.append({
-            "filename": result['filename'],
-            "success": result['success'],
-            "total_fish_detected": result['total_fish_detected'],
-            "detections": top_3
-        })
+        entry = _format_result(result)
+        if entry is not None:
+            ret_results.append(entry)
 
     return {"success": True, "results": ret_results}
 
+@router.post("/identify/stream")
+async def detect_and_classify_stream(files: List[UploadFile] = File(...),
+                                     output_format: str = Query("ndjson", alias="format")):
+    """
+    Streaming variant of /identify: each file's result is sent as soon as it is ready,
+    as newline-delimited JSON (format=ndjson) or server-sent events (format=sse).
+    Entries carry the file's position in the upload as "index" since they arrive in
+    completion order; failed files are sent with "success": false and an "error".
+    """
+    models = state.models
+    if models is None:
+        raise HTTPException(status_code=503, detail="AI models not loaded")
+    if output_format not in ("ndjson", "sse"):
+        raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'sse'")
+    if len(files) > settings.MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"Too many files, at most {settings.MAX_BATCH_SIZE} per request")
+
+    models.acquire()
+    try:
+        uploads = await _read_uploads(files)
+        cached = await _get_cached_results(models, uploads)
+        state.inference_executor.acquire()
+    except InferenceQueueFull as e:
+        models.release()
+        raise _busy_exception(e)
+    except BaseException:
+        models.release()
+        raise
+    use_process_pool = models.process_pool is not None and sum(result is None for result in cached) > 1
+
+    async def identify_indexed(index: int, upload: tuple):
+        if cached[index] is not None:
+            return index, cached[index]
+        result = await _identify_shared(models, upload, use_process_pool=use_process_pool)
+        await _cache_results(models, [upload], [result])
+        return index, result
+
+    def release(_):
+        executor.release()
+        models.release()
+
+    # Start work right away and keep it running if the client disconnects, so
+    # finished results are still cached; the admission (and the models) are
+    # released once every file is done
+    executor = state.inference_executor
+    tasks = [asyncio.ensure_future(identify_indexed(index, upload)) for index, upload in enumerate(uploads)]
+    asyncio.gather(*tasks, return_exceptions=True).add_done_callback(release)
+
+    def encode(entry: dict) -> str:
+        if output_format == "sse":
+            return f"event: result\ndata: {json.dumps(entry)}\n\n"
+        return json.dumps(entry) + "\n"
+
+    async def stream():
+        for next_done in asyncio.as_completed(tasks):
+            index, result = await next_done
+            entry = _format_result(result)
+            if entry is None:
+                entry = {"filename": result['filename'], "success": False, "error": result.get('error', '')}
+            yield encode({"index": index, **entry})
+        if output_format == "sse":
+            yield "event: done\ndata: {}\n\n"
+
+    media_type = "text/event-stream" if output_format == "sse" else "application/x-ndjson"
+    return StreamingResponse(stream(), media_type=media_type, headers={"Cache-Control": "no-cache"})
+
 @router.get("/species")
 async def get_species_list():
     try:
@@ -1,5 +1,7 @@
 import os
+import asyncio
 from pathlib import Path
+from typing import List, Optional
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 import logging
@@ -9,12 +11,24 @@ from .api import identify
 # Import our fish modules
 from .models.fish_classifier import FishClassifier
 from .models.fish_segmenter import FishSegmenter
+from .models.embedding_cache import EmbeddingCache
+from .models.shared_tensors import process_memory
+from .models.inference_backend import ensure_onnx_export
 from .services.simple_model_manager import SimpleModelManager
-from .utils.model_config import get_model_urls, get_cache_dir, get_device
+from .services.classification_batcher import ClassificationBatcher
+from .services.inference_executor import InferenceExecutor
+from .services.process_pool import IdentifyProcessPool
+from .services.replica_pool import ReplicaPool
+from .services.model_reload import ModelGeneration, ModelReloader, rescore_summary
+from .services.serving_topology import ServingTopology
+from .services.registry import services
+from .utils.model_config import get_model_urls, get_model_checksums, get_cache_dir, get_device, get_classifier_options, get_segmenter_options, get_shared_store, get_model_version
+from .utils.config import settings
 
 from .state import classifier, segmenter
 
 BASE_DIR = Path(__file__).parent.parent.resolve()
+CATEGORIES_PATH = BASE_DIR / "models" / "classification" / "categories.json"
 
 app = FastAPI(
     title="Fishing-AI API",
@@ -36,13 +50,155 @@ app.add_middleware(
 )
 
 # Model manager instance (using gdown - no credentials needed)
-model_manager = SimpleModelManager(get_cache_dir())
+model_manager = SimpleModelManager(
+    get_cache_dir(),
+    expected_hashes=get_model_checksums(),
+    max_workers=settings.MODEL_DOWNLOAD_WORKERS,
+    retries=settings.MODEL_DOWNLOAD_RETRIES,
+    store_dir=settings.MODEL_STORE_DIR or None,
+    store_verify=settings.MODEL_STORE_VERIFY
+)
+
+# Builds refreshed models in the background, one refresh at a time
+model_reloader = ModelReloader(niceness=settings.MODEL_RELOAD_NICENESS)
+
+# Generations that are serving or still finishing requests
+live_generations: List[ModelGeneration] = []
+
+def start_process_pool(model_paths) -> Optional[IdentifyProcessPool]:
+    """Worker processes for parallel multi-file uploads (None when disabled); warmup() starts them"""
+    if settings.IDENTIFY_PROCESS_WORKERS <= 0:
+        return None
+    return IdentifyProcessPool(
+        model_paths={name: str(path) for name, path in model_paths.items()},
+        indexes_path=str(CATEGORIES_PATH),
+        device=get_device(),
+        classifier_options=get_classifier_options(),
+        max_workers=settings.IDENTIFY_PROCESS_WORKERS,
+        torch_threads=settings.IDENTIFY_PROCESS_TORCH_THREADS,
+        mmap_database=model_manager.store is not None
+    )
+
+def export_onnx_models(model_paths):
+    """
+    Export the models that have no ONNX export yet when the onnx backend is
+    selected (blocking), once, before process pool workers load them
+    """
+    if settings.INFERENCE_BACKEND != "onnx":
+        return
+    onnx_dir = settings.ONNX_EXPORT_DIR or None
+    ensure_onnx_export(model_paths["classification_model.ts"], FishClassifier.ONNX_INPUT, onnx_dir)
+    ensure_onnx_export(model_paths["segmentation_model.ts"], FishSegmenter.ONNX_INPUT, onnx_dir)
+
+def build_generation(model_paths, warmup_iterations: int, process_pool: Optional[IdentifyProcessPool] = None) -> ModelGeneration:
+    """
+    Load and warm up a complete set of models (blocking). Used at startup and,
+    on the reload thread, to build the next generation while the current one serves
+    
+    Args:
+        model_paths: Dictionary mapping model filename to path
+        warmup_iterations: Warmup passes per model (0 skips them)
+        process_pool: Already started process pool of this generation, if any
+    """
+    from . import state
+    
+    # Initialize classifier
+    classifier = FishClassifier(
+        model_path=str(model_paths["classification_model.ts"]),
+        data_set_path=str(model_paths["embedding_database.pt"]), 
+        indexes_path=str(CATEGORIES_PATH),
+        device=get_device(),
+        embedding_cache=state.embedding_cache,
+        optimize=settings.MODEL_OPTIMIZE,
+        shared_store=get_shared_store(),
+        mmap_database=model_manager.store is not None,
+        **get_classifier_options()
+    )
+    
+    # Initialize segmenter replicas (one in latency mode)
+    segmenters = [
+        FishSegmenter(
+            model_path=str(model_paths["segmentation_model.ts"]),
+            device=get_device(),
+            optimize=settings.MODEL_OPTIMIZE,
+            shared_store=get_shared_store(),
+            **get_segmenter_options()
+        )
+        for _ in range(state.topology.replicas)
+    ]
+    
+    # Pay for TorchScript profiling and fusion before the first request
+    if warmup_iterations > 0:
+        segmenter_time = sum(segmenter.warmup(warmup_iterations) for segmenter in segmenters)
+        classifier_time = classifier.warmup(warmup_iterations)
+        logging.info(f"Models warmed up: segmenter {segmenter_time:.2f}s, classifier {classifier_time:.2f}s")
+    
+    # Batch crops from concurrent requests into shared forward passes
+    classification_batcher = ClassificationBatcher(
+        classifier,
+        max_batch_size=settings.CLASSIFIER_MAX_BATCH_SIZE,
+        max_wait_ms=settings.CLASSIFIER_MAX_WAIT_MS,
+        executor=state.inference_executor.executor
+    )
+    
+    # Cached results are only valid for the models (and options) that produced them
+    return ModelGeneration(
+        get_model_version(model_paths, CATEGORIES_PATH),
+        model_paths,
+        classifier,
+        ReplicaPool(segmenters),
+        classification_batcher,
+        process_pool
+    )
+
+def activate_generation(generation: ModelGeneration) -> Optional[ModelGeneration]:
+    """
+    Swap the models serving new requests. Runs on the event loop without
+    awaiting, so no request sees a mix of the old and new models
+
+    Returns:
+        The generation that was serving before, if any
+    """
+    from . import state
+    previous = state.models
+    live_generations.append(generation)
+    state.models = generation
+    state.classifier = generation.classifier
+    state.segmenter = generation.segmenter
+    state.segmenter_pool = generation.segmenter_pool
+    state.classification_batcher = generation.classification_batcher
+    state.process_pool = generation.process_pool
+    state.model_version = generation.version
+    return previous
+
+def prune_model_files():
+    """
+    Delete the model version directories and shared weights that no live
+    generation uses. Only called while no reload is downloading or building,
+    since that reload's files don't belong to a generation yet
+    """
+    model_manager.prune_versions(keep=[generation.model_dir for generation in live_generations])
+    shared_store = get_shared_store()
+    if shared_store is not None:
+        shared_store.prune(keep=set().union(*(generation.shared_keys() for generation in live_generations)))
+
+def generation_closed(generation: ModelGeneration):
+    live_generations.remove(generation)
+    # A running reload prunes once it has swapped its models in
+    if not model_reloader.running:
+        prune_model_files()
 
 @app.on_event("startup")
 async def startup_event():
     """Initialize models on startup"""
     from . import state 
     try:
+        # Torch threads (and CPU pinning) are set once per worker process
+        if state.topology is None:
+            state.topology = ServingTopology.from_settings(settings)
+            state.topology.validate()
+            state.topology.apply()
+        
         # Get model URLs from configuration (using gdown approach)
         model_urls = get_model_urls()
         
@@ -57,22 +213,31 @@ async def startup_event():
         if not model_manager.verify_models():
             raise Exception("Model verification failed")
         
-        # Get model paths
+        # Kept across model refreshes; entries are keyed by classification model hash
+        if state.embedding_cache is None and settings.EMBEDDING_CACHE_MAX_ENTRIES > 0:
+            state.embedding_cache = EmbeddingCache(settings.EMBEDDING_CACHE_MAX_ENTRIES)
+        
+        # Run inference off the event loop on a dedicated, bounded pool
+        if state.inference_executor is None:
+            state.inference_executor = InferenceExecutor(
+                max_workers=max(settings.INFERENCE_WORKERS, state.topology.replicas),
+                max_queue_depth=settings.INFERENCE_QUEUE_DEPTH,
+                retry_after=settings.INFERENCE_RETRY_AFTER_SECONDS
+            )
+        
         model_paths = model_manager.get_all_model_paths()
+        export_onnx_models(model_paths)
+        process_pool = start_process_pool(model_paths)
+        if process_pool is not None:
+            process_pool.warmup(wait=True)
+        activate_generation(build_generation(model_paths, settings.MODEL_WARMUP_ITERATIONS, process_pool))
         
-        # Initialize classifier
-        state.classifier = FishClassifier(
-            model_path=str(model_paths["classification_model.ts"]),
-            data_set_path=str(model_paths["embedding_database.pt"]), 
-            indexes_path=str(BASE_DIR / "models" / "classification" / "categories.json"),
-            device=get_device()
-        )
+        # Reference data used to enrich responses, built here rather than on the first request
+        services.get("species_index")
         
-        # Initialize segmenter
-        state.segmenter = FishSegmenter(
-            model_path=str(model_paths["segmentation_model.ts"]),
-            device=get_device()
-        )
+        if settings.CACHE_ENABLED:
+            await services.cache.connect()
+            services.cache.start_expiry_task(settings.CACHE_EXPIRY_INTERVAL_SECONDS)
         
         logging.info("Models loaded successfully from Google Drive using gdown")
         
@@ -80,6 +245,76 @@ async def startup_event():
         logging.error(f"Failed to load models: {e}")
         raise e
 
+async def reload_models():
+    """
+    Blue/green model reload: download into a new version directory and build
+    the new generation on the reload thread while the current one keeps
+    serving, swap it in, then retire the old one.
+    
+    Building still costs CPU next to live traffic: warmup passes run on torch's
+    shared intra-op threads (which the reload thread's nice value doesn't
+    cover) and new process pool workers load their models at normal priority.
+    Reload warmups are therefore limited to MODEL_RELOAD_WARMUP_ITERATIONS.
+    
+    Returns:
+        The new version and the re-score summary of cached crop embeddings
+    """
+    from . import state
+    version = await model_reloader.run(model_manager.download_version, get_model_urls())
+    if version is None:
+        raise Exception("Failed to download required model files from Google Drive")
+    model_paths = version.get_all_model_paths()
+    await model_reloader.run(export_onnx_models, model_paths)
+    
+    # Started from the event loop thread: processes spawned by the reload
+    # thread would inherit its nice value and keep serving at low priority
+    process_pool = start_process_pool(model_paths)
+    try:
+        if process_pool is not None:
+            await asyncio.gather(*(asyncio.wrap_future(future) for future in process_pool.warmup()))
+        generation = await model_reloader.run(
+            build_generation, model_paths, settings.MODEL_RELOAD_WARMUP_ITERATIONS, process_pool
+        )
+    except Exception:
+        if process_pool is not None:
+            process_pool.shutdown()
+        raise
+    # Show what the new database changes for crops this worker has seen
+    rescore = None
+    if state.models is not None:
+        rescore = await model_reloader.run(rescore_summary, state.models.classifier, generation.classifier)
+        logging.info(f"Re-scored {rescore['rescored']} cached crops, {rescore['top_species_changed']} changed top species")
+    
+    previous = activate_generation(generation)
+    model_manager.promote_version(version)
+    logging.info(f"Serving model version {generation.version}")
+    
+    # The old models are closed (and their files pruned) only after their
+    # last request finished, however long that takes
+    if previous is not None:
+        previous.retire(on_closed=lambda: generation_closed(previous))
+        await previous.drain(settings.MODEL_RELOAD_DRAIN_SECONDS)
+    prune_model_files()
+    return {"version": generation.version, "rescore": rescore}
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background schedulers and inference pools"""
+    from . import state
+    model_reloader.shutdown()
+    for generation in list(live_generations):
+        generation.close()
+    live_generations.clear()
+    # Files still mapped by other workers are left to the last one
+    shared_store = get_shared_store()
+    if shared_store is not None:
+        shared_store.prune()
+    if state.inference_executor is not None:
+        state.inference_executor.shutdown()
+        state.inference_executor = None
+    services.cache.stop_expiry_task()
+    await services.cache.close()
+
 # Include routers
 app.include_router(identify.router, prefix="/api", tags=["identify"])
 
@@ -101,6 +336,14 @@ async def health_check():
             "classifier": state.classifier is not None,
             "segmenter": state.segmenter is not None
         },
+        "models": state.models.stats() if state.models else None,
+        "model_reload": model_reloader.stats(),
+        "inference": state.inference_executor.stats() if state.inference_executor else None,
+        "serving": state.topology.stats() if state.topology else None,
+        "memory": process_memory(),
+        "cache": services.cache.stats(),
+        "services": services.stats(),
+        "embedding_cache": state.embedding_cache.stats() if state.embedding_cache else None,
         "model_info": model_manager.get_model_info(),
         "timestamp": datetime.now().isoformat()
     }
@@ -110,19 +353,20 @@ async def get_model_info():
     """Get detailed information about model files"""
     return model_manager.get_model_info()
 
-@app.post("/models/refresh")
+@app.post("/models/refresh", status_code=202)
 async def refresh_models():
-    """Force refresh of model files from Google Drive"""
-    try:
-        # Clear cache and re-download
-        model_manager.clear_cache()
-        
-        # Re-run startup process
-        await startup_event()
-        
-        return {"message": "Models refreshed successfully"}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to refresh models: {str(e)}")
+    """
+    Force refresh of model files from Google Drive. The reload runs in the
+    background while the current models keep serving; poll GET /models/refresh
+    """
+    if not model_reloader.start(reload_models):
+        raise HTTPException(status_code=409, detail="A model refresh is already running")
+    return {"message": "Model refresh started", "refresh": model_reloader.stats()}
+
+@app.get("/models/refresh")
+async def refresh_status():
+    """Status of the last model refresh"""
+    return model_reloader.stats()
 
 if __name__ == "__main__":
     import uvicorn
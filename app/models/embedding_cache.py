@@ -0,0 +1,90 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import torch
+
+class EmbeddingCache:
+    """
+    In-process LRU cache of backbone embeddings, keyed by crop content hash and
+    classification model hash.
+
+    Only the backbone output is cached, so changing thresholds, confidence
+    mapping, category metadata or the embedding database keeps every entry
+    valid; only a new classification model makes them unreachable. Lookups
+    come from the inference threads, so every access holds a lock.
+    """
+
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max(1, max_entries)
+        self._entries: "OrderedDict[str, torch.Tensor]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def key_for(model_hash: str, crop: np.ndarray) -> str:
+        """Key of a crop's embedding under the given classification model"""
+        crop = np.ascontiguousarray(crop)
+        digest = hashlib.sha256(f"{crop.shape}{crop.dtype}".encode())
+        digest.update(crop.data)
+        return f"{model_hash}:{digest.hexdigest()}"
+
+    def get_many(self, keys: List[str]) -> List[Optional[torch.Tensor]]:
+        """Cached embedding per key, None where nothing is cached"""
+        with self._lock:
+            embeddings = []
+            for key in keys:
+                embedding = self._entries.get(key)
+                if embedding is not None:
+                    self._entries.move_to_end(key)
+                embeddings.append(embedding)
+            hits = sum(1 for embedding in embeddings if embedding is not None)
+            self.hits += hits
+            self.misses += len(keys) - hits
+            return embeddings
+
+    def put_many(self, keys: List[str], embeddings: torch.Tensor):
+        """Store one embedding per key (rows of embeddings)"""
+        embeddings = embeddings.detach().cpu()
+        with self._lock:
+            for key, embedding in zip(keys, embeddings):
+                self._entries[key] = embedding.clone()
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def snapshot(self, model_hash: str) -> Tuple[List[str], Optional[torch.Tensor]]:
+        """
+        All embeddings cached for a classification model
+
+        Returns:
+            Tuple of (keys, stacked embeddings), embeddings is None when there are none
+        """
+        prefix = f"{model_hash}:"
+        with self._lock:
+            items = [(key, embedding) for key, embedding in self._entries.items() if key.startswith(prefix)]
+        if not items:
+            return [], None
+        keys, embeddings = zip(*items)
+        return list(keys), torch.stack(embeddings)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Hit, miss and eviction counters"""
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
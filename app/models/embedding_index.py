@@ -0,0 +1,221 @@
+import math
+import torch
+import logging
+import time
+from pathlib import Path
+from typing import Optional, Tuple, Union
+
+class IVFIndex:
+    """
+    Inverted-file (IVF) approximate nearest-neighbor index over an embedding database.
+
+    A k-means coarse quantizer splits the database into nlist cells. A query is
+    compared against the centroids, and only the rows of its nprobe closest cells
+    are scanned. Rows are stored grouped by cell (CSR layout: list_rows holds row
+    ids, list_offsets[i]:list_offsets[i + 1] is the slice for cell i).
+    """
+
+    def __init__(self, centroids: torch.Tensor, list_offsets: torch.Tensor, list_rows: torch.Tensor, num_vectors: int):
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_rows = list_rows
+        self.num_vectors = num_vectors
+
+    @property
+    def nlist(self) -> int:
+        return self.centroids.shape[0]
+
+    @staticmethod
+    def default_nlist(num_vectors: int) -> int:
+        """Rule of thumb of ~4 * sqrt(N) cells"""
+        return max(1, min(num_vectors, int(4 * math.sqrt(num_vectors))))
+
+    @staticmethod
+    def path_for(data_set_path: Union[str, Path], nlist: int) -> Path:
+        """Location of the persisted index next to the embedding database"""
+        data_set_path = Path(data_set_path)
+        return data_set_path.with_name(f"{data_set_path.stem}.ivf{nlist}.pt")
+
+    @classmethod
+    def build(cls, vectors: torch.Tensor, nlist: Optional[int] = None, iterations: int = 20,
+              seed: int = 0, chunk_size: int = 65536) -> "IVFIndex":
+        """
+        Cluster the database with k-means and build the inverted lists
+
+        Args:
+            vectors: Database tensor of shape (N, D)
+            nlist: Number of cells (defaults to default_nlist(N))
+            iterations: Lloyd iterations
+            seed: Random seed for centroid initialization
+            chunk_size: Rows assigned per distance computation
+
+        Returns:
+            The built index
+        """
+        start_time = time.time()
+        vectors = vectors.float()
+        num_vectors = vectors.shape[0]
+        nlist = min(nlist or cls.default_nlist(num_vectors), num_vectors)
+        generator = torch.Generator().manual_seed(seed)
+
+        centroids = vectors[torch.randperm(num_vectors, generator=generator)[:nlist]].clone()
+        for _ in range(iterations):
+            assignments = cls._assign(vectors, centroids, chunk_size)
+            sums = torch.zeros_like(centroids).index_add_(0, assignments, vectors)
+            counts = torch.bincount(assignments, minlength=nlist)
+
+            # Re-seed empty cells with random database rows
+            empty = counts == 0
+            centroids = sums / counts.clamp(min=1).unsqueeze(1).to(sums.dtype)
+            if empty.any():
+                reseed = torch.randint(num_vectors, (int(empty.sum()),), generator=generator)
+                centroids[empty] = vectors[reseed]
+
+        assignments = cls._assign(vectors, centroids, chunk_size)
+        list_rows = torch.argsort(assignments, stable=True)
+        counts = torch.bincount(assignments, minlength=nlist)
+        list_offsets = torch.zeros(nlist + 1, dtype=torch.long)
+        list_offsets[1:] = torch.cumsum(counts, dim=0)
+
+        elapsed = time.time() - start_time
+        logging.info(f"IVF index with {nlist} cells built over {num_vectors} vectors in {elapsed:.2f} seconds")
+        return cls(centroids, list_offsets, list_rows, num_vectors)
+
+    @staticmethod
+    def _assign(vectors: torch.Tensor, centroids: torch.Tensor, chunk_size: int) -> torch.Tensor:
+        return torch.cat([
+            torch.cdist(vectors[i:i + chunk_size], centroids).argmin(dim=1)
+            for i in range(0, vectors.shape[0], chunk_size)
+        ])
+
+    def search(self, queries: torch.Tensor, vectors, nprobe: int, k: Optional[int] = None) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Find approximate nearest database rows for a batch of queries
+
+        Args:
+            queries: Query tensor of shape (B, D)
+            vectors: Database the index was built on (tensor or QuantizedEmbeddings)
+            nprobe: Number of closest cells to scan per query
+            k: Number of closest rows to return per query (None returns every scanned row)
+
+        Returns:
+            Tuple of (distances, rows), both of shape (B, M). Slots that could not be
+            filled (fewer scanned rows than M) have distance inf and row 0.
+        """
+        nprobe = min(nprobe, self.nlist)
+        probes = torch.topk(torch.cdist(queries, self.centroids.to(queries.dtype)), nprobe, dim=1, largest=False).indices
+
+        offsets = self.list_offsets.tolist()
+        scanned = []
+        for i, cells in enumerate(probes.tolist()):
+            candidates = torch.cat([self.list_rows[offsets[cell]:offsets[cell + 1]] for cell in cells])
+            candidate_distances = torch.cdist(queries[i:i + 1], vectors[candidates])[0]
+            if k is not None and candidates.numel() > k:
+                candidate_distances, positions = torch.topk(candidate_distances, k, largest=False)
+                candidates = candidates[positions]
+            scanned.append((candidate_distances, candidates))
+
+        width = max(1, max(candidates.numel() for _, candidates in scanned))
+        distances = torch.full((queries.shape[0], width), float('inf'), dtype=queries.dtype, device=queries.device)
+        rows = torch.zeros((queries.shape[0], width), dtype=torch.long, device=queries.device)
+        for i, (candidate_distances, candidates) in enumerate(scanned):
+            distances[i, :candidates.numel()] = candidate_distances
+            rows[i, :candidates.numel()] = candidates
+
+        return distances, rows
+
+    def save(self, path: Union[str, Path]):
+        """Persist the index"""
+        torch.save({
+            "centroids": self.centroids,
+            "list_offsets": self.list_offsets,
+            "list_rows": self.list_rows,
+            "num_vectors": self.num_vectors
+        }, str(path))
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "IVFIndex":
+        """Load an index saved with save()"""
+        data = torch.load(str(path), map_location="cpu")
+        return cls(data["centroids"], data["list_offsets"], data["list_rows"], data["num_vectors"])
+
+    @classmethod
+    def load_or_build(cls, data_set_path: Union[str, Path], vectors: torch.Tensor, nlist: Optional[int] = None) -> "IVFIndex":
+        """
+        Load the index persisted next to the embedding database, building and
+        saving it first if it is missing or was built for a different database
+        """
+        nlist = min(nlist or cls.default_nlist(vectors.shape[0]), vectors.shape[0])
+        index_path = cls.path_for(data_set_path, nlist)
+        if index_path.exists() and index_path.stat().st_mtime >= Path(data_set_path).stat().st_mtime:
+            try:
+                index = cls.load(index_path)
+                if index.num_vectors == vectors.shape[0]:
+                    logging.info(f"Loaded IVF index from {index_path}")
+                    return index
+            except Exception as e:
+                logging.warning(f"Failed to load IVF index {index_path}: {e}")
+
+        index = cls.build(vectors, nlist)
+        try:
+            index.save(index_path)
+        except Exception as e:
+            logging.warning(f"Failed to save IVF index to {index_path}: {e}")
+        return index
+
+class QuantizedEmbeddings:
+    """
+    Compressed copy of the embedding database for scanning.
+
+    "fp16" stores half-precision vectors (2x smaller); "int8" stores one byte per
+    value with a per-dimension scale and offset (4x smaller). Distances computed
+    here are approximate and meant to pick candidates for exact re-ranking.
+    """
+
+    def __init__(self, vectors: torch.Tensor, precision: str = "int8", chunk_size: int = 65536):
+        vectors = vectors.float()
+        self.precision = precision
+        self.chunk_size = chunk_size
+
+        if precision == "fp16":
+            self.codes = vectors.half()
+            self.scale = torch.ones(vectors.shape[1])
+            self.offset = torch.zeros(vectors.shape[1])
+        elif precision == "int8":
+            minimum = vectors.min(dim=0).values
+            maximum = vectors.max(dim=0).values
+            self.scale = ((maximum - minimum) / 255).clamp(min=1e-12)
+            self.offset = minimum
+            self.codes = torch.round((vectors - self.offset) / self.scale).clamp(0, 255).to(torch.uint8)
+        else:
+            raise ValueError(f"Unknown embedding precision: {precision}")
+
+        # Squared norms of the decoded vectors, for the ||q||^2 - 2 q.x + ||x||^2 expansion
+        self.norms = torch.cat([
+            self[torch.arange(i, min(i + chunk_size, len(self)))].pow(2).sum(dim=1)
+            for i in range(0, len(self), chunk_size)
+        ])
+
+    def __len__(self) -> int:
+        return self.codes.shape[0]
+
+    def __getitem__(self, rows: torch.Tensor) -> torch.Tensor:
+        """Decode the given rows back to float32"""
+        return self.codes[rows].float() * self.scale + self.offset
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.element_size() * self.codes.numel() + 4 * (self.scale.numel() + self.offset.numel() + self.norms.numel())
+
+    def distances(self, queries: torch.Tensor) -> torch.Tensor:
+        """Approximate L2 distances from each query to every row, shape (B, N)"""
+        queries = queries.float()
+        scaled_queries = queries * self.scale
+        query_offsets = (queries @ self.offset).unsqueeze(1)
+        query_norms = queries.pow(2).sum(dim=1, keepdim=True)
+
+        chunks = []
+        for i in range(0, len(self), self.chunk_size):
+            dots = scaled_queries @ self.codes[i:i + self.chunk_size].float().T + query_offsets
+            chunks.append(query_norms - 2 * dots + self.norms[i:i + self.chunk_size])
+        return torch.cat(chunks, dim=1).clamp(min=0).sqrt()
@@ -6,24 +6,74 @@ import logging
 import time
 from PIL import Image
 from torchvision import transforms
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
+from .embedding_index import IVFIndex, QuantizedEmbeddings
+from .embedding_cache import EmbeddingCache
+from .model_optimizer import file_hash, warmup
+from .inference_backend import load_backend
+from .shared_tensors import SharedTensorStore, load_mmap
+
+UNKNOWN_CATEGORY = {'name': 'Unknown', 'species_id': 'unknown'}
 
 class FishClassifier:
     """
     Fish classifier using only embedding-based similarity (no FC layer).
     """
 
-    def __init__(self, model_path, data_set_path, indexes_path, device='cpu', threshold=5.0):
+    # Example input and dynamic axes for ONNX exports
+    ONNX_INPUT = ((1, 3, 224, 224), {"input": {0: "batch"}})
+
+    def __init__(self, model_path, data_set_path, indexes_path, device='cpu', threshold=5.0,
+                 search_mode='exact', ivf_nlist=None, ivf_nprobe=8,
+                 db_precision='fp32', rerank_candidates=64, rerank_species=16,
+                 embedding_cache: Optional[EmbeddingCache] = None, optimize=False,
+                 precision='fp32', channels_last=False, backend='torchscript',
+                 shared_store: Optional[SharedTensorStore] = None, mmap_database=False, onnx_dir=None):
         start_time = time.time()
         self.device = device
         self.threshold = threshold
+        self.search_mode = search_mode
+        self.ivf_nprobe = ivf_nprobe
+        self.db_precision = db_precision
+        self.rerank_candidates = rerank_candidates
+        self.rerank_species = rerank_species
+
+        self.model = load_backend(model_path, backend, device, optimize, precision, channels_last, shared_store,
+                                  onnx_dir, self.ONNX_INPUT)
 
-        self.model = torch.jit.load(model_path, map_location=device)
-        self.model.eval()
+        # Backbone embeddings are cached per crop and model, across database changes
+        self.embedding_cache = embedding_cache
+        self.model_hash = None
+        if embedding_cache is not None:
+            self.model_hash = f"{file_hash(self.model.model_path)}-{self.model.tag}"
 
-        self.data_base = torch.load(data_set_path, map_location=device)
+        # With a compressed database the full-precision copy is memory-mapped and
+        # only read for re-ranking, so it does not stay resident in every worker.
+        # With shared memory or a shared model store it is mapped too, and
+        # shared through the page cache
+        if shared_store is not None or mmap_database or db_precision != 'fp32':
+            self.data_base = load_mmap(data_set_path, device)
+        else:
+            self.data_base = torch.load(data_set_path, map_location=device)
         with open(indexes_path, 'r') as f:
             self.indexes = json.load(f)
+        self._build_species_index()
+
+        self.compressed_db = None
+        if db_precision != 'fp32':
+            self.compressed_db = QuantizedEmbeddings(self.db_tensor, db_precision)
+            logging.info(
+                f"Embedding database compressed to {db_precision}: "
+                f"{self.compressed_db.nbytes / 2**20:.1f} MB resident instead of "
+                f"{self.db_tensor.element_size() * self.db_tensor.numel() / 2**20:.1f} MB"
+            )
+
+        # Optional approximate search over the embedding database
+        self.ivf_index = None
+        if search_mode == 'ivf':
+            self.ivf_index = IVFIndex.load_or_build(data_set_path, self.db_tensor, ivf_nlist)
+        elif search_mode != 'exact':
+            raise ValueError(f"Unknown search mode: {search_mode}")
 
         self.transform = transforms.Compose([
             transforms.Resize((224, 224)),
@@ -35,59 +85,214 @@ class FishClassifier:
         logging.info(f"Embedding-based fish classifier loaded in {elapsed:.2f} seconds")
 
     def classify(self, image_np, top_k=3):
-        image_pil = Image.fromarray(image_np)
-        image_tensor = self.transform(image_pil).unsqueeze(0).to(self.device)
+        return self.classify_batch([image_np], top_k)[0]
 
-        with torch.no_grad():
-            outputs = self.model(image_tensor)
+    def classify_batch(self, images_np: List[np.ndarray], top_k: int = 3) -> List[List[Dict[str, Any]]]:
+        """
+        Classify several fish crops with a single forward pass.
+        Returns one list of classifications per input crop, in input order.
+        Crops found in the embedding cache skip the forward pass.
+        """
+        if not images_np:
+            return []
 
-        if not isinstance(outputs, tuple) or len(outputs) != 2:
-            raise ValueError("Expected model to return a tuple (embedding, fc_output)")
+        if self.embedding_cache is None:
+            embeddings = self._embed(images_np)
+        else:
+            keys = [EmbeddingCache.key_for(self.model_hash, image_np) for image_np in images_np]
+            cached = self.embedding_cache.get_many(keys)
+            misses = [i for i, embedding in enumerate(cached) if embedding is None]
 
-        embedding = outputs[0][0]  # First item is the embedding
+            # Only crops never seen by this model go through the backbone
+            if misses:
+                computed = self._embed([images_np[i] for i in misses])
+                self.embedding_cache.put_many([keys[i] for i in misses], computed)
+                for i, embedding in zip(misses, computed):
+                    cached[i] = embedding
+            embeddings = torch.stack([embedding.to(self.device) for embedding in cached])
 
         # Run embedding similarity
-        return self._classify_by_embedding(embedding, top_k)
+        return self._classify_by_embeddings(embeddings, top_k)
+
+    def warmup(self, iterations: int = 2, batch_size: int = 4) -> float:
+        """Run the backbone on dummy crops (bypassing the embedding cache) before the first request"""
+        crops = [np.zeros((224, 224, 3), dtype=np.uint8)] * batch_size
+        return warmup("Classifier", lambda: self._embed(crops), iterations)
+
+    def rescore_cached(self, top_k: int = 3, chunk_size: int = 1024) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Classify every cached embedding of this model against the current
+        database, e.g. after rolling out a new database or category metadata
+
+        Args:
+            top_k: Number of species per embedding
+            chunk_size: Embeddings scored per distance computation
+
+        Returns:
+            Classifications per embedding cache key
+        """
+        if self.embedding_cache is None:
+            return {}
+
+        start_time = time.time()
+        keys, embeddings = self.embedding_cache.snapshot(self.model_hash)
+        results = {}
+        if embeddings is not None:
+            embeddings = embeddings.to(self.device)
+            for start in range(0, len(keys), chunk_size):
+                chunk = self._classify_by_embeddings(embeddings[start:start + chunk_size], top_k)
+                results.update(zip(keys[start:start + chunk_size], chunk))
+
+        logging.info(f"Re-scored {len(results)} cached embeddings in {time.time() - start_time:.2f} seconds")
+        return results
+
+    def _embed(self, images_np: List[np.ndarray]) -> torch.Tensor:
+        """Backbone embeddings of several crops in one forward pass"""
+        image_tensor = torch.stack([self.transform(Image.fromarray(image_np)) for image_np in images_np]).to(self.device)
+        outputs = self.model(image_tensor)
+
+        if not isinstance(outputs, tuple) or len(outputs) != 2:
+            raise ValueError("Expected model to return a tuple (embedding, fc_output)")
+
+        return outputs[0]  # First item is the embedding
 
     def _classify_by_embedding(self, embedding: torch.Tensor, top_k: int = 3) -> List[Dict[str, Any]]:
+        return self._classify_by_embeddings(embedding.unsqueeze(0), top_k)[0]
+
+    def _build_species_index(self):
+        """
+        Map every database row to a contiguous species index so the closest
+        exemplar per species can be found with one scatter reduction.
+        """
         if isinstance(self.data_base, tuple):
-            db_tensor = self.data_base[0]
+            self.db_tensor = self.data_base[0]
             db_ids = self.data_base[1]
         else:
-            db_tensor = self.data_base
+            self.db_tensor = self.data_base
             db_ids = self.indexes['list_of_ids']
 
-        distances = (db_tensor - embedding).pow(2).sum(dim=1).sqrt()
-        values, indices = torch.sort(distances)
-
-        results = []
-        seen_species = set()
-        for idx in indices:
-            idx = idx.item()
-            id_entry = db_ids[idx]
+        species_positions = {}
+        row_categories = []
+        self.species_categories = []
+        species_index = []
+        for id_entry in db_ids:
             internal_id = id_entry if isinstance(id_entry, int) else id_entry[0]
-            category = self.indexes['categories'].get(str(internal_id), {'name': 'Unknown', 'species_id': 'unknown'})
+            category = self.indexes['categories'].get(str(internal_id), UNKNOWN_CATEGORY)
+            position = species_positions.get(category['species_id'])
+            if position is None:
+                position = len(self.species_categories)
+                species_positions[category['species_id']] = position
+                self.species_categories.append(category)
+            species_index.append(position)
+            row_categories.append(category)
+
+        self.species_index = torch.tensor(species_index, dtype=torch.long, device=self.db_tensor.device)
+
+        # Species whose rows carry different category entries report the entry of
+        # their closest row, so keep those rows around for the rare lookup
+        self._ambiguous_species = {}
+        ambiguous = {
+            position for position, category in zip(species_index, row_categories)
+            if category['name'] != self.species_categories[position]['name']
+        }
+        for position in ambiguous:
+            rows = (self.species_index == position).nonzero(as_tuple=True)[0]
+            self._ambiguous_species[position] = (rows, [row_categories[row] for row in rows.tolist()])
 
-            # Ensure uniqueness of species
-            if category['species_id'] in seen_species:
-                continue
+    def _search(self, embeddings: torch.Tensor) -> Tuple[torch.Tensor, Optional[torch.Tensor]]:
+        """
+        Distances from each embedding to database rows.
+        Exact search returns all distances and rows=None; IVF search returns the
+        distances to the rows of the probed cells and their row ids. With a
+        compressed database the scan is approximate and the returned distances
+        are exact re-ranked distances of the best candidates.
+        """
+        vectors = self.compressed_db if self.compressed_db is not None else self.db_tensor
+        if self.ivf_index is not None:
+            distances, rows = self.ivf_index.search(embeddings, vectors, self.ivf_nprobe)
+        elif self.compressed_db is not None:
+            distances, rows = self.compressed_db.distances(embeddings), None
+        else:
+            # One distance matrix for the whole batch. cdist's matrix-multiply
+            # expansion loses precision for near-duplicate vectors; the direct
+            # difference form gives the same distances as one row at a time
+            return torch.cdist(embeddings, self.db_tensor, compute_mode='donot_use_mm_for_euclid_dist'), None
+
+        if self.compressed_db is not None:
+            return self._rerank(embeddings, distances, rows)
+        return distances, rows
+
+    def _rerank(self, embeddings: torch.Tensor, approx_distances: torch.Tensor, rows: Optional[torch.Tensor]) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Recompute exact distances for the best approximate candidates: the
+        rerank_candidates closest rows, plus the closest row of each of the
+        rerank_species closest species so every species that can reach the
+        top-k is scored exactly.
+        """
+        batch_size, width = approx_distances.shape
+        if rows is None:
+            rows = torch.arange(width, device=approx_distances.device).expand(batch_size, width)
+        species_index = self.species_index[rows]
+        num_species = len(self.species_categories)
+
+        top_positions = torch.topk(approx_distances, min(self.rerank_candidates, width), dim=1, largest=False).indices
+
+        species_distances = torch.full((batch_size, num_species), float('inf'), dtype=approx_distances.dtype)
+        species_distances.scatter_reduce_(1, species_index, approx_distances, reduce='amin')
+        positions = torch.arange(width, dtype=torch.int32).expand(batch_size, width)
+        closest_positions = torch.full((batch_size, num_species), width, dtype=torch.int32)
+        closest_positions.scatter_reduce_(
+            1, species_index,
+            torch.where(approx_distances == species_distances.gather(1, species_index), positions, width),
+            reduce='amin'
+        )
+        top_species = torch.topk(species_distances, min(self.rerank_species, num_species), dim=1, largest=False).indices
+        species_positions = closest_positions.gather(1, top_species).long()
 
-            seen_species.add(category['species_id'])
-            distance_val = distances[idx].item()
-            confidence = self._distance_to_confidence(distance_val)
+        candidates = torch.cat([top_positions, species_positions], dim=1)
+        valid = candidates < width
+        candidates = candidates.clamp(max=width - 1)
+        valid &= torch.isfinite(approx_distances.gather(1, candidates))
 
-            results.append({
-                'common_name': category['name'],
-                'scientific_name': category['species_id'],
-                'confidence': confidence,
-                'method': 'embedding'
-            })
+        candidate_rows = rows.gather(1, candidates)
+        exact = (self.db_tensor[candidate_rows] - embeddings.unsqueeze(1)).pow(2).sum(dim=2).sqrt()
+        return exact.masked_fill(~valid, float('inf')), candidate_rows
 
-            if len(results) >= top_k:
-                break
+    def _classify_by_embeddings(self, embeddings: torch.Tensor, top_k: int = 3) -> List[List[Dict[str, Any]]]:
+        distances, rows = self._search(embeddings)
+        species_index = self.species_index.expand_as(distances) if rows is None else self.species_index[rows]
 
+        # Closest exemplar per species, then top-k over species
+        species_distances = torch.full(
+            (distances.shape[0], len(self.species_categories)), float('inf'),
+            dtype=distances.dtype, device=distances.device
+        )
+        species_distances.scatter_reduce_(1, species_index, distances, reduce='amin')
+        values, species = torch.topk(species_distances, min(top_k, len(self.species_categories)), dim=1, largest=False)
+
+        results = []
+        for embedding, row_values, row_species in zip(embeddings, values.tolist(), species.tolist()):
+            results.append([
+                self._species_result(position, distance_val, embedding)
+                for distance_val, position in zip(row_values, row_species)
+                if math.isfinite(distance_val)  # species not reached by approximate search
+            ])
         return results
 
+    def _species_result(self, position: int, distance_val: float, embedding: torch.Tensor) -> Dict[str, Any]:
+        category = self.species_categories[position]
+        if position in self._ambiguous_species:
+            rows, categories = self._ambiguous_species[position]
+            distances = torch.cdist(embedding.unsqueeze(0), self.db_tensor[rows], compute_mode='donot_use_mm_for_euclid_dist')
+            category = categories[int(distances[0].argmin())]
+
+        return {
+            'common_name': category['name'],
+            'scientific_name': category['species_id'],
+            'confidence': self._distance_to_confidence(distance_val),
+            'method': 'embedding'
+        }
+
     def _distance_to_confidence(self, distance: float) -> float:
         max_distance = 14
         min_distance = 3
@@ -4,21 +4,27 @@ import cv2
 import logging
 import time
 from PIL import Image
-from shapely.geometry import Polygon
 from torch.nn import functional as F
+from torchvision.ops import nms
+from .model_optimizer import warmup
+from .inference_backend import load_backend
 
 class FishSegmenter:
     """
     Simplified fish segmenter for FastAPI integration
     """
 
-    def __init__(self, model_path, device='cpu'):
+    # Example input (a 768x1024 photo resized to min_size) and dynamic axes for ONNX exports
+    ONNX_INPUT = ((3, 800, 1066), {"input": {1: "height", 2: "width"}})
+
+    def __init__(self, model_path, device='cpu', optimize=False, precision='fp32', channels_last=False,
+                 backend='torchscript', shared_store=None, onnx_dir=None):
         start_time = time.time()
         self.device = device
 
         # Load model
-        self.model = torch.jit.load(model_path, map_location=device)
-        self.model.eval()
+        self.model = load_backend(model_path, backend, device, optimize, precision, channels_last, shared_store,
+                                  onnx_dir, self.ONNX_INPUT)
 
         # Default parameters
         self.min_size = 800
@@ -30,12 +36,19 @@ class FishSegmenter:
         elapsed = time.time() - start_time
         logging.info(f"Fish segmenter loaded successfully in {elapsed:.2f} seconds")
 
-    def segment(self, image_np):
-        resized_img, scales = self._resize_image(image_np)
-        img_tensor = torch.as_tensor(resized_img.astype("float32").transpose(2, 0, 1))
+    def warmup(self, iterations=2, shape=(768, 1024, 3)):
+        """Run the model on a dummy image of a typical photo shape before the first request"""
+        image_np = np.zeros(shape, dtype=np.uint8)
+        return warmup("Segmenter", lambda: self._run_model(image_np), iterations)
 
-        with torch.no_grad():
-            segm_output = self.model(img_tensor)
+    def segment(self, image_np, source_scale=1.0):
+        """
+        Segment fish in an image. source_scale is the size of the original image
+        relative to image_np (for reduced decodes), so polygons are returned in
+        original image coordinates.
+        """
+        resized_img, scales, segm_output = self._run_model(image_np)
+        scales = scales * source_scale
 
         masks_and_polygons = self._convert_output_to_masks_and_polygons(segm_output, resized_img, scales)
         polygons, masks = self._process_output(masks_and_polygons)
@@ -45,6 +58,41 @@ class FishSegmenter:
 
         return polygons, masks
 
+    def detect_boxes(self, image_np):
+        """
+        Detect fish boxes without any mask work (no mask paste, NMS on boxes).
+        Returns [x1, y1, x2, y2] boxes in original image coordinates, largest first.
+        """
+        _, scales, segm_output = self._run_model(image_np)
+        boxes, _, _, scores, _ = self._unpack_output(segm_output)
+
+        boxes = torch.as_tensor(boxes, dtype=torch.float32).reshape(-1, 4)
+        boxes = boxes[torch.as_tensor(scores).reshape(-1) > self.score_threshold]
+        boxes = boxes[(boxes[:, 2] > boxes[:, 0]) & (boxes[:, 3] > boxes[:, 1])]
+        if boxes.numel() == 0:
+            logging.warning("[SEGMENTER] No valid fish boxes detected.")
+            return []
+
+        # Same largest-first greedy order as the mask NMS, with box IoU
+        areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+        boxes = boxes[nms(boxes, areas, self.nms_threshold)]
+
+        scale_y, scale_x = scales
+        boxes = boxes * torch.tensor([scale_x, scale_y, scale_x, scale_y], dtype=torch.float32)
+        return boxes.int().tolist()
+
+    def _run_model(self, image_np):
+        resized_img, scales = self._resize_image(image_np)
+        img_tensor = torch.as_tensor(resized_img.astype("float32").transpose(2, 0, 1))
+
+        segm_output = self.model(img_tensor)
+
+        return resized_img, scales, segm_output
+
+    @staticmethod
+    def _unpack_output(mask_rcnn_output):
+        return tuple(value[0] if isinstance(value, tuple) else value for value in mask_rcnn_output)
+
     def _resize_image(self, image_np):
         h, w = image_np.shape[:2]
         scale = self.min_size / min(h, w)
@@ -59,15 +107,10 @@ class FishSegmenter:
         return resized, scales
 
     def _convert_output_to_masks_and_polygons(self, mask_rcnn_output, resized_img, scales):
-        boxes, classes, masks, scores, img_size = mask_rcnn_output
-
-        boxes = boxes[0] if isinstance(boxes, tuple) else boxes
-        classes = classes[0] if isinstance(classes, tuple) else classes
-        masks = masks[0] if isinstance(masks, tuple) else masks
-        scores = scores[0] if isinstance(scores, tuple) else scores
-        img_size = img_size[0] if isinstance(img_size, tuple) else img_size
+        boxes, classes, masks, scores, img_size = self._unpack_output(mask_rcnn_output)
 
-        processed = []
+        detection_boxes = []
+        detection_masks = []
 
         for i in range(len(masks)):
             if scores[i] <= self.score_threshold:
@@ -75,14 +118,27 @@ class FishSegmenter:
 
             x1, y1, x2, y2 = [int(v) for v in boxes[i].tolist()] if isinstance(boxes[i], torch.Tensor) else [int(v) for v in boxes[i]]
             mask_h, mask_w = y2 - y1, x2 - x1
+            if mask_h <= 0 or mask_w <= 0:
+                continue
 
             mask = masks[i, 0, :, :]
-            mask = self._paste_mask(mask.unsqueeze(0).unsqueeze(0), mask_h, mask_w).numpy()[0][0]
-            mask = np.where(mask > self.mask_threshold, 255, 0).astype(np.uint8)
+            mask = self._paste_mask(mask.unsqueeze(0).unsqueeze(0), mask_h, mask_w)[0][0] > self.mask_threshold
+            if not mask.any():
+                logging.warning("[SEGMENTER] Empty mask %d, skipping.", i)
+                continue
+
+            detection_boxes.append([x1, y1, x2, y2])
+            detection_masks.append(mask)
+
+        # Contours are only extracted for detections that survive NMS
+        processed = []
+        for i in self._mask_nms(detection_boxes, detection_masks):
+            x1, y1 = detection_boxes[i][:2]
+            mask = detection_masks[i].numpy().astype(np.uint8) * 255
 
             contours = self._bitmap_to_polygon(mask)
-            if len(contours) < 1:
-                logging.warning("[SEGMENTER] No contours found for mask %d, skipping.", i)
+            if len(contours) < 1 or len(contours[0]) < 3:
+                logging.warning("[SEGMENTER] No valid contour found for mask %d, skipping.", i)
                 continue
 
             logging.debug(f"[SEGMENTER] Contour 0 size for mask {i}: {len(contours[0])}")
@@ -92,29 +148,49 @@ class FishSegmenter:
 
         return processed
 
-    def _process_output(self, output):
-        poly_instances = []
-        for mask, polygon_array in output:
-            try:
-                poly = Polygon(polygon_array)
-                poly_instances.append([poly, polygon_array, mask])
-            except Exception as e:
-                logging.warning(f"Invalid polygon: {e}")
+    def _mask_nms(self, boxes, masks):
+        """
+        Greedy mask-IoU NMS, largest mask first.
+        Returns the indices of the kept detections in keep order.
+        """
+        if not boxes:
+            return []
+
+        boxes_t = torch.tensor(boxes, dtype=torch.float32)
+        areas = torch.stack([mask.sum() for mask in masks]).float()
+
+        # Box-overlap prefilter: a mask lies inside its box, so the mask IoU of a pair
+        # is at most min(box intersection, area_a, area_b) / max(area_a, area_b)
+        top_left = torch.max(boxes_t[:, None, :2], boxes_t[None, :, :2])
+        bottom_right = torch.min(boxes_t[:, None, 2:], boxes_t[None, :, 2:])
+        box_inter = (bottom_right - top_left).clamp(min=0).prod(dim=2)
+        area_min = torch.min(areas[:, None], areas[None, :])
+        area_max = torch.max(areas[:, None], areas[None, :])
+        iou_bound = torch.min(box_inter, area_min) / area_max
+        candidates = torch.triu(iou_bound > self.nms_threshold, diagonal=1)
+
+        # Exact mask IoU for candidate pairs, on the overlap of their boxes
+        iou = torch.zeros_like(iou_bound)
+        for i, j in candidates.nonzero().tolist():
+            ix1, iy1, ix2, iy2 = *top_left[i, j].int().tolist(), *bottom_right[i, j].int().tolist()
+            (ax1, ay1), (bx1, by1) = boxes[i][:2], boxes[j][:2]
+            inter = (masks[i][iy1 - ay1:iy2 - ay1, ix1 - ax1:ix2 - ax1] & masks[j][iy1 - by1:iy2 - by1, ix1 - bx1:ix2 - bx1]).sum()
+            iou[i, j] = iou[j, i] = inter / (areas[i] + areas[j] - inter)
+
+        order = torch.argsort(areas, descending=True, stable=True).tolist()
+        suppressed = torch.zeros(len(boxes), dtype=torch.bool)
+        keep = []
+        for i in order:
+            if suppressed[i]:
                 continue
+            keep.append(i)
+            suppressed |= iou[i] > self.nms_threshold
+
+        return keep
 
-        poly_instances.sort(key=lambda x: x[0].area, reverse=True)
-        keep_indices = [0]
-        for i in range(1, len(poly_instances)):
-            keep = True
-            for j in keep_indices:
-                if self._calculate_iou(poly_instances[i][0], poly_instances[j][0]) > self.nms_threshold:
-                    keep = False
-                    break
-            if keep:
-                keep_indices.append(i)
-
-        polygons = [self._poly_array_to_dict(poly_instances[i][1]) for i in keep_indices]
-        masks = [poly_instances[i][2] for i in keep_indices]
+    def _process_output(self, output):
+        polygons = [self._poly_array_to_dict(polygon_array) for _, polygon_array in output]
+        masks = [mask for mask, _ in output]
         return polygons, masks
 
     def _paste_mask(self, masks, img_h, img_w):
@@ -135,8 +211,3 @@ class FishSegmenter:
             result[f"x{i+1}"] = point[0]
             result[f"y{i+1}"] = point[1]
         return result
-
-    def _calculate_iou(self, poly_a, poly_b):
-        intersection_area = poly_a.intersection(poly_b).area
-        union_area = poly_a.union(poly_b).area
-        return intersection_area / union_area if union_area > 0 else 0
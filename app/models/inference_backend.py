@@ -0,0 +1,179 @@
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple, Union
+import numpy as np
+import torch
+from .model_optimizer import load_torchscript, file_hash, resolve_precision, precision_tag, autocast, to_float32
+from .shared_tensors import SharedTensorStore
+
+BACKENDS = ("torchscript", "onnx")
+
+# Shape of an example input and the ONNX dynamic_axes, to export a model with
+OnnxInput = Tuple[Tuple[int, ...], Dict[str, Any]]
+
+class InferenceBackend:
+    """
+    Runs one exported model. FishClassifier and FishSegmenter only call it with
+    a float32 input tensor and get a tuple of output tensors back, so the
+    runtime behind it can be swapped.
+    """
+
+    name = "base"
+
+    def __init__(self, model_path: Union[str, Path]):
+        self.model_path = Path(model_path)
+        # Key of the weights mapped from a SharedTensorStore, if any
+        self.shared_key: Optional[str] = None
+
+    @property
+    def tag(self) -> str:
+        """Short description of the runtime and its precision, part of cache keys"""
+        return self.name
+
+    def __call__(self, inputs: torch.Tensor) -> Tuple[torch.Tensor, ...]:
+        raise NotImplementedError
+
+class TorchScriptBackend(InferenceBackend):
+    """
+    TorchScript module, optionally frozen/optimized, int8, bf16 or channels_last,
+    with its weights optionally mapped from a SharedTensorStore
+    """
+
+    name = "torchscript"
+
+    def __init__(self, model_path: Union[str, Path], device: str = 'cpu', optimize: bool = False,
+                 precision: str = 'fp32', channels_last: bool = False,
+                 shared_store: Optional[SharedTensorStore] = None):
+        super().__init__(model_path)
+        self.precision = resolve_precision(precision, device)
+        self.channels_last = channels_last
+
+        if shared_store is not None and optimize:
+            logging.warning("Frozen models can't share weights between workers, skipping optimization")
+            optimize = False
+        self.model = load_torchscript(model_path, device, optimize, self.precision, channels_last)
+        if shared_store is not None and device == 'cpu':
+            self.shared_key = f"{self.model_path.stem}-{file_hash(model_path)}-{self.tag}"
+            shared_store.share_module(self.model, self.shared_key)
+
+    @property
+    def tag(self) -> str:
+        return precision_tag(self.precision, self.channels_last)
+
+    def __call__(self, inputs: torch.Tensor) -> Tuple[torch.Tensor, ...]:
+        if self.channels_last and inputs.dim() == 4:
+            inputs = inputs.contiguous(memory_format=torch.channels_last)
+        with torch.no_grad(), autocast(self.precision):
+            return to_float32(self.model(inputs))
+
+class OnnxRuntimeBackend(InferenceBackend):
+    """
+    ONNX Runtime CPU session over a model exported with scripts/export_onnx.py,
+    with all graph optimizations enabled
+    """
+
+    name = "onnx"
+
+    def __init__(self, model_path: Union[str, Path], intra_op_threads: int = 0):
+        super().__init__(model_path)
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise ImportError("The onnx inference backend requires the onnxruntime package")
+
+        start_time = time.time()
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        self.session = ort.InferenceSession(str(model_path), options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        logging.info(f"ONNX Runtime session for {self.model_path.name} created in {time.time() - start_time:.2f} seconds")
+
+    def __call__(self, inputs: torch.Tensor) -> Tuple[torch.Tensor, ...]:
+        outputs = self.session.run(None, {self.input_name: inputs.detach().cpu().numpy().astype(np.float32)})
+        return tuple(torch.from_numpy(output) for output in outputs)
+
+def onnx_path_for(model_path: Union[str, Path], onnx_dir: Optional[Union[str, Path]] = None) -> Path:
+    """
+    Location of a model's ONNX export, named by the hash of the .ts file it was
+    exported from, so a refreshed model is never served with the graph of the
+    one it replaced. Exports are kept in onnx_dir (next to the .ts file without
+    one), where every copy of the same .ts file finds the same export
+    """
+    model_path = Path(model_path)
+    return Path(onnx_dir or model_path.parent) / f"{model_path.stem}.{file_hash(model_path)}.onnx"
+
+def export_onnx(model_path: Union[str, Path], onnx_path: Union[str, Path], onnx_input: OnnxInput,
+                opset: int = 17) -> Path:
+    """
+    Export a TorchScript model to ONNX. The file is written under a temporary
+    name first, so other workers never load a partial export
+
+    Args:
+        model_path: Path of the .ts model
+        onnx_path: Where to write the export
+        onnx_input: Example input shape and dynamic axes
+        opset: ONNX opset version
+
+    Returns:
+        onnx_path
+    """
+    shape, dynamic_axes = onnx_input
+    model = torch.jit.load(str(model_path), map_location="cpu")
+    model.eval()
+    onnx_path = Path(onnx_path)
+    onnx_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = onnx_path.with_name(f"{onnx_path.name}.{os.getpid()}.tmp")
+    start_time = time.time()
+    torch.onnx.export(
+        model, (torch.zeros(shape),), str(tmp_path),
+        input_names=["input"], dynamic_axes=dynamic_axes, opset_version=opset, dynamo=False
+    )
+    os.replace(tmp_path, onnx_path)
+    logging.info(f"Exported {onnx_path.name} in {time.time() - start_time:.2f} seconds")
+    return onnx_path
+
+def ensure_onnx_export(model_path: Union[str, Path], onnx_input: OnnxInput,
+                       onnx_dir: Optional[Union[str, Path]] = None) -> Path:
+    """The ONNX export of a model, exported first if this .ts file has none yet"""
+    onnx_path = onnx_path_for(model_path, onnx_dir)
+    if not onnx_path.exists():
+        logging.warning(f"No ONNX export of {Path(model_path).name} yet, exporting it (check its parity with scripts/export_onnx.py)")
+        export_onnx(model_path, onnx_path, onnx_input)
+    return onnx_path
+
+def load_backend(model_path: Union[str, Path], backend: str = 'torchscript', device: str = 'cpu',
+                 optimize: bool = False, precision: str = 'fp32', channels_last: bool = False,
+                 shared_store: Optional[SharedTensorStore] = None, onnx_dir: Optional[Union[str, Path]] = None,
+                 onnx_input: Optional[OnnxInput] = None) -> InferenceBackend:
+    """
+    Create the inference backend for a model
+
+    Args:
+        model_path: Path of the .ts model (the onnx backend loads its export, see onnx_path_for)
+        backend: "torchscript" or "onnx"
+        device: Device to run on (onnx runs on CPU only)
+        optimize, precision, channels_last: TorchScript options, see load_torchscript
+        shared_store: Map TorchScript weights from this store (shared by all workers)
+        onnx_dir: Directory of the ONNX exports
+        onnx_input: Example input shape and dynamic axes to export the model
+            with if it has no export yet (a missing export is an error without)
+
+    Returns:
+        The backend, ready to be called
+    """
+    if backend == 'torchscript':
+        return TorchScriptBackend(model_path, device, optimize, precision, channels_last, shared_store)
+    if backend == 'onnx':
+        if device != 'cpu' or precision != 'fp32' or channels_last:
+            logging.warning("The onnx backend runs fp32 on CPU, ignoring device/precision options")
+        if onnx_input is not None:
+            return OnnxRuntimeBackend(ensure_onnx_export(model_path, onnx_input, onnx_dir))
+        onnx_path = onnx_path_for(model_path, onnx_dir)
+        if not onnx_path.exists():
+            raise FileNotFoundError(f"{onnx_path} not found, export {Path(model_path).name} with scripts/export_onnx.py")
+        return OnnxRuntimeBackend(onnx_path)
+    raise ValueError(f"Unknown inference backend: {backend}")
@@ -0,0 +1,161 @@
+import hashlib
+import logging
+import os
+import time
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Any, Callable, Dict, Tuple, Union
+import torch
+
+PRECISIONS = ("fp32", "int8", "bf16")
+
+# Hashes already computed, by (resolved path, size, mtime)
+_file_hashes: Dict[Tuple[str, int, int], str] = {}
+
+def file_hash(path: Union[str, Path], chunk_size: int = 1 << 20) -> str:
+    """
+    Short SHA-256 content hash of a file. Computed once per file version and
+    reused by the optimizer, the shared weight store and the embedding cache
+    """
+    stat = os.stat(path)
+    key = (str(Path(path).resolve()), stat.st_size, stat.st_mtime_ns)
+    if key not in _file_hashes:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+        _file_hashes[key] = digest.hexdigest()[:16]
+    return _file_hashes[key]
+
+def bf16_supported() -> bool:
+    """Whether this CPU has native bfloat16 kernels (AVX512-BF16 / AMX)"""
+    try:
+        return torch.backends.mkldnn.is_available() and torch.ops.mkldnn._is_mkldnn_bf16_supported()
+    except Exception:
+        return False
+
+def resolve_precision(precision: str, device: str = 'cpu') -> str:
+    """Validate a precision mode, falling back to fp32 where it can't run"""
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown inference precision: {precision}")
+    if device != 'cpu' and precision != 'fp32':
+        logging.warning(f"{precision} inference is only supported on CPU, using fp32")
+        return 'fp32'
+    if precision == 'bf16' and not bf16_supported():
+        logging.warning("CPU has no native bfloat16 support, using fp32")
+        return 'fp32'
+    return precision
+
+def precision_tag(precision: str = 'fp32', channels_last: bool = False) -> str:
+    """Short name of a precision mode, e.g. "int8-cl" """
+    return f"{precision}-cl" if channels_last else precision
+
+def optimized_path_for(model_path: Union[str, Path], source_hash: str, tag: str = 'fp32') -> Path:
+    """
+    Location of the optimized artifact next to the source model. Frozen graphs
+    are only valid for the torch build that produced them, so its version is
+    part of the name.
+    """
+    model_path = Path(model_path)
+    torch_version = torch.__version__.split('+')[0]
+    return model_path.with_name(f"{model_path.stem}.opt-{source_hash}-{tag}-torch{torch_version}.ts")
+
+def autocast(precision: str):
+    """Context to run a forward pass in, bf16 autocast for "bf16" """
+    if precision == 'bf16':
+        return torch.autocast('cpu', dtype=torch.bfloat16)
+    return nullcontext()
+
+def to_float32(outputs: Any) -> Any:
+    """Cast the floating point tensors of a (nested tuple) model output back to float32"""
+    if isinstance(outputs, (tuple, list)):
+        return type(outputs)(to_float32(value) for value in outputs)
+    if isinstance(outputs, torch.Tensor) and outputs.is_floating_point() and outputs.dtype != torch.float32:
+        return outputs.float()
+    return outputs
+
+def _convert(model: torch.jit.ScriptModule, precision: str, channels_last: bool) -> torch.jit.ScriptModule:
+    if precision == 'int8':
+        # Dynamic quantization: int8 weights for Linear layers, activations quantized on the fly
+        from torch.ao.quantization import quantize_dynamic_jit, default_dynamic_qconfig
+        try:
+            model = quantize_dynamic_jit(model, {'': default_dynamic_qconfig})
+        except Exception as e:
+            logging.warning(f"Dynamic quantization failed, keeping fp32 weights: {e}")
+    if channels_last:
+        model = model.to(memory_format=torch.channels_last)
+    return model
+
+def load_torchscript(model_path: Union[str, Path], device: str = 'cpu', optimize: bool = False,
+                     precision: str = 'fp32', channels_last: bool = False) -> torch.jit.ScriptModule:
+    """
+    Load a TorchScript model for inference
+
+    With optimize, the module is frozen and run through
+    torch.jit.optimize_for_inference. The result is saved next to the source
+    model, keyed by its content hash and precision mode, so later boots load
+    it directly. Models that can't be frozen are used as loaded.
+
+    Args:
+        model_path: Path of the .ts model
+        device: Device to load the model on
+        optimize: Freeze and optimize the module
+        precision: "fp32", "int8" (dynamic quantization) or "bf16" (weights stay
+            fp32, run forward passes under autocast(precision))
+        channels_last: Store convolution weights in channels_last format
+
+    Returns:
+        The module, in eval mode
+    """
+    if not optimize:
+        model = torch.jit.load(str(model_path), map_location=device)
+        model.eval()
+        return _convert(model, precision, channels_last)
+
+    start_time = time.time()
+    artifact_path = optimized_path_for(model_path, file_hash(model_path), precision_tag(precision, channels_last))
+    if artifact_path.exists():
+        try:
+            model = torch.jit.load(str(artifact_path), map_location=device)
+            model.eval()
+            logging.info(f"Loaded optimized model {artifact_path.name} in {time.time() - start_time:.2f} seconds")
+            return model
+        except Exception as e:
+            logging.warning(f"Failed to load optimized model {artifact_path}: {e}")
+
+    model = torch.jit.load(str(model_path), map_location=device)
+    model.eval()
+    model = _convert(model, precision, channels_last)
+    try:
+        optimized = torch.jit.optimize_for_inference(torch.jit.freeze(model))
+    except Exception as e:
+        logging.warning(f"Could not optimize {Path(model_path).name}, using it as loaded: {e}")
+        return model
+
+    # Write to a temporary name first so concurrent workers never load a partial file
+    try:
+        tmp_path = artifact_path.with_name(f"{artifact_path.name}.{os.getpid()}.tmp")
+        torch.jit.save(optimized, str(tmp_path))
+        os.replace(tmp_path, artifact_path)
+    except Exception as e:
+        logging.warning(f"Failed to save optimized model to {artifact_path}: {e}")
+
+    logging.info(f"Optimized {Path(model_path).name} in {time.time() - start_time:.2f} seconds")
+    return optimized
+
+def warmup(name: str, run: Callable[[], object], iterations: int = 2) -> float:
+    """
+    Run a model a few times so TorchScript profiling and fusion happen before
+    the first request, logging each pass
+
+    Returns:
+        Total warmup time in seconds
+    """
+    total = 0.0
+    for i in range(iterations):
+        start_time = time.time()
+        run()
+        elapsed = time.time() - start_time
+        total += elapsed
+        logging.info(f"{name} warmup pass {i + 1}/{iterations}: {elapsed * 1000:.1f} ms")
+    return total
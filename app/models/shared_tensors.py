@@ -0,0 +1,142 @@
+import fcntl
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Dict, IO, Iterable, Union
+import torch
+
+# Shared lock per store file this process maps, so no other worker deletes it
+_held_locks: Dict[Path, IO] = {}
+
+class SharedTensorStore:
+    """
+    Read-only, memory-mapped copies of model weights shared by every worker
+    process.
+
+    The first worker to load a model writes its parameters and buffers to one
+    file per model in the store directory (tmpfs /dev/shm by default). Every
+    worker then memory-maps that file and points the module's tensors at it,
+    so the weights live once in the page cache instead of once per worker.
+    Frozen modules have their weights inlined as constants and can't be shared.
+
+    Every worker holds a shared lock on the files it maps; prune() deletes
+    the files no worker holds, so old model versions don't stay in tmpfs.
+    """
+
+    def __init__(self, directory: Union[str, Path] = "/dev/shm/fishai"):
+        self.directory = Path(directory)
+
+    def share_module(self, module: torch.nn.Module, key: str) -> int:
+        """
+        Replace the module's parameters and buffers with memory-mapped shared copies
+
+        Args:
+            module: Loaded module (TorchScript or eager)
+            key: Identifies the weights, e.g. source model hash and precision
+
+        Returns:
+            Number of bytes now backed by the shared file
+        """
+        start_time = time.time()
+        tensors = self._named_tensors(module)
+        if not tensors:
+            return 0
+
+        path = self.directory / f"{key}.pt"
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._hold(path)
+        if not path.exists():
+            # Write to a temporary name first so other workers never map a partial file
+            tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+            torch.save({name: tensor.detach().contiguous() for name, tensor in tensors.items()}, str(tmp_path))
+            os.replace(tmp_path, path)
+
+        shared = torch.load(str(path), map_location="cpu", mmap=True, weights_only=True)
+        nbytes = 0
+        with torch.no_grad():
+            for name, tensor in tensors.items():
+                source = shared.get(name)
+                if source is None or source.shape != tensor.shape or source.dtype != tensor.dtype:
+                    continue
+                tensor.data = source
+                nbytes += source.element_size() * source.numel()
+
+        logging.info(f"Mapped {nbytes / 2**20:.1f} MB of shared weights from {path.name} in {time.time() - start_time:.2f} seconds")
+        return nbytes
+
+    def prune(self, keep: Iterable[str] = ()):
+        """
+        Drop this process's hold on every key not in keep, then delete the
+        shared files that no worker holds any more
+
+        Args:
+            keep: Keys still used by this process
+        """
+        keep_paths = {self.directory / f"{key}.pt" for key in keep}
+        for path in [path for path in _held_locks if path.parent == self.directory and path not in keep_paths]:
+            _held_locks.pop(path).close()
+
+        for path in self.directory.glob("*.pt"):
+            if path in keep_paths:
+                continue
+            with open(self._lock_path(path), "a") as f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    continue
+                try:
+                    freed = path.stat().st_size
+                    path.unlink()
+                except FileNotFoundError:
+                    continue
+                logging.info(f"Removed unused shared weights {path.name} ({freed / 2**20:.1f} MB)")
+
+    @staticmethod
+    def _lock_path(path: Path) -> Path:
+        return path.with_name(f"{path.name}.lock")
+
+    def _hold(self, path: Path):
+        # Blocks while a prune is deleting this file
+        if path not in _held_locks:
+            f = open(self._lock_path(path), "a")
+            fcntl.flock(f, fcntl.LOCK_SH)
+            _held_locks[path] = f
+
+    @staticmethod
+    def _named_tensors(module: torch.nn.Module) -> Dict[str, torch.Tensor]:
+        tensors = dict(module.named_parameters())
+        tensors.update(module.named_buffers())
+        return {name: tensor for name, tensor in tensors.items() if tensor.device.type == "cpu" and tensor.numel()}
+
+def load_mmap(path: Union[str, Path], map_location: str = "cpu"):
+    """
+    torch.load a file memory-mapped, so its tensors are shared through the
+    page cache by every process that loads it. Files in the legacy
+    (non-zip) format can't be mapped and are loaded normally.
+    """
+    try:
+        return torch.load(str(path), map_location=map_location, mmap=True)
+    except RuntimeError as e:
+        logging.warning(f"Can't memory-map {Path(path).name}, loading it into memory: {e}")
+        return torch.load(str(path), map_location=map_location)
+
+def process_memory(pid: Union[int, str] = "self") -> Dict[str, int]:
+    """
+    Resident (RSS), proportional (PSS) and unique (USS) set size of a
+    process in bytes, from /proc/<pid>/smaps_rollup (Linux only)
+    """
+    fields = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    fields[parts[0].rstrip(":")] = int(parts[1]) * 1024
+    except OSError:
+        return {}
+    return {
+        "rss": fields.get("Rss", 0),
+        "pss": fields.get("Pss", 0),
+        "uss": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)
+    }
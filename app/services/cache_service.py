@@ -1,103 +1,268 @@
+import asyncio
 import hashlib
 import json
 import time
-from typing import Optional, Dict, Any
-import redis
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Tuple, Callable, Awaitable
 import logging
 from ..utils.config import settings
 
 logger = logging.getLogger(__name__)
 
-class CacheService:
+class MemoryCache:
+    """
+    In-process LRU cache bounded by entry count and total bytes, with per-entry expiry.
+    Values are JSON strings, so their size is known and cached results can't be
+    modified by callers.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self.nbytes = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expiry = entry
+        if time.time() >= expiry:
+            self._remove(key)
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: str, ttl: int) -> bool:
+        self.delete(key)
+        if len(value) > self.max_bytes:
+            return False
+        self._entries[key] = (value, time.time() + ttl)
+        self.nbytes += len(value)
+
+        # Evict least recently used entries until both bounds hold
+        while len(self._entries) > self.max_entries or self.nbytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+        return True
+
+    def delete(self, key: str) -> bool:
+        if key not in self._entries:
+            return False
+        self._remove(key)
+        return True
+
+    def clear(self):
+        self._entries.clear()
+        self.nbytes = 0
+
+    def purge_expired(self) -> int:
+        """Drop every expired entry, returns how many were dropped"""
+        now = time.time()
+        expired = [key for key, (_, expiry) in self._entries.items() if expiry <= now]
+        for key in expired:
+            self._remove(key)
+        self.expirations += len(expired)
+        return len(expired)
+
+    def _remove(self, key: str):
+        value, _ = self._entries.pop(key)
+        self.nbytes -= len(value)
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one execution. Callers
+    that arrive while a call is in flight await its result instead of starting
+    their own. The call runs as its own task, so one caller being cancelled
+    doesn't fail the others; it is only cancelled once every caller is gone.
+    """
+
     def __init__(self):
-        self.redis_client = None
-        self.ttl = 3600  # 1 hour default TTL
-        self._init_redis()
+        self._calls: Dict[str, Tuple[asyncio.Task, List[int]]] = {}
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Run fn() for key, or join the call already in flight for it"""
+        call = self._calls.get(key)
+        if call is None:
+            task = asyncio.ensure_future(fn())
+            call = self._calls[key] = (task, [0])
+            task.add_done_callback(lambda _: self._forget(key, call))
+        else:
+            self.coalesced += 1
 
-    def _init_redis(self):
-        """Initialize Redis connection"""
+        task, waiters = call
+        waiters[0] += 1
         try:
-            self.redis_client = redis.Redis(
-                host=settings.REDIS_HOST,
-                port=settings.REDIS_PORT,
-                db=settings.REDIS_DB,
-                decode_responses=True
-            )
+            return await asyncio.shield(task)
+        finally:
+            waiters[0] -= 1
+            if waiters[0] == 0 and not task.done():
+                task.cancel()
+
+    def _forget(self, key: str, call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+class CacheService:
+    """
+    Identification result cache. Redis is used through an asyncio client with a
+    shared, bounded connection pool; when it is unreachable, results are kept in
+    a bounded in-memory LRU instead. A client can be passed in (e.g. a fake).
+    Concurrent identical lookups that miss are coalesced with coalesce().
+    """
+
+    def __init__(self, redis_client=None):
+        self.redis_client = redis_client
+        self.ttl = settings.CACHE_TTL_SECONDS
+        self._memory_cache = MemoryCache(settings.CACHE_MAX_ENTRIES, settings.CACHE_MAX_BYTES)
+        self._expiry_task = None
+        self._in_flight = SingleFlight()
+        self.hits = 0
+        self.misses = 0
+
+    async def connect(self):
+        """Connect to Redis, falling back to the in-memory cache if it is unreachable"""
+        try:
+            if self.redis_client is None:
+                import redis.asyncio as redis
+                self.redis_client = redis.Redis(
+                    host=settings.REDIS_HOST,
+                    port=settings.REDIS_PORT,
+                    db=settings.REDIS_DB,
+                    max_connections=settings.REDIS_MAX_CONNECTIONS,
+                    socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+                    socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT,
+                    decode_responses=True
+                )
             # Test connection
-            self.redis_client.ping()
+            await self.redis_client.ping()
             logger.info("Redis connection established")
         except Exception as e:
             logger.warning(f"Redis connection failed: {e}. Using in-memory cache.")
+            await self.close()
+
+    async def close(self):
+        """Close the Redis connection pool"""
+        if self.redis_client is not None:
+            try:
+                await self.redis_client.aclose()
+            except Exception as e:
+                logger.warning(f"Error closing Redis connection: {e}")
             self.redis_client = None
-            self._memory_cache = {}
 
-    def _generate_key(self, image_data: bytes) -> str:
-        """Generate a unique key for the image data"""
-        return hashlib.sha256(image_data).hexdigest()
+    def _generate_key(self, image_data: bytes, version: str = "") -> str:
+        """Generate a unique key for the image data, namespaced by model version"""
+        digest = hashlib.sha256(image_data).hexdigest()
+        return f"{version}:{digest}" if version else digest
+
+    def key_for(self, image_data: bytes, version: str = "") -> str:
+        """Cache key of an image (content hash namespaced by model version)"""
+        return self._generate_key(image_data, version)
 
-    async def get_cached_result(self, image_data: bytes) -> Optional[Dict[str, Any]]:
+    async def coalesce(self, image_data: bytes, compute: Callable[[], Awaitable[Dict[str, Any]]], version: str = "") -> Dict[str, Any]:
+        """
+        Compute a result for an image, sharing the computation with any
+        concurrent caller for the same image and model version
+
+        Args:
+            image_data: Raw image bytes
+            compute: Coroutine function producing the result
+            version: Model version the result belongs to
+
+        Returns:
+            The result of compute(), as produced by whichever caller ran it
+        """
+        return await self._in_flight.do(self._generate_key(image_data, version), compute)
+
+    async def get_cached_result(self, image_data: bytes, version: str = "") -> Optional[Dict[str, Any]]:
         """Get cached identification result for an image"""
+        return (await self.get_many([image_data], version))[0]
+
+    async def cache_result(self, image_data: bytes, result: Dict[str, Any], ttl: Optional[int] = None, version: str = "") -> bool:
+        """Cache identification result for an image"""
+        return await self.set_many([(image_data, result)], ttl, version)
+
+    async def get_many(self, images: List[bytes], version: str = "") -> List[Optional[Dict[str, Any]]]:
+        """
+        Get cached results for several images in one round trip (MGET)
+
+        Args:
+            images: Raw image bytes
+            version: Model version the results must belong to
+
+        Returns:
+            One result per image, None where nothing is cached
+        """
+        if not images:
+            return []
         try:
-            key = self._generate_key(image_data)
-            
+            keys = [self._generate_key(image_data, version) for image_data in images]
+
             if self.redis_client:
-                # Try Redis first
-                cached = self.redis_client.get(key)
-                if cached:
-                    return json.loads(cached)
+                cached = await self.redis_client.mget(keys)
             else:
-                # Fallback to memory cache
-                if key in self._memory_cache:
-                    result, expiry = self._memory_cache[key]
-                    if time.time() < expiry:
-                        return result
-                    else:
-                        del self._memory_cache[key]
-            
-            return None
-            
+                cached = [self._memory_cache.get(key) for key in keys]
+
+            results = [json.loads(value) if value else None for value in cached]
+            hits = sum(1 for result in results if result is not None)
+            self.hits += hits
+            self.misses += len(results) - hits
+            return results
+
         except Exception as e:
             logger.error(f"Cache retrieval error: {e}")
-            return None
+            self.misses += len(images)
+            return [None] * len(images)
 
-    async def cache_result(self, image_data: bytes, result: Dict[str, Any], ttl: Optional[int] = None) -> bool:
-        """Cache identification result for an image"""
+    async def set_many(self, items: List[Tuple[bytes, Dict[str, Any]]], ttl: Optional[int] = None, version: str = "") -> bool:
+        """
+        Cache several results in one round trip (pipelined SETEX)
+
+        Args:
+            items: (image bytes, result) pairs
+            ttl: Expiry in seconds (defaults to the service TTL)
+            version: Model version the results belong to
+        """
+        if not items:
+            return True
         try:
-            key = self._generate_key(image_data)
             expiry = ttl or self.ttl
-            
+            entries = [(self._generate_key(image_data, version), json.dumps(result)) for image_data, result in items]
+
             if self.redis_client:
                 # Store in Redis
-                return self.redis_client.setex(
-                    key,
-                    expiry,
-                    json.dumps(result)
-                )
+                async with self.redis_client.pipeline(transaction=False) as pipe:
+                    for key, value in entries:
+                        pipe.setex(key, expiry, value)
+                    return all(await pipe.execute())
             else:
                 # Store in memory
-                self._memory_cache[key] = (
-                    result,
-                    time.time() + expiry
-                )
-                return True
-                
+                return all([self._memory_cache.set(key, value, expiry) for key, value in entries])
+
         except Exception as e:
             logger.error(f"Cache storage error: {e}")
             return False
 
-    async def invalidate_cache(self, image_data: bytes) -> bool:
+    async def invalidate_cache(self, image_data: bytes, version: str = "") -> bool:
         """Remove cached result for an image"""
         try:
-            key = self._generate_key(image_data)
-            
+            key = self._generate_key(image_data, version)
+
             if self.redis_client:
-                return bool(self.redis_client.delete(key))
+                return bool(await self.redis_client.delete(key))
             else:
-                if key in self._memory_cache:
-                    del self._memory_cache[key]
-                    return True
-                return False
-                
+                return self._memory_cache.delete(key)
+
         except Exception as e:
             logger.error(f"Cache invalidation error: {e}")
             return False
@@ -106,14 +271,49 @@ class CacheService:
         """Clear all cached results"""
         try:
             if self.redis_client:
-                return bool(self.redis_client.flushdb())
+                return bool(await self.redis_client.flushdb())
             else:
                 self._memory_cache.clear()
                 return True
-                
+
         except Exception as e:
             logger.error(f"Cache clear error: {e}")
             return False
 
-# Create singleton instance
-cache_service = CacheService() 
\ No newline at end of file
+    def start_expiry_task(self, interval: float):
+        """Start purging expired in-memory entries every interval seconds"""
+        if self._expiry_task is None or self._expiry_task.done():
+            self._expiry_task = asyncio.get_running_loop().create_task(self._expire_periodically(interval))
+
+    def stop_expiry_task(self):
+        if self._expiry_task is not None:
+            self._expiry_task.cancel()
+            self._expiry_task = None
+
+    async def _expire_periodically(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            purged = self._memory_cache.purge_expired()
+            if purged:
+                logger.debug(f"Purged {purged} expired cache entries")
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit, miss and eviction counters"""
+        return {
+            "backend": "redis" if self.redis_client else "memory",
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self._in_flight.coalesced,
+            "in_flight": len(self._in_flight),
+            "evictions": self._memory_cache.evictions,
+            "expirations": self._memory_cache.expirations,
+            "entries": len(self._memory_cache),
+            "bytes": self._memory_cache.nbytes
+        }
+
+# Built on first use through the service registry
+def __getattr__(name):
+    if name == "cache_service":
+        from .registry import services
+        return services.get("cache")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,153 @@
+import asyncio
+import logging
+from concurrent.futures import Executor
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class ClassificationBatcher:
+    """
+    Micro-batching scheduler in front of FishClassifier.
+
+    Crops submitted by concurrent requests are queued and classified together
+    in one batched forward pass. A batch is dispatched as soon as it reaches
+    max_batch_size crops or max_wait_ms has passed since its first crop arrived.
+    A group submitted through classify_batch always stays in one batch, even
+    when it is larger than max_batch_size.
+    """
+
+    def __init__(self, classifier, max_batch_size: int = 16, max_wait_ms: float = 2.0,
+                 executor: Optional[Executor] = None):
+        self.classifier = classifier
+        self.executor = executor
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._carry = None
+        self._dispatched: List[Tuple[List[np.ndarray], int, asyncio.Future]] = []
+
+    async def classify(self, image_np: np.ndarray, top_k: int = 3) -> List[Dict[str, Any]]:
+        """
+        Classify a single crop as part of the next batch
+
+        Args:
+            image_np: RGB crop as a numpy array
+            top_k: Number of species to return
+
+        Returns:
+            Classifications for this crop, as returned by FishClassifier.classify
+        """
+        results = await self.classify_batch([image_np], top_k)
+        return results[0]
+
+    async def classify_batch(self, images_np: List[np.ndarray], top_k: int = 3) -> List[List[Dict[str, Any]]]:
+        """
+        Classify a group of crops (e.g. all fish of one image) in the same batch
+
+        Args:
+            images_np: RGB crops as numpy arrays
+            top_k: Number of species to return per crop
+
+        Returns:
+            One list of classifications per crop, in input order
+        """
+        if not images_np:
+            return []
+
+        self._ensure_worker()
+        future = self._loop.create_future()
+        await self._queue.put((list(images_np), top_k, future))
+        return await future
+
+    def close(self):
+        """Stop the dispatch loop, failing every request still waiting for its results"""
+        pending = list(self._dispatched)
+        if self._carry is not None:
+            pending.append(self._carry)
+        while self._queue is not None and not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        error = RuntimeError("Classification batcher closed")
+        for _, _, future in pending:
+            if not future.done():
+                future.set_exception(error)
+
+        if self._worker is not None:
+            self._worker.cancel()
+        self._worker = None
+        self._carry = None
+        self._dispatched = []
+        self._queue = None
+        self._loop = None
+
+    def _ensure_worker(self):
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done() or self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._carry = None
+            self._worker = loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            batch = await self._collect_batch()
+            await self._classify_batch(batch)
+
+    async def _collect_batch(self) -> List[Tuple[List[np.ndarray], int, asyncio.Future]]:
+        # A group that did not fit into the previous batch opens the next one
+        if self._carry is not None:
+            first, self._carry = self._carry, None
+        else:
+            first = await self._queue.get()
+
+        batch = [first]
+        size = len(first[0])
+        deadline = self._loop.time() + self.max_wait
+
+        while size < self.max_batch_size:
+            try:
+                item = self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                remaining = deadline - self._loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+
+            # Groups are never split across batches
+            if size + len(item[0]) > self.max_batch_size:
+                self._carry = item
+                break
+            batch.append(item)
+            size += len(item[0])
+
+        return batch
+
+    async def _classify_batch(self, batch: List[Tuple[List[np.ndarray], int, asyncio.Future]]):
+        crops = [image_np for images_np, _, _ in batch for image_np in images_np]
+        top_k = max(k for _, k, _ in batch)
+
+        self._dispatched = batch
+        try:
+            results = await self._loop.run_in_executor(self.executor, self.classifier.classify_batch, crops, top_k)
+        except Exception as e:
+            logger.error(f"Batched classification of {len(crops)} crops failed: {e}")
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self._dispatched = []
+
+        logger.debug(f"Classified batch of {len(crops)} crops from {len(batch)} callers")
+        offset = 0
+        for images_np, k, future in batch:
+            group_results = results[offset:offset + len(images_np)]
+            offset += len(images_np)
+            if not future.done():
+                future.set_result([result[:k] for result in group_results])
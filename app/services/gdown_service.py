@@ -1,90 +1,168 @@
 import os
+import json
+import shutil
+import hashlib
 import logging
-import gdown
+import threading
+import urllib.error
+import urllib.request
 from pathlib import Path
 from typing import Optional, Dict, Any
-import requests
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+
+MANIFEST_NAME = "manifest.json"
+
+def sha256_file(path: Path, chunk_size: int = 1 << 20) -> str:
+    """SHA-256 hex digest of a file"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
 
 class GDownService:
     """
-    Simplified service for downloading files from Google Drive using gdown
+    Simplified service for downloading files from Google Drive using gdown.
+
+    Plain http(s) and file URLs are downloaded directly, so a local server or
+    directory can stand in for Drive. Downloads go to "<name>.part" and resume
+    from where an interrupted attempt stopped. A file is renamed into place only
+    after its SHA-256 has been checked against the expected hash, if one is
+    configured, and recorded in manifest.json. Cached files are used only
+    when they still match their manifest entry.
     """
-    
-    def __init__(self, cache_dir: str = "cache/models"):
+
+    def __init__(self, cache_dir: str = "cache/models", expected_hashes: Optional[Dict[str, str]] = None,
+                 retries: int = 3, timeout: float = 60.0):
         self.cache_dir = Path(cache_dir)
         self.cache_dir.mkdir(parents=True, exist_ok=True)
-        
+        self.expected_hashes = expected_hashes or {}
+        self.retries = max(1, retries)
+        self.timeout = timeout
+        self._manifest_lock = threading.Lock()
+
         # Store file paths after download
         self.downloaded_files: Dict[str, Path] = {}
-    
+
     def download_file_from_url(self, url: str, filename: str) -> Optional[Path]:
         """
-        Download a file from Google Drive using gdown
-        
+        Download a file from Google Drive using gdown (or from an http(s)/file URL)
+
         Args:
-            url: Google Drive sharing URL
+            url: Google Drive sharing URL, http(s) URL, file URL or local path
             filename: Name to save the file as
-            
+
         Returns:
             Path to downloaded file or None if failed
         """
         try:
             file_path = self.cache_dir / filename
-            
-            # Check if file already exists
-            if file_path.exists():
-                logging.info(f"File already exists: {filename}")
-                self.downloaded_files[filename] = file_path
-                return file_path
-            
-            logging.info(f"Downloading {filename} from Google Drive...")
-            
-            # Download using gdown
-            output_path = gdown.download(url, str(file_path), quiet=False, fuzzy=True)
-            
-            if output_path and Path(output_path).exists():
-                self.downloaded_files[filename] = Path(output_path)
-                logging.info(f"Successfully downloaded: {filename}")
-                return Path(output_path)
+
+            # Check if a verified copy already exists
+            cached_path = self.get_cached_file(filename)
+            if cached_path:
+                return cached_path
+
+            part_path = file_path.with_name(f"{file_path.name}.part")
+            for attempt in range(1, self.retries + 1):
+                try:
+                    logging.info(f"Downloading {filename} (attempt {attempt}/{self.retries})...")
+                    self.fetch(url, part_path)
+                    break
+                except Exception as e:
+                    logging.warning(f"Download of {filename} interrupted: {e}")
             else:
                 logging.error(f"Failed to download {filename}")
                 return None
-                
+
+            digest = sha256_file(part_path)
+            expected = self.expected_hashes.get(filename)
+            if expected and digest != expected.lower():
+                logging.error(f"Checksum mismatch for {filename}: expected {expected}, got {digest}")
+                part_path.unlink()
+                return None
+
+            size = part_path.stat().st_size
+            os.replace(part_path, file_path)
+            self._record(filename, {"sha256": digest, "size": size, "url": url})
+            self.downloaded_files[filename] = file_path
+            logging.info(f"Successfully downloaded: {filename} ({size / 2**20:.1f} MB, sha256 {digest[:12]})")
+            return file_path
+
         except Exception as e:
             logging.error(f"Error downloading {filename}: {e}")
             return None
-    
+
     def download_file_from_id(self, file_id: str, filename: str) -> Optional[Path]:
         """
         Download a file from Google Drive using file ID
-        
+
         Args:
             file_id: Google Drive file ID
             filename: Name to save the file as
-            
+
         Returns:
             Path to downloaded file or None if failed
         """
         url = f"https://drive.google.com/uc?id={file_id}"
         return self.download_file_from_url(url, filename)
-    
+
     def get_cached_file(self, filename: str) -> Optional[Path]:
         """
-        Get cached file if it exists
-        
+        Get cached file if it exists and matches its manifest entry
+
         Args:
             filename: Name of the file
-            
+
         Returns:
-            Path to cached file or None if not found
+            Path to cached file or None if not found or not verified
         """
         file_path = self.cache_dir / filename
-        if file_path.exists():
-            logging.info(f"Using cached file: {filename}")
-            self.downloaded_files[filename] = file_path
-            return file_path
-        return None
-    
+        if not file_path.exists():
+            return None
+
+        entry = self._load_manifest().get(filename)
+        expected = self.expected_hashes.get(filename)
+        if entry is None:
+            logging.warning(f"Cached {filename} has no manifest entry, downloading it again")
+            return None
+        if file_path.stat().st_size != entry["size"]:
+            logging.warning(f"Cached {filename} has the wrong size, downloading it again")
+            return None
+        if sha256_file(file_path) != entry["sha256"] or (expected and entry["sha256"] != expected.lower()):
+            logging.warning(f"Cached {filename} failed checksum verification, downloading it again")
+            return None
+
+        logging.info(f"Using cached file: {filename}")
+        self.downloaded_files[filename] = file_path
+        return file_path
+
+    def link_from(self, other: "GDownService", filename: str) -> Optional[Path]:
+        """
+        Hard-link a downloaded file from another cache directory (on the same
+        filesystem) into this one, replacing the current file atomically
+
+        Args:
+            other: Service whose cache directory holds the file
+            filename: Name of the file
+
+        Returns:
+            Path to the linked file or None if other has no manifest entry for it
+        """
+        entry = other._load_manifest().get(filename)
+        if entry is None:
+            return None
+
+        file_path = self.cache_dir / filename
+        tmp_path = self.cache_dir / f".{filename}.{os.getpid()}.tmp"
+        tmp_path.unlink(missing_ok=True)
+        os.link(other.cache_dir / filename, tmp_path)
+        os.replace(tmp_path, file_path)
+        self._record(filename, entry)
+        self.downloaded_files[filename] = file_path
+        return file_path
+
     def clear_cache(self):
         """Clear all cached files"""
         for file in self.cache_dir.glob("*"):
@@ -92,12 +170,81 @@ class GDownService:
                 file.unlink()
         self.downloaded_files.clear()
         logging.info("Cache cleared")
-    
+
     def get_downloaded_files(self) -> Dict[str, Path]:
         """Get all downloaded file paths"""
         return self.downloaded_files.copy()
-    
+
     def verify_file_exists(self, filename: str) -> bool:
         """Verify if a file exists in cache"""
         file_path = self.cache_dir / filename
-        return file_path.exists() 
\ No newline at end of file
+        return file_path.exists()
+
+    def fetch(self, url: str, part_path: Path):
+        """Download url into part_path, continuing a partial download if there is one"""
+        parsed = urlparse(url)
+        if parsed.scheme in ("", "file"):
+            self._copy_local(Path(url2pathname(parsed.path)), part_path)
+        elif "drive.google.com" in parsed.netloc or "docs.google.com" in parsed.netloc:
+            import gdown
+            # gdown keeps its own partial file next to the output and resumes from
+            # it; a finished but unverified output would be mistaken for one
+            part_path.unlink(missing_ok=True)
+            output = gdown.download(url, str(part_path), quiet=False, fuzzy=True, resume=True)
+            if not output or not Path(output).exists():
+                raise IOError("gdown did not produce a file")
+        elif parsed.scheme in ("http", "https"):
+            self._download_http(url, part_path)
+        else:
+            raise ValueError(f"Unsupported URL scheme: {parsed.scheme}")
+
+    def _download_http(self, url: str, part_path: Path, chunk_size: int = 1 << 20):
+        offset = part_path.stat().st_size if part_path.exists() else 0
+        request = urllib.request.Request(url, headers={"Range": f"bytes={offset}-"} if offset else {})
+        try:
+            response = urllib.request.urlopen(request, timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+            # 416: the partial file is already complete
+            if e.code == 416 and offset:
+                return
+            raise
+
+        with response:
+            # Servers that ignore Range send the whole file again
+            resumed = offset and response.status == 206
+            if offset and not resumed:
+                logging.info(f"Server does not support resume, restarting {part_path.name}")
+            with open(part_path, "ab" if resumed else "wb") as f:
+                shutil.copyfileobj(response, f, chunk_size)
+
+            expected_size = response.headers.get("Content-Length")
+            if expected_size is not None:
+                received = part_path.stat().st_size - (offset if resumed else 0)
+                if received != int(expected_size):
+                    raise IOError(f"Connection closed after {received} of {expected_size} bytes")
+
+    def _copy_local(self, source: Path, part_path: Path, chunk_size: int = 1 << 20):
+        offset = part_path.stat().st_size if part_path.exists() else 0
+        if offset > source.stat().st_size:
+            offset = 0
+        with open(source, "rb") as src, open(part_path, "ab" if offset else "wb") as dst:
+            src.seek(offset)
+            shutil.copyfileobj(src, dst, chunk_size)
+
+    def _load_manifest(self) -> Dict[str, Any]:
+        manifest_path = self.cache_dir / MANIFEST_NAME
+        try:
+            with open(manifest_path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _record(self, filename: str, entry: Dict[str, Any]):
+        """Add a file to the manifest (written atomically)"""
+        with self._manifest_lock:
+            manifest = self._load_manifest()
+            manifest[filename] = entry
+            tmp_path = self.cache_dir / f"{MANIFEST_NAME}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(manifest, f, indent=2)
+            os.replace(tmp_path, self.cache_dir / MANIFEST_NAME)
@@ -4,14 +4,11 @@ import os
 from PIL import Image
 import io
 import numpy as np
-import tensorflow as tf
 import json
 from pathlib import Path
 from ..utils.config import settings
-from .species_service import species_service
-from .regulations_service import regulations_service
-from .image_processor import image_processor
 from .image_processor import preprocess_for_model
+from .registry import services
 
 class IdentificationResult(BaseModel):
     species_id: str
@@ -48,6 +45,8 @@ class IdentificationService:
         try:
             model_path = Path(settings.MODEL_PATH)
             if model_path.exists():
+                # TensorFlow is only imported when there is a Keras model to load
+                import tensorflow as tf
                 self.model = tf.keras.models.load_model(str(model_path))
                 print(f"Loaded model from {model_path}")
             else:
@@ -80,10 +79,10 @@ class IdentificationService:
                     species_id = self.reverse_class_mapping.get(str(class_idx))
                     
                     if species_id:
-                        species_info = species_service.get_species(species_id)
+                        species_info = services.species.get_species(species_id)
                         if species_info:
                             # Get regulations for this species
-                            regulations = regulations_service.get_regulations(species_id)
+                            regulations = services.regulations.get_regulations(species_id)
                             
                             results.append(IdentificationResult(
                                 species_id=species_id,
@@ -122,5 +121,9 @@ class IdentificationService:
             print(f"Error training model: {e}")
             raise
 
-# Create a singleton instance
-identification_service = IdentificationService() 
\ No newline at end of file
+# Built on first use through the service registry
+def __getattr__(name):
+    if name == "identification_service":
+        from .registry import services
+        return services.get("identification")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
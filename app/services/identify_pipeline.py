@@ -0,0 +1,183 @@
+"""
+Per-image identification pipeline shared by the API and process pool workers.
+"""
+
+import io
+import logging
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
+from PIL import Image
+from ..utils.util import extract_fish_region, extract_box_region
+from ..utils.config import settings
+
+def decode_image(image_data: bytes, min_side: int = 0) -> Tuple[np.ndarray, float]:
+    """
+    Decode an upload to an RGB array, letting the JPEG decoder downscale it
+
+    Args:
+        image_data: Raw image bytes
+        min_side: Smallest acceptable shorter side after reduction (0 disables it)
+
+    Returns:
+        Tuple of (decoded image, original width / decoded width)
+    """
+    image = Image.open(io.BytesIO(image_data))
+    original_width = image.size[0]
+
+    # draft() only picks a JPEG scale (1/2, 1/4, 1/8) that keeps both sides >= the requested size
+    if min_side and image.format == "JPEG" and min(image.size) > min_side:
+        image.draft("RGB", (min_side, min_side))
+
+    image_np = np.array(image.convert("RGB"))
+    return image_np, original_width / image_np.shape[1]
+
+def segment_image(segmenter, image_data: bytes, filename: str, crop_mode: Optional[str] = None) -> Tuple[np.ndarray, Optional[List[int]], Optional[List[np.ndarray]]]:
+    """
+    Decode an upload and cut out its fish regions
+
+    Args:
+        segmenter: FishSegmenter instance
+        image_data: Raw image bytes
+        filename: Upload name, used for logging
+        crop_mode: "masks" or "boxes" (defaults to settings.SEGMENTATION_CROP_MODE)
+
+    Returns:
+        Tuple of (decoded image, ids of the kept fish, fish crops). The ids and crops
+        are None when segmentation found nothing usable and the whole image should
+        be classified instead.
+    """
+    min_side = max(settings.DECODE_MIN_SIDE, segmenter.min_size) if settings.DECODE_MIN_SIDE else 0
+    image_np, scale = decode_image(image_data, min_side)
+
+    print(f"[DEBUG] Processing {filename}, shape={image_np.shape}, decode scale={scale:.2f}")
+
+    if len(image_np.shape) != 3:
+        raise ValueError("Image must be RGB")
+
+    # Minimum crop size is in original image pixels
+    min_region = 50 / scale
+
+    if (crop_mode or settings.SEGMENTATION_CROP_MODE) == "boxes":
+        return image_np, *_crop_boxes(segmenter, image_np, filename, min_region)
+
+    polygons, masks = segmenter.segment(image_np, source_scale=scale)
+    print(f"[DEBUG] Segmented {len(polygons)} fish in {filename}")
+
+    # Fallback if no valid fish masks or polygons
+    if not polygons or not masks or len(polygons) != len(masks):
+        print("[DEBUG] No valid segmentation. Falling back to whole image classification.")
+        return image_np, None, None
+
+    fish_ids = []
+    fish_regions = []
+    for i, (polygon, mask) in enumerate(zip(polygons, masks)):
+        try:
+            fish_region = extract_fish_region(image_np, mask)
+            print(f"[DEBUG] Fish region shape: {fish_region.shape}")
+            if fish_region.shape[0] < min_region or fish_region.shape[1] < min_region:
+                print(f"[DEBUG] Skipping small fish region in {filename}")
+                continue
+
+            fish_ids.append(i)
+            fish_regions.append(fish_region)
+        except Exception as e:
+            logging.error(f"Error processing fish {i}: {e}")
+            continue
+
+    return image_np, fish_ids, fish_regions
+
+def _crop_boxes(segmenter, image_np: np.ndarray, filename: str, min_region: float) -> Tuple[Optional[List[int]], Optional[List[np.ndarray]]]:
+    boxes = segmenter.detect_boxes(image_np)
+    print(f"[DEBUG] Detected {len(boxes)} fish boxes in {filename}")
+
+    if not boxes:
+        print("[DEBUG] No valid segmentation. Falling back to whole image classification.")
+        return None, None
+
+    fish_ids = []
+    fish_regions = []
+    for i, box in enumerate(boxes):
+        fish_region = extract_box_region(image_np, box, min_size=min_region)
+        if fish_region is None:
+            print(f"[DEBUG] Skipping small fish region in {filename}")
+            continue
+
+        print(f"[DEBUG] Fish region shape: {fish_region.shape}")
+        fish_ids.append(i)
+        fish_regions.append(fish_region)
+
+    return fish_ids, fish_regions
+
+def build_file_result(filename: str, fish_ids: Optional[List[int]], batch_classifications: List[List[Dict[str, Any]]]) -> Dict[str, Any]:
+    """
+    Build the per-file result from the classifications of its crops
+
+    Args:
+        filename: Upload name
+        fish_ids: Ids of the classified fish, or None for whole-image fallback
+        batch_classifications: One list of classifications per crop
+
+    Returns:
+        Per-file result in the /api/identify batch_results format
+    """
+    if fish_ids is None:
+        classifications = batch_classifications[0] if batch_classifications else []
+        if not classifications or all(c['common_name'] == "Unknown" for c in classifications):
+            print(f"[INFO] No confident fallback classification for {filename}")
+            return {
+                "filename": filename,
+                "success": True,
+                "total_fish_detected": 0,
+                "detections": []
+            }
+        return {
+            "filename": filename,
+            "success": True,
+            "total_fish_detected": 1,
+            "detections": [{
+                "fish_id": 0,
+                "bounding_box": None,
+                "polygon": None,
+                "classifications": classifications,
+                "mask_area": None
+            }]
+        }
+
+    detections = []
+    for i, classifications in zip(fish_ids, batch_classifications):
+        if not classifications or all(c['common_name'] == "Unknown" for c in classifications):
+            print(f"[DEBUG] No valid classification for fish {i} in {filename}")
+
+        print(f"[DEBUG] Classifications for fish {i} in {filename}:")
+        for c in classifications:
+            print(f"  → {c['common_name']} ({c['confidence']:.4f}) via {c['method']}")
+
+        detections.append({
+            "fish_id": i,
+            "classifications": classifications
+        })
+
+    return {
+        "filename": filename,
+        "success": True,
+        "total_fish_detected": len(detections),
+        "detections": detections
+    }
+
+def identify_image(segmenter, classifier, image_data: bytes, filename: str, top_k: int = 3) -> Dict[str, Any]:
+    """
+    Run decode, segmentation and classification for one upload synchronously
+
+    Args:
+        segmenter: FishSegmenter instance
+        classifier: FishClassifier instance
+        image_data: Raw image bytes
+        filename: Upload name
+        top_k: Number of species per fish
+
+    Returns:
+        Per-file result in the /api/identify batch_results format
+    """
+    image_np, fish_ids, fish_regions = segment_image(segmenter, image_data, filename)
+    crops = [image_np] if fish_ids is None else fish_regions
+    return build_file_result(filename, fish_ids, classifier.classify_batch(crops, top_k))
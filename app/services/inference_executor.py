@@ -0,0 +1,79 @@
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+class InferenceQueueFull(Exception):
+    """Raised when no more requests can be admitted for inference"""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Inference queue is full")
+        self.retry_after = retry_after
+
+class InferenceExecutor:
+    """
+    Dedicated, bounded thread pool for CPU-heavy model inference.
+
+    Blocking work (decoding, segmentation, classification) runs on this pool
+    so the event loop stays free for other endpoints. At most max_queue_depth
+    requests are admitted at once; further requests are rejected immediately
+    instead of piling up behind the running ones.
+    """
+
+    def __init__(self, max_workers: int = 2, max_queue_depth: int = 16, retry_after: int = 2):
+        self.max_workers = max(1, max_workers)
+        self.max_queue_depth = max(1, max_queue_depth)
+        self.retry_after = retry_after
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="inference")
+
+        # Only touched from the event loop thread
+        self._active = 0
+        self._rejected = 0
+
+    def acquire(self):
+        """
+        Admit one request
+
+        Raises:
+            InferenceQueueFull: If max_queue_depth requests are already admitted
+        """
+        if self._active >= self.max_queue_depth:
+            self._rejected += 1
+            raise InferenceQueueFull(self.retry_after)
+        self._active += 1
+
+    def release(self):
+        """Release a request admitted with acquire()"""
+        self._active = max(0, self._active - 1)
+
+    @asynccontextmanager
+    async def admit(self):
+        """Admit a request for the duration of the block"""
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """Run a blocking function on the inference pool and await its result"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+
+    def stats(self) -> Dict[str, int]:
+        """Get current queue statistics"""
+        return {
+            "workers": self.max_workers,
+            "max_queue_depth": self.max_queue_depth,
+            "active_requests": self._active,
+            "rejected_requests": self._rejected
+        }
+
+    def shutdown(self):
+        """Stop the pool without waiting for queued work"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        logger.info("Inference executor shut down")
@@ -0,0 +1,209 @@
+"""
+Blue/green model reloads. A ModelGeneration is one loaded set of models;
+requests hold the generation they started on until they finish, so a reload
+can build and warm a new generation in the background, swap it in at once,
+and retire the old one, which is closed when its last request is done.
+"""
+
+import os
+import time
+import asyncio
+import logging
+import threading
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+class ModelGeneration:
+    """
+    The classifier, segmenter replicas, batcher and (optional) process pool
+    loaded from one set of model files, with the version their cached
+    results are stored under. Only touched from the event loop thread.
+    """
+
+    def __init__(self, version: str, model_paths: Dict[str, Path], classifier, segmenter_pool,
+                 classification_batcher, process_pool=None):
+        self.version = version
+        self.model_paths = dict(model_paths)
+        self.classifier = classifier
+        self.segmenter_pool = segmenter_pool
+        self.segmenter = segmenter_pool.replicas[0]
+        self.classification_batcher = classification_batcher
+        self.process_pool = process_pool
+        self.loaded_at = time.time()
+
+        self._active = 0
+        self._drained = asyncio.Event()
+        self._drained.set()
+        self._retired = False
+        self._on_closed: Optional[Callable[[], None]] = None
+
+    @property
+    def closed(self) -> bool:
+        return self.classifier is None
+
+    @property
+    def model_dir(self) -> Path:
+        """Directory the model files were loaded from"""
+        return Path(self.model_paths["classification_model.ts"]).parent
+
+    def shared_keys(self) -> Set[str]:
+        """Keys of the weights this generation maps from the shared tensor store"""
+        if self.closed:
+            return set()
+        backends = [self.classifier.model] + [segmenter.model for segmenter in self.segmenter_pool.replicas]
+        return {backend.shared_key for backend in backends if backend.shared_key}
+
+    def acquire(self):
+        """Hold this generation for a request"""
+        self._active += 1
+        self._drained.clear()
+
+    def release(self):
+        """Release a request held with acquire()"""
+        self._active = max(0, self._active - 1)
+        if self._active == 0:
+            self._drained.set()
+            if self._retired:
+                self.close()
+
+    @contextmanager
+    def use(self):
+        """Hold this generation for the duration of the block"""
+        self.acquire()
+        try:
+            yield self
+        finally:
+            self.release()
+
+    def retire(self, on_closed: Optional[Callable[[], None]] = None):
+        """
+        Close this generation once no request holds it (right away if none
+        does). on_closed is called after it is closed
+        """
+        self._retired = True
+        self._on_closed = on_closed
+        if self._active == 0:
+            self.close()
+
+    async def drain(self, timeout: float) -> bool:
+        """
+        Wait until no request holds this generation
+
+        Returns:
+            False if requests were still running after timeout seconds
+        """
+        try:
+            await asyncio.wait_for(self._drained.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            logger.warning(f"Model version {self.version} still has {self._active} requests after {timeout}s")
+            return False
+
+    def close(self):
+        """Stop the batcher and process pool and drop the models"""
+        if self.closed:
+            return
+        self.classification_batcher.close()
+        if self.process_pool is not None:
+            self.process_pool.shutdown()
+        self.classifier = self.segmenter = self.segmenter_pool = None
+        self.classification_batcher = self.process_pool = None
+        logger.info(f"Model version {self.version} closed")
+        if self._on_closed is not None:
+            self._on_closed()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "loaded_at": self.loaded_at,
+            "active_requests": self._active,
+            "retired": self._retired,
+        }
+
+def rescore_summary(previous_classifier, classifier) -> Dict[str, int]:
+    """
+    Re-score the crop embeddings cached for the new classifier against the
+    previous and the new database and count the crops whose top species
+    changed. Embeddings stay valid across database and category changes, so
+    this needs no forward passes.
+    """
+    before = previous_classifier.rescore_cached(top_k=1)
+    after = classifier.rescore_cached(top_k=1)
+
+    def top_species(result):
+        return result[0]['scientific_name'] if result else None
+
+    changed = sum(1 for key, result in after.items() if key in before and top_species(before[key]) != top_species(result))
+    return {"rescored": len(after), "top_species_changed": changed}
+
+def _lower_priority(niceness: int):
+    # Linux applies the nice value to the calling thread only
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), niceness)
+    except (AttributeError, OSError) as e:
+        logger.warning(f"Can't lower the model reload thread priority: {e}")
+
+class ModelReloader:
+    """
+    Runs model reloads in the background, one at a time. Blocking steps
+    (downloading, loading, warming up) run on a single thread with a lowered
+    priority. Work that thread hands to torch's intra-op thread pool runs at
+    normal priority.
+    """
+
+    def __init__(self, niceness: int = 10):
+        self.executor = ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix="model-reload",
+            initializer=_lower_priority if niceness > 0 else None,
+            initargs=(niceness,) if niceness > 0 else ()
+        )
+        self._task: Optional[asyncio.Task] = None
+        self._status: Dict[str, Any] = {"state": "idle", "reloads": 0}
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self, reload: Callable[[], Awaitable[Any]]) -> bool:
+        """
+        Start reload() as a background task. What it returns is reported
+        as "result" in stats()
+
+        Returns:
+            False if a reload is already running
+        """
+        if self.running:
+            return False
+        self._status.update(state="running", started_at=time.time(), finished_at=None, error=None)
+        self._task = asyncio.get_running_loop().create_task(self._run(reload))
+        return True
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """Run a blocking step of a reload on the reload thread and await its result"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+
+    async def _run(self, reload: Callable[[], Awaitable[Any]]):
+        try:
+            result = await reload()
+            self._status.update(state="succeeded", reloads=self._status["reloads"] + 1, result=result)
+        except Exception as e:
+            logger.error(f"Model reload failed: {e}")
+            self._status.update(state="failed", error=str(e))
+        finally:
+            self._status["finished_at"] = time.time()
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self._status)
+
+    def shutdown(self):
+        """Cancel a running reload and stop the reload thread"""
+        if self._task is not None:
+            self._task.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,238 @@
+"""
+Content-addressed model store shared by every worker process, and by every
+container that mounts the same volume.
+
+Files are stored once under objects/sha256/<hash> and never modified. A ref
+per source URL records which object it resolved to. Downloads are guarded by
+a file lock per URL, so when several processes start together exactly one
+downloads while the others wait on the lock and then use its result. flock
+locks are honoured across containers sharing a local or bind-mounted volume
+on one host; network filesystems may not support them.
+
+Every process holds a shared lock on the objects it uses. prune() deletes
+the objects that no ref points to and no process holds.
+"""
+
+import os
+import json
+import fcntl
+import hashlib
+import logging
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional, Dict, Any, Callable, IO, Iterable
+
+from .gdown_service import sha256_file
+
+# Shared lock per object this process uses, so no other process deletes it
+_held_objects: Dict[Path, IO] = {}
+
+class ModelStore:
+    """
+    Args:
+        root: Store directory (a volume shared between containers)
+        fetch: Callable(url, part_path) that downloads url into part_path,
+            continuing a partial download if there is one
+        retries: Download attempts per file
+        verify: Re-hash objects every time they are used, not only when stored
+    """
+
+    def __init__(self, root: str, fetch: Callable[[str, Path], None], retries: int = 3, verify: bool = False):
+        self.root = Path(root)
+        self.fetch_url = fetch
+        self.retries = max(1, retries)
+        self.verify = verify
+        for name in ("objects/sha256", "refs", "locks", "tmp"):
+            (self.root / name).mkdir(parents=True, exist_ok=True)
+
+    def object_path(self, digest: str) -> Path:
+        return self.root / "objects" / "sha256" / digest
+
+    def fetch(self, url: str, filename: str, expected_hash: Optional[str] = None) -> Optional[Path]:
+        """
+        Get the stored object for url, downloading it if no process has yet
+
+        Args:
+            url: Source URL of the file
+            filename: Model file name, for logging
+            expected_hash: SHA-256 the file must have, if known
+
+        Returns:
+            Path to the object or None if the download failed
+        """
+        expected_hash = expected_hash.lower() if expected_hash else None
+        if expected_hash:
+            path = self._existing(expected_hash)
+            if path:
+                logging.info(f"Using stored {filename} (sha256 {expected_hash[:12]})")
+                return path
+
+        ref = hashlib.sha256(url.encode()).hexdigest()[:24]
+        # Blocks while another process downloads this URL
+        with self._locked(ref, fcntl.LOCK_SH):
+            path = self._resolve(ref, expected_hash)
+        if path:
+            logging.info(f"Using stored {filename} ({path.name[:12]})")
+            return path
+
+        with self._locked(ref, fcntl.LOCK_EX):
+            # Another process may have finished it while we waited for the lock
+            path = self._resolve(ref, expected_hash)
+            if path:
+                logging.info(f"Using stored {filename} ({path.name[:12]}), downloaded by another process")
+                return path
+            return self._download(url, filename, ref, expected_hash)
+
+    def forget(self, url: str):
+        """Drop the ref of url so the next fetch downloads it again (objects are kept)"""
+        ref = hashlib.sha256(url.encode()).hexdigest()[:24]
+        with self._locked(ref, fcntl.LOCK_EX):
+            (self.root / "refs" / f"{ref}.json").unlink(missing_ok=True)
+
+    def prune(self, keep: Iterable[Path] = ()) -> int:
+        """
+        Drop this process's hold on every object not in keep, then delete the
+        objects that no ref points to and no process holds
+
+        Args:
+            keep: Objects (or links to them) still used by this process
+
+        Returns:
+            Number of objects deleted
+        """
+        objects_dir = (self.root / "objects" / "sha256").resolve()
+        keep = {Path(path).resolve() for path in keep}
+        for path in [path for path in _held_objects if path.parent == objects_dir and path not in keep]:
+            _held_objects.pop(path).close()
+
+        referenced = set()
+        for ref_path in (self.root / "refs").glob("*.json"):
+            try:
+                with open(ref_path, "r") as f:
+                    referenced.add(json.load(f)["sha256"])
+            except (OSError, ValueError, KeyError):
+                continue
+
+        removed = 0
+        for object_path in objects_dir.iterdir():
+            if object_path.name in referenced or object_path in keep:
+                continue
+            try:
+                with open(object_path, "rb") as f:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    size = object_path.stat().st_size
+                    object_path.unlink()
+            except OSError:
+                # In use by another process, or already deleted
+                continue
+            removed += 1
+            logging.info(f"Removed unused stored object {object_path.name[:12]} ({size / 2**20:.1f} MB)")
+        return removed
+
+    def _download(self, url: str, filename: str, ref: str, expected_hash: Optional[str]) -> Optional[Path]:
+        part_path = self.root / "tmp" / f"{ref}.part"
+        for attempt in range(1, self.retries + 1):
+            try:
+                logging.info(f"Downloading {filename} into the model store (attempt {attempt}/{self.retries})...")
+                self.fetch_url(url, part_path)
+                break
+            except Exception as e:
+                logging.warning(f"Download of {filename} interrupted: {e}")
+        else:
+            logging.error(f"Failed to download {filename}")
+            return None
+
+        digest = sha256_file(part_path)
+        if expected_hash and digest != expected_hash:
+            logging.error(f"Checksum mismatch for {filename}: expected {expected_hash}, got {digest}")
+            part_path.unlink()
+            return None
+
+        # Objects are read-only; the same content from another URL is stored once
+        object_path = self.object_path(digest)
+        if self._hold(object_path):
+            part_path.unlink()
+        else:
+            os.chmod(part_path, 0o444)
+            # Held before it's in place, so no prune deletes it before its ref is written
+            self._hold(part_path, object_path)
+            os.replace(part_path, object_path)
+
+        size = object_path.stat().st_size
+        self._write_ref(ref, {"url": url, "filename": filename, "sha256": digest, "size": size})
+        logging.info(f"Stored {filename} ({size / 2**20:.1f} MB, sha256 {digest[:12]})")
+        return object_path
+
+    def _resolve(self, ref: str, expected_hash: Optional[str]) -> Optional[Path]:
+        try:
+            with open(self.root / "refs" / f"{ref}.json", "r") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if expected_hash and entry["sha256"] != expected_hash:
+            logging.warning(f"Stored {entry['filename']} does not have the expected hash, downloading it again")
+            return None
+        return self._existing(entry["sha256"], entry.get("size"))
+
+    def _existing(self, digest: str, size: Optional[int] = None) -> Optional[Path]:
+        """The object with this hash, if it exists and is intact"""
+        object_path = self.object_path(digest)
+        if not self._hold(object_path):
+            return None
+        if size is not None and object_path.stat().st_size != size:
+            logging.warning(f"Stored object {digest[:12]} has the wrong size, ignoring it")
+            return None
+        # Objects are hashed before they're stored and never written again
+        if self.verify and sha256_file(object_path) != digest:
+            logging.warning(f"Stored object {digest[:12]} failed checksum verification, ignoring it")
+            return None
+        return object_path
+
+    def _write_ref(self, ref: str, entry: Dict[str, Any]):
+        tmp_path = self.root / "refs" / f"{ref}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(entry, f, indent=2)
+        os.replace(tmp_path, self.root / "refs" / f"{ref}.json")
+
+    def _hold(self, path: Path, object_path: Optional[Path] = None) -> bool:
+        """
+        Hold an object for the life of this process (path is the file to
+        lock, if it isn't at object_path yet)
+
+        Returns:
+            False if the object doesn't exist
+        """
+        key = (object_path or path).resolve()
+        if key in _held_objects:
+            return True
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            return False
+        # Blocks while a prune is deleting it
+        fcntl.flock(f, fcntl.LOCK_SH)
+        if not path.exists():
+            f.close()
+            return False
+        _held_objects[key] = f
+        return True
+
+    @contextmanager
+    def _locked(self, ref: str, operation: int):
+        with open(self.root / "locks" / f"{ref}.lock", "a") as f:
+            fcntl.flock(f, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+def link_into(object_path: Path, link_path: Path) -> Path:
+    """
+    Point link_path at a stored object (replacing whatever was there atomically),
+    so files derived from a model are still written next to its usual name
+    """
+    tmp_path = link_path.with_name(f".{link_path.name}.{os.getpid()}.link")
+    tmp_path.unlink(missing_ok=True)
+    os.symlink(object_path.resolve(), tmp_path)
+    os.replace(tmp_path, link_path)
+    return link_path
@@ -1,13 +1,14 @@
 import os
 import numpy as np
-import tensorflow as tf
-from tensorflow.keras import layers, models, applications
-from tensorflow.keras.preprocessing.image import ImageDataGenerator
 from pathlib import Path
 import logging
-from typing import Tuple, Dict, List
+from typing import Tuple, Dict, List, TYPE_CHECKING
 from ..utils.config import settings
-from .species_service import species_service
+
+# TensorFlow is imported by the methods that train, not when the module loads
+if TYPE_CHECKING:
+    import tensorflow as tf
+    from tensorflow.keras.preprocessing.image import ImageDataGenerator
 
 logger = logging.getLogger(__name__)
 
@@ -18,8 +19,11 @@ class ModelTrainer:
         self.reverse_class_mapping: Dict[int, str] = {}
         self.training_data_dir = Path(settings.TRAINING_DATA_DIR)
         
-    def _create_model(self, num_classes: int) -> tf.keras.Model:
+    def _create_model(self, num_classes: int) -> "tf.keras.Model":
         """Create a CNN model for fish identification"""
+        import tensorflow as tf
+        from tensorflow.keras import layers, models, applications
+
         # Use MobileNetV2 as the base model
         base_model = applications.MobileNetV2(
             input_shape=settings.MODEL_INPUT_SIZE + (3,),
@@ -49,8 +53,10 @@ class ModelTrainer:
         
         return model
     
-    def _create_data_generators(self) -> Tuple[ImageDataGenerator, ImageDataGenerator]:
+    def _create_data_generators(self) -> Tuple["ImageDataGenerator", "ImageDataGenerator"]:
         """Create data generators for training and validation"""
+        from tensorflow.keras.preprocessing.image import ImageDataGenerator
+
         # Data augmentation for training
         train_datagen = ImageDataGenerator(
             rescale=1./255,
@@ -101,6 +107,8 @@ class ModelTrainer:
     
     def train(self) -> None:
         """Train the fish identification model"""
+        import tensorflow as tf
+
         try:
             # Create class mapping
             self._create_class_mapping()
@@ -170,6 +178,8 @@ class ModelTrainer:
     
     def evaluate(self, test_data_dir: str = None) -> Dict[str, float]:
         """Evaluate the trained model"""
+        from tensorflow.keras.preprocessing.image import ImageDataGenerator
+
         if not self.model:
             raise ValueError("Model not trained yet")
             
@@ -203,5 +213,9 @@ class ModelTrainer:
             logger.error(f"Error during model evaluation: {e}")
             raise
 
-# Create singleton instance
-model_trainer = ModelTrainer() 
\ No newline at end of file
+# Built on first use through the service registry
+def __getattr__(name):
+    if name == "model_trainer":
+        from .registry import services
+        return services.get("model_trainer")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
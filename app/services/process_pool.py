@@ -0,0 +1,119 @@
+"""
+Process pool that identifies the files of one upload in parallel.
+Each worker process loads the TorchScript models once, in its initializer.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Per-process models, set by _init_worker
+_worker_classifier = None
+_worker_segmenter = None
+
+def _init_worker(model_paths: Dict[str, str], indexes_path: str, device: str,
+                 classifier_options: Dict[str, Any], torch_threads: int, mmap_database: bool):
+    global _worker_classifier, _worker_segmenter
+    import torch
+    from ..models.fish_classifier import FishClassifier
+    from ..models.fish_segmenter import FishSegmenter
+    from ..models.embedding_cache import EmbeddingCache
+    from ..utils.config import settings
+    from ..utils.model_config import get_segmenter_options, get_shared_store
+
+    torch.set_num_threads(torch_threads)
+
+    embedding_cache = None
+    if settings.EMBEDDING_CACHE_MAX_ENTRIES > 0:
+        embedding_cache = EmbeddingCache(settings.EMBEDDING_CACHE_MAX_ENTRIES)
+
+    _worker_classifier = FishClassifier(
+        model_path=model_paths["classification_model.ts"],
+        data_set_path=model_paths["embedding_database.pt"],
+        indexes_path=indexes_path,
+        device=device,
+        embedding_cache=embedding_cache,
+        optimize=settings.MODEL_OPTIMIZE,
+        shared_store=get_shared_store(),
+        mmap_database=mmap_database,
+        **classifier_options
+    )
+    _worker_segmenter = FishSegmenter(
+        model_path=model_paths["segmentation_model.ts"],
+        device=device,
+        optimize=settings.MODEL_OPTIMIZE,
+        shared_store=get_shared_store(),
+        **get_segmenter_options()
+    )
+    if settings.MODEL_WARMUP_ITERATIONS > 0:
+        _worker_segmenter.warmup(settings.MODEL_WARMUP_ITERATIONS)
+        _worker_classifier.warmup(settings.MODEL_WARMUP_ITERATIONS)
+
+def _worker_ready() -> bool:
+    return _worker_classifier is not None and _worker_segmenter is not None
+
+def _identify_in_worker(image_data: bytes, filename: str, top_k: int) -> Dict[str, Any]:
+    from .identify_pipeline import identify_image
+    try:
+        return identify_image(_worker_segmenter, _worker_classifier, image_data, filename, top_k)
+    except Exception as e:
+        return {"error": str(e), "filename": filename}
+
+class IdentifyProcessPool:
+    """
+    Runs the full per-image pipeline for several uploads in parallel worker processes
+    """
+
+    def __init__(self, model_paths: Dict[str, str], indexes_path: str, device: str = "cpu",
+                 classifier_options: Optional[Dict[str, Any]] = None,
+                 max_workers: int = 2, torch_threads: int = 1, mmap_database: bool = False,
+                 start_method: str = "spawn"):
+        self.max_workers = max(1, max_workers)
+        self.torch_threads = max(1, torch_threads)
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context(start_method),
+            initializer=_init_worker,
+            initargs=(model_paths, indexes_path, device, classifier_options or {}, self.torch_threads, mmap_database)
+        )
+        logger.info(f"Identify process pool started with {self.max_workers} workers x {self.torch_threads} torch threads")
+
+    def warmup(self, wait: bool = False) -> List[Future]:
+        """
+        Start every worker so models are loaded before the first request
+
+        Args:
+            wait: Block until the workers have loaded their models
+
+        Returns:
+            One future per worker, done once it has loaded its models
+        """
+        futures = [self.executor.submit(_worker_ready) for _ in range(self.max_workers)]
+        if wait:
+            for future in futures:
+                future.result()
+        return futures
+
+    async def identify(self, image_data: bytes, filename: str, top_k: int = 3) -> Dict[str, Any]:
+        """
+        Identify fish in one upload on a worker process
+
+        Args:
+            image_data: Raw image bytes
+            filename: Upload name
+            top_k: Number of species per fish
+
+        Returns:
+            Per-file result in the /api/identify batch_results format
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, _identify_in_worker, image_data, filename, top_k)
+
+    def shutdown(self):
+        """Stop all worker processes"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        logger.info("Identify process pool shut down")
@@ -0,0 +1,87 @@
+"""
+Lazy service registry. Services are registered by import path and only
+imported and built the first time they are used, so importing the app doesn't
+pull in TensorFlow, Redis or reference data the serving process never needs.
+"""
+
+import importlib
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Union
+
+logger = logging.getLogger(__name__)
+
+class ServiceRegistry:
+    """
+    Builds each service on first use and keeps the instance. A factory is
+    either a callable or a "module:attribute" path to one, resolved relative
+    to this package when the module starts with a dot.
+    """
+
+    def __init__(self):
+        self._factories: Dict[str, Union[str, Callable[[], Any]]] = {}
+        self._instances: Dict[str, Any] = {}
+        self._build_seconds: Dict[str, float] = {}
+        self._lock = threading.RLock()
+
+    def register(self, name: str, factory: Union[str, Callable[[], Any]]):
+        """Register (or replace) the factory of a service, dropping any built instance"""
+        with self._lock:
+            self._factories[name] = factory
+            self._instances.pop(name, None)
+
+    def get(self, name: str) -> Any:
+        """Get a service, building it first if this is its first use"""
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+
+        with self._lock:
+            if name not in self._instances:
+                if name not in self._factories:
+                    raise KeyError(f"Unknown service: {name}")
+                start_time = time.time()
+                self._instances[name] = self._resolve(self._factories[name])()
+                self._build_seconds[name] = time.time() - start_time
+                logger.info(f"Service {name} built in {self._build_seconds[name]:.2f} seconds")
+            return self._instances[name]
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        try:
+            return self.get(name)
+        except KeyError:
+            raise AttributeError(name)
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._instances
+
+    def reset(self, name: str):
+        """Drop a built instance so the next use builds it again"""
+        with self._lock:
+            self._instances.pop(name, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """Which services are built, and how long each took"""
+        return {
+            name: {"loaded": name in self._instances, "build_seconds": round(self._build_seconds.get(name, 0.0), 3)}
+            for name in self._factories
+        }
+
+    @staticmethod
+    def _resolve(factory: Union[str, Callable[[], Any]]) -> Callable[[], Any]:
+        if callable(factory):
+            return factory
+        module_name, _, attribute = factory.partition(":")
+        module = importlib.import_module(module_name, package=__package__)
+        return getattr(module, attribute)
+
+services = ServiceRegistry()
+services.register("cache", ".cache_service:CacheService")
+services.register("species_index", ".species_index:load_species_index")
+services.register("species", ".species_service:SpeciesService")
+services.register("regulations", ".regulations_service:RegulationsService")
+services.register("identification", ".identification_service:IdentificationService")
+services.register("model_trainer", ".model_trainer:ModelTrainer")
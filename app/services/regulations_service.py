@@ -83,5 +83,9 @@ class RegulationsService:
                     
         return all_regs
 
-# Create a singleton instance
-regulations_service = RegulationsService() 
\ No newline at end of file
+# Built on first use through the service registry
+def __getattr__(name):
+    if name == "regulations_service":
+        from .registry import services
+        return services.get("regulations")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,35 @@
+import queue
+from contextlib import contextmanager
+from typing import Any, Callable, List
+
+class ReplicaPool:
+    """
+    Fixed set of model replicas shared by the inference threads. Each call
+    borrows a replica for its duration, so at most len(replicas) calls run at
+    once and no replica is used by two threads at a time.
+    """
+
+    def __init__(self, replicas: List[Any]):
+        if not replicas:
+            raise ValueError("ReplicaPool needs at least one replica")
+        self.replicas = list(replicas)
+        self._free: "queue.Queue[Any]" = queue.Queue()
+        for replica in self.replicas:
+            self._free.put(replica)
+
+    def __len__(self) -> int:
+        return len(self.replicas)
+
+    @contextmanager
+    def borrow(self):
+        """Borrow a free replica, waiting for one if all are busy"""
+        replica = self._free.get()
+        try:
+            yield replica
+        finally:
+            self._free.put(replica)
+
+    def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """Call fn(replica, *args, **kwargs) on a borrowed replica (blocking)"""
+        with self.borrow() as replica:
+            return fn(replica, *args, **kwargs)
@@ -0,0 +1,157 @@
+"""
+CPU thread topology for serving: how many uvicorn workers, model replicas per
+worker and torch threads per replica, and which cores each worker runs on.
+"""
+
+import logging
+import os
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SERVING_MODES = ("latency", "throughput")
+
+# Thread pools torch and its BLAS/OpenMP libraries size from the environment
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+
+def available_cores() -> List[int]:
+    """Cores this process may run on"""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+class ServingTopology:
+    """
+    Split of the available cores between workers, replicas and threads.
+
+    "latency" runs one model replica per worker with all of the worker's cores
+    as intra-op threads, so a single request finishes as fast as possible.
+    "throughput" runs several replicas per worker with a few threads each, so
+    concurrent requests don't contend for the same threads.
+    """
+
+    def __init__(self, mode: str = "latency", workers: int = 1, replicas: int = 1,
+                 intra_op_threads: int = 0, interop_threads: int = 1,
+                 cpu_affinity: bool = False, cores: Optional[List[int]] = None):
+        if mode not in SERVING_MODES:
+            raise ValueError(f"Unknown serving mode: {mode}")
+        self.mode = mode
+        self.cores = cores or available_cores()
+        self.workers = max(1, workers)
+        self.replicas = 1 if mode == "latency" else max(1, replicas)
+        self.interop_threads = max(1, interop_threads)
+        self.cpu_affinity = cpu_affinity
+
+        # Default: share the cores evenly, at least one thread per replica
+        fair_share = max(1, len(self.cores) // (self.workers * self.replicas))
+        self.intra_op_threads = intra_op_threads or fair_share
+
+    @classmethod
+    def from_settings(cls, settings) -> "ServingTopology":
+        return cls(
+            mode=settings.SERVING_MODE,
+            workers=settings.UVICORN_WORKERS,
+            replicas=settings.MODEL_REPLICAS,
+            intra_op_threads=settings.INTRA_OP_THREADS,
+            interop_threads=settings.INTEROP_THREADS,
+            cpu_affinity=settings.CPU_AFFINITY
+        )
+
+    @property
+    def total_threads(self) -> int:
+        return self.workers * self.replicas * self.intra_op_threads
+
+    def validate(self) -> bool:
+        """Log a warning when workers x replicas x threads oversubscribes the cores"""
+        if self.total_threads > len(self.cores):
+            logger.warning(
+                f"{self.workers} workers x {self.replicas} replicas x {self.intra_op_threads} threads = "
+                f"{self.total_threads} threads on {len(self.cores)} cores, the CPU is oversubscribed"
+            )
+            return False
+        return True
+
+    def export_environment(self):
+        """Size OpenMP/MKL thread pools for worker processes started after this call"""
+        for name in THREAD_ENV_VARS:
+            os.environ[name] = str(self.intra_op_threads)
+
+    def apply(self, slot: Optional[int] = None):
+        """
+        Configure torch threads in this worker process, and pin it to its share
+        of the cores when cpu_affinity is set
+
+        Args:
+            slot: This worker's index (claimed with claim_worker_slot() if None)
+        """
+        import torch
+        torch.set_num_threads(self.intra_op_threads)
+        try:
+            torch.set_num_interop_threads(self.interop_threads)
+        except RuntimeError as e:
+            # Only possible before the first parallel op in the process
+            logger.warning(f"Could not set interop threads: {e}")
+
+        if self.cpu_affinity and hasattr(os, "sched_setaffinity"):
+            if slot is None:
+                slot = claim_worker_slot(self.workers)
+            cores = self.worker_cores(slot)
+            os.sched_setaffinity(0, cores)
+            logger.info(f"Worker {slot} pinned to cores {cores}")
+
+    def worker_cores(self, slot: int) -> List[int]:
+        """Contiguous block of cores for a worker"""
+        per_worker = max(1, len(self.cores) // self.workers)
+        start = (slot % self.workers) * per_worker
+        return self.cores[start:start + per_worker] or self.cores
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "workers": self.workers,
+            "replicas": self.replicas,
+            "intra_op_threads": self.intra_op_threads,
+            "interop_threads": self.interop_threads,
+            "cores": len(self.cores),
+            "cpu_affinity": self.cpu_affinity
+        }
+
+# Held for the life of the worker so the slot's lock stays taken
+_slot_file = None
+
+def claim_worker_slot(workers: int, lock_dir: str = "/tmp/fishai-worker-slots") -> int:
+    """
+    Claim the lowest free worker index with an exclusive file lock. The lock is
+    released by the OS when the worker exits, so a restarted worker reclaims it.
+    """
+    global _slot_file
+    import fcntl
+
+    Path(lock_dir).mkdir(parents=True, exist_ok=True)
+    for slot in range(workers):
+        f = open(Path(lock_dir) / f"slot-{slot}.lock", "w")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            continue
+        _slot_file = f
+        return slot
+
+    logger.warning("No free worker slot, using slot 0")
+    return 0
+
+def configure_serving(settings) -> ServingTopology:
+    """
+    Validate the topology and export its thread settings for the worker
+    processes. Called by run.py and startup.py before starting uvicorn.
+    """
+    topology = ServingTopology.from_settings(settings)
+    topology.validate()
+    topology.export_environment()
+    logger.info(
+        f"Serving mode {topology.mode}: {topology.workers} workers x {topology.replicas} replicas "
+        f"x {topology.intra_op_threads} threads on {len(topology.cores)} cores"
+    )
+    return topology
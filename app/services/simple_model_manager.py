@@ -1,18 +1,43 @@
 import logging
 import os
+import time
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Callable, Iterable
 from .gdown_service import GDownService
+from .model_store import ModelStore, link_into
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
 
 class SimpleModelManager:
     """
-    Simplified model manager using gdown for Google Drive downloads
+    Simplified model manager using gdown for Google Drive downloads.
+
+    With a store_dir, files are downloaded once into a content-addressed
+    ModelStore shared by all workers (and containers mounting it), and the
+    cache directory only holds links to the stored objects.
     """
     
-    def __init__(self, cache_dir: str = "cache/models"):
+    def __init__(self, cache_dir: str = "cache/models", expected_hashes: Optional[Dict[str, str]] = None,
+                 max_workers: int = 3, retries: int = 3, store_dir: Optional[str] = None,
+                 store_verify: bool = False):
         self.cache_dir = Path(cache_dir)
         self.cache_dir.mkdir(parents=True, exist_ok=True)
-        self.gdown_service = GDownService(cache_dir)
+        self.max_workers = max_workers
+        self.retries = retries
+        self.expected_hashes = expected_hashes or {}
+        self.gdown_service = GDownService(cache_dir, expected_hashes=expected_hashes, retries=retries)
+        self.store = None
+        if store_dir:
+            self.store = ModelStore(store_dir, self.gdown_service.fetch, retries=retries, verify=store_verify)
         
         # Model file configurations
         self.model_configs = {
@@ -32,6 +57,7 @@ class SimpleModelManager:
         
         # Store file paths after download
         self.model_paths: Dict[str, Path] = {}
+        self._source_urls: Dict[str, str] = {}
     
     def setup_models_from_urls(self, model_urls: Dict[str, str]) -> bool:
         """
@@ -43,35 +69,9 @@ class SimpleModelManager:
         Returns:
             True if all models were downloaded successfully
         """
-        success = True
-        
-        for filename, url in model_urls.items():
-            if filename not in self.model_configs:
-                logging.warning(f"Unknown model file: {filename}")
-                continue
-            
-            # Check if already cached
-            cached_path = self.gdown_service.get_cached_file(filename)
-            if cached_path:
-                self.model_paths[filename] = cached_path
-                logging.info(f"Using cached model: {filename}")
-                continue
-            
-            # Download from Google Drive
-            logging.info(f"Downloading model: {filename}")
-            downloaded_path = self.gdown_service.download_file_from_url(url, filename)
-            
-            if downloaded_path:
-                self.model_paths[filename] = downloaded_path
-                logging.info(f"Successfully downloaded: {filename}")
-            else:
-                if self.model_configs[filename]["required"]:
-                    logging.error(f"Failed to download required model: {filename}")
-                    success = False
-                else:
-                    logging.warning(f"Failed to download optional model: {filename}")
-        
-        return success
+        if self.store is not None:
+            return self._setup_models(model_urls, self._download_to_store)
+        return self._setup_models(model_urls, self.gdown_service.download_file_from_url)
     
     def setup_models_from_file_ids(self, model_file_ids: Dict[str, str]) -> bool:
         """
@@ -83,33 +83,46 @@ class SimpleModelManager:
         Returns:
             True if all models were downloaded successfully
         """
-        success = True
-        
-        for filename, file_id in model_file_ids.items():
+        if self.store is not None:
+            model_urls = {filename: f"https://drive.google.com/uc?id={file_id}" for filename, file_id in model_file_ids.items()}
+            return self._setup_models(model_urls, self._download_to_store)
+        return self._setup_models(model_file_ids, self.gdown_service.download_file_from_id)
+    
+    def _download_to_store(self, url: str, filename: str) -> Optional[Path]:
+        """Fetch a file through the model store and link it into the cache directory"""
+        try:
+            object_path = self.store.fetch(url, filename, self.expected_hashes.get(filename))
+            if object_path is None:
+                return None
+            self._source_urls[filename] = url
+            return link_into(object_path, self.cache_dir / filename)
+        except Exception as e:
+            logging.error(f"Error getting {filename} from the model store: {e}")
+            return None
+    
+    def _setup_models(self, sources: Dict[str, str], download: Callable[[str, str], Optional[Path]]) -> bool:
+        """Verify or download every model file, all files concurrently"""
+        known = {}
+        for filename, source in sources.items():
             if filename not in self.model_configs:
                 logging.warning(f"Unknown model file: {filename}")
                 continue
-            
-            # Check if already cached
-            cached_path = self.gdown_service.get_cached_file(filename)
-            if cached_path:
-                self.model_paths[filename] = cached_path
-                logging.info(f"Using cached model: {filename}")
-                continue
-            
-            # Download from Google Drive
-            logging.info(f"Downloading model: {filename}")
-            downloaded_path = self.gdown_service.download_file_from_id(file_id, filename)
-            
-            if downloaded_path:
-                self.model_paths[filename] = downloaded_path
-                logging.info(f"Successfully downloaded: {filename}")
+            known[filename] = source
+        
+        # Cached files are verified (hashed) on the same threads as the downloads
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(known) or 1))) as pool:
+            futures = {filename: pool.submit(download, source, filename) for filename, source in known.items()}
+            results = {filename: future.result() for filename, future in futures.items()}
+        
+        success = True
+        for filename, path in results.items():
+            if path:
+                self.model_paths[filename] = path
+            elif self.model_configs[filename]["required"]:
+                logging.error(f"Failed to download required model: {filename}")
+                success = False
             else:
-                if self.model_configs[filename]["required"]:
-                    logging.error(f"Failed to download required model: {filename}")
-                    success = False
-                else:
-                    logging.warning(f"Failed to download optional model: {filename}")
+                logging.warning(f"Failed to download optional model: {filename}")
         
         return success
     
@@ -160,8 +173,84 @@ class SimpleModelManager:
         logging.info("All required models verified successfully")
         return True
     
+    def download_version(self, model_urls: Dict[str, str]) -> Optional["SimpleModelManager"]:
+        """
+        Download a fresh copy of every model file into its own versioned
+        directory, leaving the files in use untouched
+        
+        Args:
+            model_urls: Dictionary mapping filename to Google Drive sharing URL
+            
+        Returns:
+            Manager of the version directory, or None if a required file failed
+        """
+        version_dir = self.cache_dir / "versions" / f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+        version = SimpleModelManager(
+            str(version_dir),
+            expected_hashes=self.expected_hashes,
+            max_workers=self.max_workers,
+            retries=self.retries,
+            store_dir=str(self.store.root) if self.store is not None else None,
+            store_verify=self.store.verify if self.store is not None else False
+        )
+        
+        # Fetch the URLs again instead of reusing what they resolved to before
+        if self.store is not None:
+            for url in model_urls.values():
+                self.store.forget(url)
+        
+        if not version.setup_models_from_urls(model_urls) or not version.verify_models():
+            shutil.rmtree(version_dir, ignore_errors=True)
+            return None
+        return version
+    
+    def promote_version(self, version: "SimpleModelManager"):
+        """
+        Make a downloaded version the one this cache directory holds (and the
+        one the next start loads), replacing each file atomically
+        
+        Args:
+            version: Manager returned by download_version
+        """
+        for filename, path in version.model_paths.items():
+            if self.store is not None:
+                link_into(path, self.cache_dir / filename)
+            else:
+                self.gdown_service.link_from(version.gdown_service, filename)
+        self._source_urls.update(version._source_urls)
+        self.model_paths = version.get_all_model_paths()
+        logging.info(f"Model version {version.cache_dir.name} promoted")
+    
+    def prune_versions(self, keep: Iterable[Path] = ()):
+        """
+        Delete version directories not in keep, except those of other running
+        workers, then the stored objects that nothing uses any more
+        """
+        keep = {Path(path).resolve() for path in keep}
+        versions_dir = self.cache_dir / "versions"
+        if versions_dir.is_dir():
+            for version_dir in versions_dir.iterdir():
+                if version_dir.resolve() in keep:
+                    continue
+                pid = version_dir.name.rsplit("-", 1)[-1]
+                if pid.isdigit() and int(pid) != os.getpid() and _process_alive(int(pid)):
+                    continue
+                shutil.rmtree(version_dir, ignore_errors=True)
+        
+        if self.store is not None:
+            # The promoted files are loaded by the next start
+            in_use = [self.cache_dir / filename for filename in self.model_configs]
+            in_use += [path for version_dir in keep if version_dir.is_dir() for path in version_dir.iterdir()]
+            self.store.prune(keep=in_use)
+    
     def clear_cache(self):
         """Clear all cached model files"""
+        # Stored objects in use by other workers are kept
+        if self.store is not None:
+            for url in self._source_urls.values():
+                self.store.forget(url)
+            self._source_urls.clear()
+            self.store.prune()
         self.gdown_service.clear_cache()
         self.model_paths.clear()
         logging.info("Model cache cleared")
@@ -176,6 +265,7 @@ class SimpleModelManager:
         info = {
             "cache_directory": str(self.cache_dir),
             "download_method": "gdown",
+            "model_store": str(self.store.root) if self.store is not None else None,
             "models": {}
         }
         
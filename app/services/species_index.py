@@ -0,0 +1,95 @@
+import json
+from pathlib import Path
+from types import MappingProxyType
+from typing import List, Dict, Any, Mapping, Optional, Tuple, Union
+
+BASE_DIR = Path(__file__).parent.parent.parent.resolve()
+
+def _normalize(name: Optional[str]) -> str:
+    return (name or '').lower()
+
+def _first_positions(entries: List[Dict[str, Any]], field: str) -> Dict[str, int]:
+    positions = {}
+    for position, entry in enumerate(entries):
+        positions.setdefault(_normalize(entry.get(field, '')), position)
+    return positions
+
+class SpeciesIndex:
+    """
+    Hashed lookup of regulations and categories by normalized common or scientific name.
+
+    Lookups return the same entry a linear scan would: the first one whose common
+    name or scientific name matches. Response fragments (image_url + regulation)
+    are prebuilt for every known category so enriching a classification is a
+    single dict lookup. Fragments and the regulations inside them are shared
+    between responses and must not be modified.
+    """
+
+    def __init__(self, regulations: List[Dict[str, Any]], categories: Dict[str, Dict[str, Any]]):
+        self.regulations = regulations
+        self.categories = list(categories.values())
+
+        self._regulation_by_common = _first_positions(self.regulations, 'species')
+        self._regulation_by_scientific = _first_positions(self.regulations, 'latin_name')
+        self._category_by_common = _first_positions(self.categories, 'name')
+        self._category_by_scientific = _first_positions(self.categories, 'species_id')
+
+        self._fragments: Dict[Tuple[str, str], Mapping[str, Any]] = {}
+        for category in self.categories:
+            common_name, scientific_name = category.get('name', ''), category.get('species_id', '')
+            key = (_normalize(common_name), _normalize(scientific_name))
+            if key not in self._fragments:
+                self._fragments[key] = self._build_fragment(common_name, scientific_name)
+
+    @classmethod
+    def from_files(cls, regulations_path: Union[str, Path], categories_path: Union[str, Path]) -> "SpeciesIndex":
+        """Build the index from regulations.json and categories.json"""
+        with open(regulations_path, 'r', encoding='utf-8') as f:
+            regulations = json.load(f)["regulations"]
+        with open(categories_path, 'r', encoding='utf-8') as f:
+            categories = json.load(f)["categories"]
+        return cls(regulations, categories)
+
+    def find_regulation(self, common_name: str, scientific_name: str) -> Dict[str, Any]:
+        """Get the regulation for a species, or {} if there is none"""
+        position = self._lookup(self._regulation_by_common, self._regulation_by_scientific, common_name, scientific_name)
+        return self.regulations[position] if position is not None else {}
+
+    def find_category(self, common_name: str, scientific_name: str) -> Union[Dict[str, Any], str]:
+        """Get the category for a species, or "" if there is none"""
+        position = self._lookup(self._category_by_common, self._category_by_scientific, common_name, scientific_name)
+        return self.categories[position] if position is not None else ""
+
+    def fragment(self, common_name: str, scientific_name: str) -> Mapping[str, Any]:
+        """
+        Get the read-only response fragment for a species
+
+        Returns:
+            Mapping with "image_url" and "more_info" (the regulation)
+        """
+        fragment = self._fragments.get((_normalize(common_name), _normalize(scientific_name)))
+        if fragment is None:
+            fragment = self._build_fragment(common_name, scientific_name)
+        return fragment
+
+    def _build_fragment(self, common_name: str, scientific_name: str) -> Mapping[str, Any]:
+        category = self.find_category(common_name, scientific_name)
+        return MappingProxyType({
+            "image_url": category.get('image_url', '') if category else '',
+            "more_info": self.find_regulation(common_name, scientific_name)
+        })
+
+    @staticmethod
+    def _lookup(by_common: Dict[str, int], by_scientific: Dict[str, int], common_name: str, scientific_name: str) -> Optional[int]:
+        positions = [
+            position for position in (by_common.get(_normalize(common_name)), by_scientific.get(_normalize(scientific_name)))
+            if position is not None
+        ]
+        return min(positions) if positions else None
+
+def load_species_index() -> SpeciesIndex:
+    """Build the index from the bundled regulations and categories files"""
+    return SpeciesIndex.from_files(
+        BASE_DIR / "references" / "regulation" / "regulations.json",
+        BASE_DIR / "models" / "classification" / "categories.json"
+    )
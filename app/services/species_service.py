@@ -78,5 +78,9 @@ class SpeciesService:
                 return species
         return None
 
-# Create a singleton instance
-species_service = SpeciesService() 
\ No newline at end of file
+# Built on first use through the service registry
+def __getattr__(name):
+    if name == "species_service":
+        from .registry import services
+        return services.get("species")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,4 +1,15 @@
 # app/state.py
 
+# The ModelGeneration serving new requests; requests hold the one they started
+# on. The model fields below mirror it
+models = None
+
 classifier = None
 segmenter = None
+segmenter_pool = None
+classification_batcher = None
+inference_executor = None
+process_pool = None
+embedding_cache = None
+model_version = ""
+topology = None
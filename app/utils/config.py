@@ -22,6 +22,122 @@ class Settings:
     # Batch processing settings
     MAX_BATCH_SIZE: int = 10
     
+    # Serving topology. "latency": one model replica per worker using all of the
+    # worker's cores; "throughput": MODEL_REPLICAS segmenter replicas per worker
+    # with few threads each. workers x replicas x threads is checked against the
+    # available cores at startup (0 threads = fair share of the cores)
+    SERVING_MODE: str = "latency"
+    UVICORN_WORKERS: int = 1
+    MODEL_REPLICAS: int = 2
+    INTRA_OP_THREADS: int = 0
+    INTEROP_THREADS: int = 1
+    CPU_AFFINITY: bool = False  # pin each worker to its own block of cores
+    
+    # Map model weights from one copy in SHARED_TENSOR_DIR and memory-map the
+    # embedding database, so every worker shares them read-only instead of
+    # holding its own (disables MODEL_OPTIMIZE freezing)
+    SHARED_MODEL_MEMORY: bool = False
+    SHARED_TENSOR_DIR: str = "/dev/shm/fishai"
+    
+    # Inference executor settings (requests beyond the queue depth are
+    # rejected with 503 + Retry-After)
+    INFERENCE_WORKERS: int = 2
+    INFERENCE_QUEUE_DEPTH: int = 16
+    INFERENCE_RETRY_AFTER_SECONDS: int = 2
+    
+    # Model downloads (files are fetched concurrently and resumed on retry)
+    MODEL_DOWNLOAD_WORKERS: int = 3
+    MODEL_DOWNLOAD_RETRIES: int = 3
+    
+    # Content-addressed model store shared by all workers on a host; mount it
+    # as a volume to share downloads between containers ("" keeps the old
+    # per-directory cache). MODEL_STORE_VERIFY re-hashes objects on every start
+    MODEL_STORE_DIR: str = "cache/store"
+    MODEL_STORE_VERIFY: bool = False
+    
+    # JSON file mapping model file name to SHA-256 (the MODEL_CHECKSUMS_FILE
+    # environment variable overrides the path). Downloads that don't match are
+    # rejected; with MODEL_REQUIRE_CHECKSUMS a file without a checksum is an error
+    MODEL_CHECKSUMS_FILE: str = os.environ.get("MODEL_CHECKSUMS_FILE", "models/model_checksums.json")
+    MODEL_REQUIRE_CHECKSUMS: bool = False
+    
+    # POST /models/refresh builds the new models on a background thread with
+    # this nice value. The old models are freed when their last request finishes;
+    # the refresh warns if that takes longer than MODEL_RELOAD_DRAIN_SECONDS
+    MODEL_RELOAD_NICENESS: int = 10
+    MODEL_RELOAD_DRAIN_SECONDS: float = 120.0
+    
+    # Warmup passes per model while a refresh builds new models; they run next
+    # to live traffic on the shared torch threads, so fewer than at startup
+    MODEL_RELOAD_WARMUP_ITERATIONS: int = 1
+    
+    # Freeze and optimize the TorchScript models at startup (cached on disk next
+    # to the source model) and run warmup passes before serving
+    MODEL_OPTIMIZE: bool = True
+    MODEL_WARMUP_ITERATIONS: int = 2
+    
+    # Runtime for both models: "torchscript" or "onnx" (ONNX Runtime on CPU). ONNX
+    # exports are kept in ONNX_EXPORT_DIR as <model>.<hash of the .ts>.onnx, so a
+    # refreshed model gets its own; missing ones are exported when models are
+    # loaded (check their parity with scripts/export_onnx.py)
+    INFERENCE_BACKEND: str = "torchscript"
+    ONNX_EXPORT_DIR: str = "cache/onnx"
+    
+    # CPU inference precision per model: "fp32", "int8" (dynamic quantization of
+    # Linear layers) or "bf16" (autocast, only where the CPU has native bf16).
+    # Measure the cost first with scripts/compare_precision.py
+    CLASSIFIER_PRECISION: str = "fp32"
+    SEGMENTER_PRECISION: str = "fp32"
+    MODEL_CHANNELS_LAST: bool = False
+    
+    # Process pool for multi-file uploads (0 workers keeps everything in-process)
+    IDENTIFY_PROCESS_WORKERS: int = 0
+    IDENTIFY_PROCESS_TORCH_THREADS: int = 1
+    
+    # Classifier micro-batching settings (crops from concurrent requests
+    # are classified together in one forward pass)
+    CLASSIFIER_MAX_BATCH_SIZE: int = 16
+    CLASSIFIER_MAX_WAIT_MS: float = 2.0
+    
+    # Embedding search settings ("exact" or "ivf" approximate search)
+    EMBEDDING_SEARCH_MODE: str = "exact"
+    IVF_NLIST: int = 0  # 0 picks ~4 * sqrt(database size)
+    IVF_NPROBE: int = 8
+    
+    # Embedding database storage ("fp32", or compressed "fp16"/"int8" with exact
+    # re-ranking of the best candidates)
+    EMBEDDING_DB_PRECISION: str = "fp32"
+    EMBEDDING_RERANK_CANDIDATES: int = 64
+    
+    # Backbone embeddings cached per crop and classification model, so crops seen
+    # before skip the forward pass after threshold/metadata/database changes
+    # (0 disables the cache)
+    EMBEDDING_CACHE_MAX_ENTRIES: int = 4096
+    
+    # Segmentation crop mode: "masks" crops from the mask of each fish, "boxes"
+    # crops straight from the detection boxes and skips all mask work
+    SEGMENTATION_CROP_MODE: str = "masks"
+    
+    # JPEG uploads are decoded at a reduced scale (DCT-domain draft mode) as long
+    # as the shorter side stays at or above this size (0 decodes at full size).
+    # 4 x 224 keeps a fish spanning a quarter of the frame at classifier resolution
+    DECODE_MIN_SIDE: int = 896
+    
+    # Identification result cache (Redis, falling back to a bounded in-memory LRU)
+    REDIS_HOST: str = "localhost"
+    REDIS_PORT: int = 6379
+    REDIS_DB: int = 0
+    REDIS_MAX_CONNECTIONS: int = 20
+    REDIS_SOCKET_TIMEOUT: float = 0.5
+    CACHE_ENABLED: bool = True
+    CACHE_TTL_SECONDS: int = 3600
+    CACHE_MAX_ENTRIES: int = 2048
+    CACHE_MAX_BYTES: int = 32 * 1024 * 1024
+    CACHE_EXPIRY_INTERVAL_SECONDS: int = 60
+    
+    # Concurrent identical uploads (same image content) share one pipeline run
+    COALESCE_IDENTICAL_REQUESTS: bool = True
+    
     # Image processing settings
     MAX_IMAGE_SIZE: int = 1024  # Maximum image size for processing
     
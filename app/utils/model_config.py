@@ -2,6 +2,11 @@
 Configuration for model files stored in Google Drive
 """
 
+import hashlib
+import json
+import logging
+from pathlib import Path
+
 # Google Drive file IDs or URLs for your model files
 # You can get file IDs from Google Drive sharing URLs
 # Example: https://drive.google.com/file/d/1ABC123DEF456GHI789JKL012MNO345PQR/view
@@ -20,6 +25,11 @@ MODEL_FILE_IDS = {
     "segmentation_model.ts": "1l4g_po7tVebvbSPpCMEvx9xl9PCDMFX7",
 }
 
+# SHA-256 of each model file. Entries in settings.MODEL_CHECKSUMS_FILE are added
+# to these; downloads that don't match are rejected. Without an entry the hash of
+# the first download is trusted and recorded
+MODEL_SHA256 = {}
+
 # Cache configuration
 CACHE_DIR = "cache/models"
 
@@ -41,6 +51,22 @@ def get_model_file_ids():
     """Get model file IDs configuration"""
     return MODEL_FILE_IDS
 
+def get_model_checksums():
+    """Get expected SHA-256 per model file, from MODEL_SHA256 and the checksums file"""
+    from .config import settings
+    checksums = dict(MODEL_SHA256)
+    checksums_path = Path(settings.MODEL_CHECKSUMS_FILE) if settings.MODEL_CHECKSUMS_FILE else None
+    if checksums_path is not None and checksums_path.exists():
+        with open(checksums_path, "r") as f:
+            checksums.update(json.load(f))
+    
+    missing = sorted(set(MODEL_URLS) - set(checksums))
+    if missing and settings.MODEL_REQUIRE_CHECKSUMS:
+        raise ValueError(f"No SHA-256 configured for {', '.join(missing)}")
+    if missing:
+        logging.warning(f"No SHA-256 configured for {', '.join(missing)}; their first download is trusted")
+    return {filename: digest.lower() for filename, digest in checksums.items()}
+
 def get_cache_dir():
     """Get cache directory path"""
     return CACHE_DIR
@@ -51,4 +77,76 @@ def get_device():
 
 def get_google_drive_config():
     """Get Google Drive API configuration"""
-    return GOOGLE_DRIVE_CONFIG 
\ No newline at end of file
+    return GOOGLE_DRIVE_CONFIG
+
+def get_classifier_options():
+    """Get FishClassifier keyword arguments from the application settings"""
+    from .config import settings
+    return {
+        "search_mode": settings.EMBEDDING_SEARCH_MODE,
+        "ivf_nlist": settings.IVF_NLIST or None,
+        "ivf_nprobe": settings.IVF_NPROBE,
+        "db_precision": settings.EMBEDDING_DB_PRECISION,
+        "rerank_candidates": settings.EMBEDDING_RERANK_CANDIDATES,
+        "precision": settings.CLASSIFIER_PRECISION,
+        "channels_last": settings.MODEL_CHANNELS_LAST,
+        "backend": settings.INFERENCE_BACKEND,
+        "onnx_dir": settings.ONNX_EXPORT_DIR or None,
+    }
+
+def get_segmenter_options():
+    """Get FishSegmenter keyword arguments from the application settings"""
+    from .config import settings
+    return {
+        "precision": settings.SEGMENTER_PRECISION,
+        "channels_last": settings.MODEL_CHANNELS_LAST,
+        "backend": settings.INFERENCE_BACKEND,
+        "onnx_dir": settings.ONNX_EXPORT_DIR or None,
+    }
+
+def get_shared_store():
+    """Get the SharedTensorStore every worker maps model weights from, or None when disabled"""
+    from .config import settings
+    if not settings.SHARED_MODEL_MEMORY:
+        return None
+    from ..models.shared_tensors import SharedTensorStore
+    return SharedTensorStore(settings.SHARED_TENSOR_DIR)
+
+def get_model_version(model_paths, indexes_path=None):
+    """
+    Get a short version id for the loaded models, the category metadata and
+    the settings that change identification results, used to namespace
+    cached results. Files are identified by their SHA-256, so identical
+    models get the same version in every container and after a re-download.
+    """
+    from .config import settings
+    files = {name: _content_hash(path) for name, path in sorted(model_paths.items())}
+    if indexes_path is not None:
+        files["categories.json"] = _content_hash(indexes_path)
+    options = {
+        **get_classifier_options(),
+        "segmenter": get_segmenter_options(),
+        "crop_mode": settings.SEGMENTATION_CROP_MODE,
+        "decode_min_side": settings.DECODE_MIN_SIDE,
+    }
+    payload = json.dumps({"files": files, "options": options}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+def _content_hash(path):
+    """
+    SHA-256 of a file, taken from the model store object name or the download
+    manifest when they have it, so model files aren't hashed again
+    """
+    from ..services.gdown_service import MANIFEST_NAME, sha256_file
+    path = Path(path)
+    resolved = path.resolve()
+    if resolved.parent.parts[-2:] == ("objects", "sha256"):
+        return resolved.name
+    try:
+        with open(path.parent / MANIFEST_NAME, "r") as f:
+            entry = json.load(f).get(path.name)
+        if entry and entry["size"] == path.stat().st_size:
+            return entry["sha256"]
+    except (OSError, ValueError, KeyError):
+        pass
+    return sha256_file(path)
@@ -27,4 +27,16 @@ def extract_fish_region(image: np.ndarray, mask: np.ndarray) -> np.ndarray:
     x2 = min(image.shape[1], x + w + padding)
     y2 = min(image.shape[0], y + h + padding)
     
-    return image[y1:y2, x1:x2]
\ No newline at end of file
+    return image[y1:y2, x1:x2]
+
+def extract_box_region(image: np.ndarray, box, padding: int = 10, min_size: int = 50):
+    """Crop a padded detection box, or return None if the crop would be under min_size"""
+    x1 = max(0, int(box[0]) - padding)
+    y1 = max(0, int(box[1]) - padding)
+    x2 = min(image.shape[1], int(box[2]) + padding)
+    y2 = min(image.shape[0], int(box[3]) + padding)
+
+    if x2 - x1 < min_size or y2 - y1 < min_size:
+        return None
+
+    return image[y1:y2, x1:x2]
@@ -1,5 +1,7 @@
 import uvicorn
 import os
+from app.utils.config import settings
+from app.services.serving_topology import configure_serving
 
 def main():
     # Get port from environment variable (Railway provides this)
@@ -10,10 +12,14 @@ def main():
     print(f"Server will be available at http://0.0.0.0:{port}")
     print(f"API documentation: http://0.0.0.0:{port}/docs")
     
+    # Size torch thread pools for the workers before any of them imports torch
+    topology = configure_serving(settings)
+    
     uvicorn.run(
         "app.main:app",
         host="0.0.0.0",
         port=port,
+        workers=topology.workers,
         reload=False  # Disable reload in production
     )
 
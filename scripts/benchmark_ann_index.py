@@ -0,0 +1,107 @@
+"""
+Recall vs latency report for the IVF embedding index against exact search.
+
+Queries are database embeddings with Gaussian noise added (or a saved query tensor),
+and every configuration is compared with the exact species ranking of FishClassifier.
+
+Example:
+    python scripts/benchmark_ann_index.py --model cache/models/classification_model.ts \
+        --database cache/models/embedding_database.pt --nlist 64 256 --nprobe 1 4 8 16 32
+"""
+
+import sys
+import time
+import argparse
+import logging
+from pathlib import Path
+
+import torch
+
+# Add the parent directory to Python path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from app.models.fish_classifier import FishClassifier
+from app.models.embedding_index import IVFIndex
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+BASE_DIR = Path(__file__).parent.parent
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="cache/models/classification_model.ts")
+    parser.add_argument("--database", default="cache/models/embedding_database.pt")
+    parser.add_argument("--categories", default=str(BASE_DIR / "models" / "classification" / "categories.json"))
+    parser.add_argument("--queries", help="Optional .pt file with a (N, D) tensor of query embeddings")
+    parser.add_argument("--num-queries", type=int, default=1000)
+    parser.add_argument("--noise", type=float, default=0.5, help="Std of the noise added to sampled database rows")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--nlist", type=int, nargs="+", default=[0], help="Cell counts to try (0 = default)")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    return parser.parse_args()
+
+def make_queries(classifier, args):
+    if args.queries:
+        return torch.load(args.queries, map_location="cpu").float()
+    generator = torch.Generator().manual_seed(0)
+    db = classifier.db_tensor.float()
+    rows = torch.randint(db.shape[0], (args.num_queries,), generator=generator)
+    return db[rows] + torch.randn(args.num_queries, db.shape[1], generator=generator) * args.noise
+
+def run(classifier, queries, batch_size, top_k):
+    results = []
+    start_time = time.perf_counter()
+    for i in range(0, queries.shape[0], batch_size):
+        results.extend(classifier._classify_by_embeddings(queries[i:i + batch_size], top_k))
+    elapsed_ms = (time.perf_counter() - start_time) * 1000
+    return results, elapsed_ms / queries.shape[0]
+
+def agreement(exact, approximate, top_k):
+    top1 = sum(
+        1 for e, a in zip(exact, approximate)
+        if e and a and e[0]['scientific_name'] == a[0]['scientific_name']
+    ) / len(exact)
+    recall = sum(
+        len({c['scientific_name'] for c in e} & {c['scientific_name'] for c in a}) / max(1, len(e))
+        for e, a in zip(exact, approximate)
+    ) / len(exact)
+    return top1, recall
+
+def main():
+    args = parse_args()
+    classifier = FishClassifier(args.model, args.database, args.categories)
+    queries = make_queries(classifier, args)
+    logger.info(f"Database: {tuple(classifier.db_tensor.shape)}, queries: {tuple(queries.shape)}")
+
+    exact, exact_ms = run(classifier, queries, args.batch_size, args.top_k)
+
+    rows = [("exact", "-", "-", f"{exact_ms:.3f}", "1.0000", "1.0000", "1.00x")]
+    for nlist in args.nlist:
+        build_start = time.perf_counter()
+        classifier.ivf_index = IVFIndex.build(classifier.db_tensor, nlist or None)
+        build_s = time.perf_counter() - build_start
+        for nprobe in args.nprobe:
+            classifier.ivf_nprobe = nprobe
+            approximate, ivf_ms = run(classifier, queries, args.batch_size, args.top_k)
+            top1, recall = agreement(exact, approximate, args.top_k)
+            rows.append((
+                "ivf", str(classifier.ivf_index.nlist), str(nprobe),
+                f"{ivf_ms:.3f}", f"{top1:.4f}", f"{recall:.4f}", f"{exact_ms / ivf_ms:.2f}x"
+            ))
+        logger.info(f"nlist={classifier.ivf_index.nlist} built in {build_s:.2f}s")
+    classifier.ivf_index = None
+
+    header = ("mode", "nlist", "nprobe", "ms/query", "top1 agree", f"recall@{args.top_k}", "speedup")
+    widths = [max(len(header[i]), *(len(row[i]) for row in rows)) for i in range(len(header))]
+    print()
+    print("  ".join(h.ljust(w) for h, w in zip(header, widths)))
+    for row in rows:
+        print("  ".join(v.ljust(w) for v, w in zip(row, widths)))
+
+if __name__ == "__main__":
+    main()
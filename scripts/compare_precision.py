@@ -0,0 +1,132 @@
+"""
+Latency and accuracy report for the reduced-precision inference modes against fp32.
+
+Every image of a local folder is segmented with the fp32 segmenter, and its fish
+crops (or the whole image, as in the API fallback) are classified with each mode.
+Classifier modes are compared with the fp32 species ranking of the same crops;
+segmenter modes with the number of fish the fp32 segmenter finds.
+
+Example:
+    python scripts/compare_precision.py --images data/test_images \
+        --modes fp32 int8 bf16 --channels-last
+"""
+
+import sys
+import time
+import argparse
+import logging
+from pathlib import Path
+
+# Add the parent directory to Python path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from app.models.fish_classifier import FishClassifier
+from app.models.fish_segmenter import FishSegmenter
+from app.models.model_optimizer import PRECISIONS, resolve_precision
+from app.services.identify_pipeline import segment_image
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+BASE_DIR = Path(__file__).parent.parent
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp", ".bmp"}
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", required=True, help="Folder of test images")
+    parser.add_argument("--classifier-model", default="cache/models/classification_model.ts")
+    parser.add_argument("--segmenter-model", default="cache/models/segmentation_model.ts")
+    parser.add_argument("--database", default="cache/models/embedding_database.pt")
+    parser.add_argument("--categories", default=str(BASE_DIR / "models" / "classification" / "categories.json"))
+    parser.add_argument("--modes", nargs="+", default=list(PRECISIONS), choices=PRECISIONS)
+    parser.add_argument("--channels-last", action="store_true", help="Also try every mode with channels_last")
+    parser.add_argument("--limit", type=int, default=0, help="Use at most this many images (0 = all)")
+    parser.add_argument("--warmup", type=int, default=2)
+    return parser.parse_args()
+
+def load_images(folder, limit):
+    paths = sorted(p for p in Path(folder).rglob("*") if p.suffix.lower() in IMAGE_SUFFIXES)
+    if limit:
+        paths = paths[:limit]
+    return [(p.name, p.read_bytes()) for p in paths]
+
+def variants(modes, channels_last):
+    """(label, precision, channels_last) for every mode to compare, fp32 first"""
+    result = [("fp32", "fp32", False)]
+    for mode in modes:
+        for cl in ([False, True] if channels_last else [False]):
+            label = f"{mode}-cl" if cl else mode
+            if label == "fp32":
+                continue
+            if resolve_precision(mode) != mode:
+                logger.warning(f"Skipping {label}: not supported here")
+                continue
+            result.append((label, mode, cl))
+    return result
+
+def timed(fn, items):
+    outputs = []
+    start_time = time.perf_counter()
+    for item in items:
+        outputs.append(fn(item))
+    return outputs, (time.perf_counter() - start_time) * 1000 / max(1, len(items))
+
+def agreement(reference, candidate):
+    top1 = sum(
+        1 for r, c in zip(reference, candidate)
+        if r and c and r[0]['scientific_name'] == c[0]['scientific_name']
+    ) / max(1, len(reference))
+    top3 = sum(
+        len({x['scientific_name'] for x in r} & {x['scientific_name'] for x in c}) / max(1, len(r))
+        for r, c in zip(reference, candidate)
+    ) / max(1, len(reference))
+    return top1, top3
+
+def main():
+    args = parse_args()
+    images = load_images(args.images, args.limit)
+    if not images:
+        logger.error(f"No images found in {args.images}")
+        return
+    logger.info(f"Comparing on {len(images)} images")
+
+    rows = []
+
+    # Segmenter: latency per image and agreement on the number of fish found
+    baseline_counts, baseline_ms, crops = None, None, []
+    for label, precision, channels_last in variants(args.modes, args.channels_last):
+        segmenter = FishSegmenter(args.segmenter_model, precision=precision, channels_last=channels_last)
+        segmenter.warmup(args.warmup)
+        outputs, ms = timed(lambda image: segment_image(segmenter, image[1], image[0]), images)
+        counts = [0 if fish_ids is None else len(fish_ids) for _, fish_ids, _ in outputs]
+        if baseline_counts is None:
+            baseline_counts, baseline_ms = counts, ms
+            crops = [[image_np] if fish_ids is None else regions for image_np, fish_ids, regions in outputs]
+        same = sum(1 for a, b in zip(baseline_counts, counts) if a == b) / len(counts)
+        rows.append(("segmenter", label, f"{ms:.1f}", f"{baseline_ms / ms:.2f}x", f"{same:.4f}", "-"))
+
+    # Classifier: latency per image on the fp32 crops, agreement per crop
+    baseline, baseline_ms = None, None
+    for label, precision, channels_last in variants(args.modes, args.channels_last):
+        classifier = FishClassifier(args.classifier_model, args.database, args.categories,
+                                    precision=precision, channels_last=channels_last)
+        classifier.warmup(args.warmup)
+        outputs, ms = timed(lambda image_crops: classifier.classify_batch(image_crops, 3) if image_crops else [], crops)
+        results = [classifications for per_image in outputs for classifications in per_image]
+        if baseline is None:
+            baseline, baseline_ms = results, ms
+        top1, top3 = agreement(baseline, results)
+        rows.append(("classifier", label, f"{ms:.1f}", f"{baseline_ms / ms:.2f}x", f"{top1:.4f}", f"{top3:.4f}"))
+
+    header = ("model", "mode", "ms/image", "speedup", "top1/count agree", "top3 agree")
+    widths = [max(len(header[i]), *(len(row[i]) for row in rows)) for i in range(len(header))]
+    print()
+    print("  ".join(h.ljust(w) for h, w in zip(header, widths)))
+    for row in rows:
+        print("  ".join(v.ljust(w) for v, w in zip(row, widths)))
+
+if __name__ == "__main__":
+    main()
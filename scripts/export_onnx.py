@@ -0,0 +1,153 @@
+"""
+Export the TorchScript models to ONNX and check ONNX Runtime output parity.
+
+Each .ts model is exported into ONNX_EXPORT_DIR as <model>.<hash of the .ts>.onnx
+(the path the "onnx" INFERENCE_BACKEND loads), then both runtimes are run on
+the same inputs: real images from --images when given, random ones otherwise.
+The report lists the largest output differences, the embedding cosine
+similarity for the classifier, and the latency of both runtimes.
+
+Example:
+    python scripts/export_onnx.py --images data/test_images
+
+Then set INFERENCE_BACKEND = "onnx" in app/utils/config.py.
+"""
+
+import sys
+import time
+import argparse
+import logging
+from pathlib import Path
+
+import numpy as np
+import torch
+from PIL import Image
+
+# Add the parent directory to Python path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from app.models.fish_classifier import FishClassifier
+from app.models.fish_segmenter import FishSegmenter
+from app.models.inference_backend import OnnxRuntimeBackend, export_onnx, onnx_path_for
+from app.services.identify_pipeline import decode_image
+from app.utils.config import settings
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+BASE_DIR = Path(__file__).parent.parent
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp", ".bmp"}
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--classifier-model", default="cache/models/classification_model.ts")
+    parser.add_argument("--segmenter-model", default="cache/models/segmentation_model.ts")
+    parser.add_argument("--database", default="cache/models/embedding_database.pt")
+    parser.add_argument("--categories", default=str(BASE_DIR / "models" / "classification" / "categories.json"))
+    parser.add_argument("--images", help="Folder of test images (random inputs if omitted)")
+    parser.add_argument("--num-samples", type=int, default=8)
+    parser.add_argument("--onnx-dir", default=settings.ONNX_EXPORT_DIR or None)
+    parser.add_argument("--opset", type=int, default=17)
+    parser.add_argument("--atol", type=float, default=1e-3, help="Largest acceptable absolute output difference")
+    parser.add_argument("--skip-export", action="store_true", help="Only validate existing .onnx files")
+    return parser.parse_args()
+
+def load_images(folder, limit):
+    if not folder:
+        rng = np.random.default_rng(0)
+        return [rng.integers(0, 256, (768, 1024, 3), dtype=np.uint8) for _ in range(limit)]
+    paths = sorted(p for p in Path(folder).rglob("*") if p.suffix.lower() in IMAGE_SUFFIXES)[:limit]
+    return [decode_image(p.read_bytes())[0] for p in paths]
+
+def compare(name, reference, candidate, inputs):
+    """Run both backends on every input, returning a report row"""
+    max_diff = 0.0
+    cosine = []
+    times = {"ts": 0.0, "onnx": 0.0}
+    for tensor in inputs:
+        start_time = time.perf_counter()
+        expected = reference(tensor)
+        times["ts"] += time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        actual = candidate(tensor)
+        times["onnx"] += time.perf_counter() - start_time
+
+        expected = list(_flatten(expected))
+        if len(expected) != len(actual):
+            raise ValueError(f"{name}: {len(expected)} TorchScript outputs vs {len(actual)} ONNX outputs")
+        for e, a in zip(expected, actual):
+            if e.shape != a.shape:
+                # Detection counts can differ at the score threshold; only compare what both found
+                n = min(e.shape[0], a.shape[0]) if e.dim() and a.dim() else 0
+                e, a = e[:n], a[:n]
+            if e.numel():
+                max_diff = max(max_diff, float((e.float() - a.float()).abs().max()))
+        if name == "classifier":
+            cosine.append(float(torch.nn.functional.cosine_similarity(expected[0], actual[0]).min()))
+
+    ts_ms, onnx_ms = (times[k] * 1000 / len(inputs) for k in ("ts", "onnx"))
+    return (name, f"{max_diff:.2e}", f"{min(cosine):.6f}" if cosine else "-",
+            f"{ts_ms:.1f}", f"{onnx_ms:.1f}", f"{ts_ms / onnx_ms:.2f}x"), max_diff
+
+def _flatten(outputs):
+    for value in outputs:
+        if isinstance(value, (tuple, list)):
+            yield from _flatten(value)
+        else:
+            yield value
+
+def main():
+    args = parse_args()
+    images = load_images(args.images, args.num_samples)
+    if not images:
+        logger.error(f"No images found in {args.images}")
+        return
+
+    # Inputs exactly as the models receive them in the API
+    classifier = FishClassifier(args.classifier_model, args.database, args.categories)
+    segmenter = FishSegmenter(args.segmenter_model)
+    classifier_inputs = [classifier.transform(Image.fromarray(image)).unsqueeze(0) for image in images]
+    segmenter_inputs = [
+        torch.as_tensor(segmenter._resize_image(image)[0].astype("float32").transpose(2, 0, 1))
+        for image in images
+    ]
+
+    models = [
+        ("classifier", classifier.model, classifier_inputs, FishClassifier.ONNX_INPUT[1]),
+        ("segmenter", segmenter.model, segmenter_inputs, FishSegmenter.ONNX_INPUT[1]),
+    ]
+
+    rows, failed = [], False
+    for name, reference, inputs, dynamic_axes in models:
+        model_path = reference.model_path
+        onnx_path = onnx_path_for(model_path, args.onnx_dir)
+        try:
+            if not args.skip_export:
+                export_onnx(model_path, onnx_path, (tuple(inputs[0].shape), dynamic_axes), args.opset)
+            candidate = OnnxRuntimeBackend(onnx_path)
+            reference(inputs[0]), candidate(inputs[0])  # warmup
+            row, max_diff = compare(name, reference, candidate, inputs)
+            rows.append(row)
+            failed |= max_diff > args.atol
+        except Exception as e:
+            logger.error(f"{name}: {e}")
+            failed = True
+
+    header = ("model", "max abs diff", "min cosine", "ts ms", "onnx ms", "speedup")
+    if rows:
+        widths = [max(len(header[i]), *(len(row[i]) for row in rows)) for i in range(len(header))]
+        print()
+        print("  ".join(h.ljust(w) for h, w in zip(header, widths)))
+        for row in rows:
+            print("  ".join(v.ljust(w) for v, w in zip(row, widths)))
+
+    if failed:
+        logger.error(f"Parity check failed (atol={args.atol})")
+        sys.exit(1)
+    logger.info("ONNX outputs match TorchScript")
+
+if __name__ == "__main__":
+    main()
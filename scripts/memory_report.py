@@ -0,0 +1,103 @@
+"""
+Per-worker memory report with and without shared model memory.
+
+Starts --workers processes that each load the classifier and segmenter the way
+a uvicorn worker does, first with private copies of the weights and database,
+then with SHARED_MODEL_MEMORY (weights mapped from a SharedTensorStore, database
+memory-mapped). Reports the unique (USS), proportional (PSS) and resident (RSS)
+set size of every worker in both runs.
+
+Example:
+    python scripts/memory_report.py --workers 4
+"""
+
+import sys
+import time
+import argparse
+import logging
+import multiprocessing
+import tempfile
+from pathlib import Path
+
+# Add the parent directory to Python path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from app.models.shared_tensors import process_memory
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+BASE_DIR = Path(__file__).parent.parent
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--classifier-model", default="cache/models/classification_model.ts")
+    parser.add_argument("--segmenter-model", default="cache/models/segmentation_model.ts")
+    parser.add_argument("--database", default="cache/models/embedding_database.pt")
+    parser.add_argument("--categories", default=str(BASE_DIR / "models" / "classification" / "categories.json"))
+    parser.add_argument("--shared-dir", help="SharedTensorStore directory (a fresh temporary one by default)")
+    return parser.parse_args()
+
+def _worker(args, shared_dir, ready, stop):
+    import torch
+    from app.models.fish_classifier import FishClassifier
+    from app.models.fish_segmenter import FishSegmenter
+    from app.models.shared_tensors import SharedTensorStore
+
+    torch.set_num_threads(1)
+    store = SharedTensorStore(shared_dir) if shared_dir else None
+    classifier = FishClassifier(args.classifier_model, args.database, args.categories, shared_store=store)
+    segmenter = FishSegmenter(args.segmenter_model, shared_store=store)
+    segmenter.warmup(1)
+    classifier.warmup(1)
+    ready.set()
+    stop.wait()
+
+def measure(args, shared_dir):
+    context = multiprocessing.get_context("spawn")
+    stop = context.Event()
+    workers = []
+    for _ in range(args.workers):
+        ready = context.Event()
+        process = context.Process(target=_worker, args=(args, shared_dir, ready, stop))
+        process.start()
+        workers.append((process, ready))
+        # One at a time, so the first worker writes the shared store for the others
+        ready.wait()
+
+    time.sleep(1)
+    usage = [process_memory(process.pid) for process, _ in workers]
+    stop.set()
+    for process, _ in workers:
+        process.join()
+    return usage
+
+def main():
+    args = parse_args()
+    runs = [("private", None)]
+    with tempfile.TemporaryDirectory(dir="/dev/shm" if Path("/dev/shm").is_dir() else None) as tmp_dir:
+        runs.append(("shared", args.shared_dir or tmp_dir))
+        rows = []
+        totals = {}
+        for label, shared_dir in runs:
+            logger.info(f"Starting {args.workers} workers with {label} model memory")
+            usage = measure(args, shared_dir)
+            totals[label] = sum(u.get("uss", 0) for u in usage)
+            for i, u in enumerate(usage):
+                rows.append((label, str(i), *(f"{u.get(k, 0) / 2**20:.1f}" for k in ("uss", "pss", "rss"))))
+
+    header = ("memory", "worker", "USS MB", "PSS MB", "RSS MB")
+    widths = [max(len(header[i]), *(len(row[i]) for row in rows)) for i in range(len(header))]
+    print()
+    print("  ".join(h.ljust(w) for h, w in zip(header, widths)))
+    for row in rows:
+        print("  ".join(v.ljust(w) for v, w in zip(row, widths)))
+    print()
+    print(f"Total USS: private {totals['private'] / 2**20:.1f} MB, shared {totals['shared'] / 2**20:.1f} MB")
+
+if __name__ == "__main__":
+    main()
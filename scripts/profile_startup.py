@@ -0,0 +1,98 @@
+"""
+Import-time and startup profile of the serving process.
+
+Imports the app in a fresh interpreter with -X importtime and reports the
+slowest top-level imports, the total import time, peak memory after import, and
+which heavy optional packages (TensorFlow, Redis, ONNX Runtime, gdown) the
+import pulled in. With --startup it also runs the startup event (downloads and
+loads the models) and reports its duration, peak memory, and which services
+it built (per-model load and warmup timings are in its log output).
+
+Example:
+    python scripts/profile_startup.py --top 25
+    python scripts/profile_startup.py --startup
+"""
+
+import sys
+import json
+import argparse
+import subprocess
+from pathlib import Path
+
+BASE_DIR = Path(__file__).parent.parent
+
+HEAVY_MODULES = ("tensorflow", "keras", "redis", "onnxruntime", "gdown", "torch", "cv2")
+
+PROBE = """
+import json, resource, sys, time
+start = time.perf_counter()
+import {module}
+imported = time.perf_counter() - start
+report = {{
+    "import_seconds": imported,
+    "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "heavy_modules": sorted(m for m in {heavy!r} if m in sys.modules),
+}}
+if {startup!r}:
+    import asyncio, logging
+    from app.services.registry import services
+    logging.basicConfig(level=logging.INFO)
+    start = time.perf_counter()
+    asyncio.run(sys.modules["app.main"].startup_event())
+    report["startup_seconds"] = time.perf_counter() - start
+    report["max_rss_mb_after_startup"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    report["services"] = services.stats()
+    report["heavy_modules_after_startup"] = sorted(m for m in {heavy!r} if m in sys.modules)
+print("REPORT" + json.dumps(report))
+"""
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="app.main", help="Module to import")
+    parser.add_argument("--top", type=int, default=20, help="Number of slowest imports to list")
+    parser.add_argument("--startup", action="store_true", help="Also run the startup event")
+    return parser.parse_args()
+
+def parse_importtime(stderr):
+    """(cumulative microseconds, self microseconds, module) of every top-level import"""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        # Nested imports are indented under the module that triggered them
+        if name == name.lstrip():
+            entries.append((int(cumulative_us), int(self_us), name))
+    return entries
+
+def main():
+    args = parse_args()
+    probe = PROBE.format(module=args.module, heavy=HEAVY_MODULES, startup=args.startup)
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", probe],
+        cwd=str(BASE_DIR), capture_output=True, text=True
+    )
+    report_lines = [line for line in completed.stdout.splitlines() if line.startswith("REPORT")]
+    if completed.returncode != 0 or not report_lines:
+        print(completed.stderr[-4000:])
+        sys.exit(completed.returncode or 1)
+    report = json.loads(report_lines[-1][len("REPORT"):])
+
+    entries = sorted(parse_importtime(completed.stderr), reverse=True)[:args.top]
+    width = max((len(name) for _, _, name in entries), default=10)
+    print(f"\nSlowest top-level imports of {args.module}:")
+    print(f"{'module'.ljust(width)}  {'cumulative ms':>13}  {'self ms':>8}")
+    for cumulative_us, self_us, name in entries:
+        print(f"{name.ljust(width)}  {cumulative_us / 1000:>13.1f}  {self_us / 1000:>8.1f}")
+
+    print(f"\nImport of {args.module}: {report['import_seconds']:.2f}s, peak RSS {report['max_rss_mb']:.0f} MB")
+    print(f"Heavy packages loaded by the import: {', '.join(report['heavy_modules']) or 'none'}")
+    if args.startup:
+        print(f"Startup event: {report['startup_seconds']:.2f}s, peak RSS {report['max_rss_mb_after_startup']:.0f} MB")
+        print(f"Heavy packages loaded after startup: {', '.join(report['heavy_modules_after_startup']) or 'none'}")
+        for name, stats in report["services"].items():
+            state = f"built in {stats['build_seconds']:.2f}s" if stats["loaded"] else "not built"
+            print(f"  service {name}: {state}")
+
+if __name__ == "__main__":
+    main()
@@ -47,9 +47,17 @@ def download_models():
     """Download models from Google Drive"""
     try:
         from app.services.simple_model_manager import SimpleModelManager
-        from app.utils.model_config import get_model_urls, get_cache_dir
+        from app.utils.model_config import get_model_urls, get_model_checksums, get_cache_dir
+        from app.utils.config import settings
         
-        model_manager = SimpleModelManager(get_cache_dir())
+        model_manager = SimpleModelManager(
+            get_cache_dir(),
+            expected_hashes=get_model_checksums(),
+            max_workers=settings.MODEL_DOWNLOAD_WORKERS,
+            retries=settings.MODEL_DOWNLOAD_RETRIES,
+            store_dir=settings.MODEL_STORE_DIR or None,
+            store_verify=settings.MODEL_STORE_VERIFY
+        )
         model_urls = get_model_urls()
         
         logger.info("📥 Downloading models from Google Drive...")
@@ -88,12 +96,18 @@ def main():
     logger.info("🎯 Starting FastAPI application...")
     
     import uvicorn
+    from app.utils.config import settings
+    from app.services.serving_topology import configure_serving
     port = int(os.environ.get("PORT", 8000))
     
+    # Size torch thread pools for the workers before any of them imports torch
+    topology = configure_serving(settings)
+    
     uvicorn.run(
         "app.main:app",
         host="0.0.0.0",
         port=port,
+        workers=topology.workers,
         reload=False,
         log_level="info"
     )
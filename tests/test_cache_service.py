@@ -0,0 +1,271 @@
+import asyncio
+
+import fakeredis
+import pytest
+
+from app.services import cache_service
+from app.services.cache_service import CacheService, MemoryCache, SingleFlight
+
+class CountingRedis(fakeredis.FakeAsyncRedis):
+    """Fake Redis that counts round trips (commands and pipeline executions)"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.round_trips = 0
+
+    async def execute_command(self, *args, **options):
+        self.round_trips += 1
+        return await super().execute_command(*args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        pipe = super().pipeline(transaction, shard_hint)
+        execute = pipe.execute
+
+        async def counted_execute(*args, **kwargs):
+            self.round_trips += 1
+            return await execute(*args, **kwargs)
+
+        pipe.execute = counted_execute
+        return pipe
+
+def run(coro):
+    return asyncio.run(coro)
+
+@pytest.fixture
+def redis_client():
+    return CountingRedis(server=fakeredis.FakeServer(), decode_responses=True)
+
+def test_get_many_is_one_round_trip(redis_client):
+    async def scenario():
+        cache = CacheService(redis_client)
+        await cache.connect()
+        images = [b"image-a", b"image-b", b"image-c"]
+        await cache.set_many([(images[0], {"species": "trout"}), (images[2], {"species": "bass"})], version="v1")
+
+        redis_client.round_trips = 0
+        results = await cache.get_many(images, version="v1")
+        assert redis_client.round_trips == 1
+        return cache, results
+
+    cache, results = run(scenario())
+    assert results == [{"species": "trout"}, None, {"species": "bass"}]
+    assert cache.stats()["backend"] == "redis"
+    assert (cache.hits, cache.misses) == (2, 1)
+
+def test_set_many_is_one_pipelined_round_trip(redis_client):
+    async def scenario():
+        cache = CacheService(redis_client)
+        await cache.connect()
+        redis_client.round_trips = 0
+        stored = await cache.set_many([(bytes([i]), {"i": i}) for i in range(10)], version="v1")
+        return stored, redis_client.round_trips
+
+    stored, round_trips = run(scenario())
+    assert stored
+    assert round_trips == 1
+
+def test_set_many_applies_ttl(redis_client):
+    async def scenario():
+        cache = CacheService(redis_client)
+        await cache.connect()
+        await cache.set_many([(b"image", {"species": "pike"})], ttl=120, version="v1")
+        custom_ttl = await redis_client.ttl(cache.key_for(b"image", "v1"))
+        await cache.set_many([(b"other", {"species": "perch"})], version="v1")
+        default_ttl = await redis_client.ttl(cache.key_for(b"other", "v1"))
+        return cache, custom_ttl, default_ttl
+
+    cache, custom_ttl, default_ttl = run(scenario())
+    assert 0 < custom_ttl <= 120
+    assert cache.ttl - 5 < default_ttl <= cache.ttl
+
+def test_results_are_namespaced_by_model_version(redis_client):
+    async def scenario():
+        cache = CacheService(redis_client)
+        await cache.connect()
+        await cache.set_many([(b"image", {"species": "carp"})], version="v1")
+        return await cache.get_many([b"image"], version="v2")
+
+    assert run(scenario()) == [None]
+
+def test_falls_back_to_memory_cache_when_redis_is_down():
+    server = fakeredis.FakeServer()
+    server.connected = False
+
+    async def scenario():
+        cache = CacheService(fakeredis.FakeAsyncRedis(server=server, decode_responses=True))
+        await cache.connect()
+        stored = await cache.set_many([(b"image", {"species": "walleye"})], version="v1")
+        results = await cache.get_many([b"image", b"missing"], version="v1")
+        return cache, stored, results
+
+    cache, stored, results = run(scenario())
+    assert cache.redis_client is None
+    assert stored
+    assert results == [{"species": "walleye"}, None]
+    stats = cache.stats()
+    assert stats["backend"] == "memory"
+    assert stats["entries"] == 1
+
+def test_single_flight_shares_one_run_between_concurrent_callers():
+    async def scenario():
+        flight = SingleFlight()
+        runs = []
+        release = asyncio.Event()
+
+        async def identify():
+            runs.append(1)
+            await release.wait()
+            return {"species": "trout"}
+
+        callers = [asyncio.ensure_future(flight.do("image", identify)) for _ in range(3)]
+        await asyncio.sleep(0)
+        in_flight = len(flight)
+        release.set()
+        return await asyncio.gather(*callers), runs, in_flight, flight
+
+    results, runs, in_flight, flight = run(scenario())
+    assert results == [{"species": "trout"}] * 3
+    assert len(runs) == 1
+    assert in_flight == 1
+    assert flight.coalesced == 2
+    assert len(flight) == 0
+
+def test_single_flight_cancelling_one_waiter_keeps_the_shared_run():
+    async def scenario():
+        flight = SingleFlight()
+        release = asyncio.Event()
+        cancelled = []
+
+        async def identify():
+            try:
+                await release.wait()
+            except asyncio.CancelledError:
+                cancelled.append(1)
+                raise
+            return {"species": "bass"}
+
+        first = asyncio.ensure_future(flight.do("image", identify))
+        second = asyncio.ensure_future(flight.do("image", identify))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        result = await second
+        return first, result, cancelled
+
+    first, result, cancelled = run(scenario())
+    assert first.cancelled()
+    assert result == {"species": "bass"}
+    assert cancelled == []
+
+def test_single_flight_cancels_the_run_when_every_waiter_is_gone():
+    async def scenario():
+        flight = SingleFlight()
+        cancelled = []
+
+        async def identify():
+            try:
+                await asyncio.Event().wait()
+            except asyncio.CancelledError:
+                cancelled.append(1)
+                raise
+
+        caller = asyncio.ensure_future(flight.do("image", identify))
+        await asyncio.sleep(0)
+        caller.cancel()
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        return cancelled, flight
+
+    cancelled, flight = run(scenario())
+    assert cancelled == [1]
+    assert len(flight) == 0
+
+def test_single_flight_exception_reaches_every_waiter():
+    async def scenario():
+        flight = SingleFlight()
+        release = asyncio.Event()
+        runs = []
+
+        async def identify():
+            runs.append(1)
+            await release.wait()
+            raise ValueError("model failed")
+
+        callers = [asyncio.ensure_future(flight.do("image", identify)) for _ in range(2)]
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(*callers, return_exceptions=True)
+        stale = len(flight)
+
+        # The failed call is forgotten, so the next caller runs again
+        release.clear()
+        retry = asyncio.ensure_future(flight.do("image", identify))
+        await asyncio.sleep(0)
+        release.set()
+        with pytest.raises(ValueError):
+            await retry
+        return results, stale, runs
+
+    results, stale, runs = run(scenario())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert stale == 0
+    assert len(runs) == 2
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(cache_service, "time", clock)
+    return clock
+
+def test_memory_cache_evicts_least_recently_used_by_count(clock):
+    cache = MemoryCache(max_entries=2, max_bytes=1000)
+    cache.set("a", "1", ttl=60)
+    cache.set("b", "2", ttl=60)
+    assert cache.get("a") == "1"
+    cache.set("c", "3", ttl=60)
+
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == ("1", "3")
+    assert cache.evictions == 1
+
+def test_memory_cache_evicts_least_recently_used_by_size(clock):
+    cache = MemoryCache(max_entries=10, max_bytes=10)
+    cache.set("a", "aaaa", ttl=60)
+    cache.set("b", "bbbb", ttl=60)
+    cache.get("a")
+    cache.set("c", "cccc", ttl=60)
+
+    assert cache.get("b") is None
+    assert cache.nbytes == 8
+    assert not cache.set("large", "x" * 11, ttl=60)
+    assert len(cache) == 2
+
+def test_memory_cache_replacing_an_entry_updates_its_size(clock):
+    cache = MemoryCache(max_entries=10, max_bytes=10)
+    cache.set("a", "aaaa", ttl=60)
+    cache.set("a", "aa", ttl=60)
+
+    assert cache.nbytes == 2
+    assert len(cache) == 1
+
+def test_memory_cache_expires_entries(clock):
+    cache = MemoryCache(max_entries=10, max_bytes=1000)
+    cache.set("short", "1", ttl=10)
+    cache.set("long", "2", ttl=100)
+    cache.set("read", "3", ttl=10)
+    clock.now += 10
+
+    assert cache.get("read") is None
+    assert cache.purge_expired() == 1
+    assert len(cache) == 1
+    assert cache.get("long") == "2"
+    assert cache.nbytes == 1
+    assert cache.expirations == 2
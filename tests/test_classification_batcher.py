@@ -0,0 +1,96 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from app.services.classification_batcher import ClassificationBatcher
+
+class RecordingClassifier:
+    """Stub classifier that records the crops of every batch it is given"""
+
+    def __init__(self, gate: threading.Event = None):
+        self.batches = []
+        self.gate = gate
+
+    def classify_batch(self, crops, top_k):
+        self.batches.append(list(crops))
+        if self.gate is not None:
+            self.gate.wait(5)
+        return [[{"crop": crop, "rank": rank} for rank in range(top_k)] for crop in crops]
+
+def group(name, size):
+    return [f"{name}{i}" for i in range(size)]
+
+def run_batched(classifier, groups, max_batch_size, top_k=3):
+    async def scenario():
+        batcher = ClassificationBatcher(classifier, max_batch_size=max_batch_size, max_wait_ms=50)
+        try:
+            return await asyncio.gather(*(batcher.classify_batch(crops, top_k) for crops in groups))
+        finally:
+            batcher.close()
+
+    return asyncio.run(scenario())
+
+def test_groups_are_never_split_across_batches():
+    classifier = RecordingClassifier()
+    groups = [group("a", 3), group("b", 3), group("c", 2)]
+
+    results = run_batched(classifier, groups, max_batch_size=4)
+
+    assert [len(batch) for batch in classifier.batches] == [3, 3, 2]
+    for crops, crop_results in zip(groups, results):
+        assert [result[0]["crop"] for result in crop_results] == crops
+
+def test_group_larger_than_max_batch_size_stays_in_one_batch():
+    classifier = RecordingClassifier()
+
+    run_batched(classifier, [group("a", 6)], max_batch_size=4)
+
+    assert classifier.batches == [group("a", 6)]
+
+def test_group_that_does_not_fit_opens_the_next_batch_in_order():
+    classifier = RecordingClassifier()
+    groups = [group("a", 3), group("b", 3), group("c", 1)]
+
+    run_batched(classifier, groups, max_batch_size=4)
+
+    assert classifier.batches == [group("a", 3), group("b", 3) + group("c", 1)]
+
+def test_results_are_trimmed_to_each_callers_top_k():
+    async def scenario():
+        batcher = ClassificationBatcher(RecordingClassifier(), max_batch_size=8, max_wait_ms=50)
+        try:
+            return await asyncio.gather(batcher.classify_batch(["a"], 1), batcher.classify_batch(["b"], 3))
+        finally:
+            batcher.close()
+
+    first, second = asyncio.run(scenario())
+    assert len(first[0]) == 1
+    assert len(second[0]) == 3
+
+def test_close_fails_dispatched_and_queued_requests():
+    gate = threading.Event()
+    classifier = RecordingClassifier(gate)
+    executor = ThreadPoolExecutor(max_workers=1)
+
+    async def scenario():
+        batcher = ClassificationBatcher(classifier, max_batch_size=2, max_wait_ms=0, executor=executor)
+        dispatched = asyncio.ensure_future(batcher.classify_batch(group("a", 2)))
+        while not classifier.batches:
+            await asyncio.sleep(0.001)
+        queued = asyncio.ensure_future(batcher.classify_batch(group("b", 1)))
+        await asyncio.sleep(0)
+        batcher.close()
+        return await asyncio.gather(dispatched, queued, return_exceptions=True)
+
+    try:
+        results = asyncio.run(scenario())
+    finally:
+        gate.set()
+        executor.shutdown()
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert classifier.batches == [group("a", 2)]
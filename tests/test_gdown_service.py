@@ -0,0 +1,117 @@
+import hashlib
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app.services.gdown_service import GDownService
+from app.utils import model_config
+from app.utils.config import settings
+
+CONTENT = bytes(range(256)) * 64
+DIGEST = hashlib.sha256(CONTENT).hexdigest()
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Serves CONTENT with Range support; the first response can be cut short"""
+
+    def do_GET(self):
+        server = self.server
+        server.ranges.append(self.headers.get("Range"))
+        offset = 0
+        if self.headers.get("Range"):
+            offset = int(self.headers["Range"].split("=")[1].rstrip("-"))
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {offset}-{len(CONTENT) - 1}/{len(CONTENT)}")
+        else:
+            self.send_response(200)
+        body = CONTENT[offset:]
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if server.cut_after is not None:
+            body, server.cut_after = body[:server.cut_after], None
+            self.close_connection = True
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    httpd.ranges = []
+    httpd.cut_after = None
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+def url_of(server):
+    return f"http://127.0.0.1:{server.server_address[1]}/model.pt"
+
+def test_http_download_resumes_after_interruption(server, tmp_path):
+    server.cut_after = 1000
+    service = GDownService(str(tmp_path), expected_hashes={"model.pt": DIGEST}, retries=2)
+
+    path = service.download_file_from_url(url_of(server), "model.pt")
+
+    assert path.read_bytes() == CONTENT
+    assert server.ranges == [None, "bytes=1000-"]
+    assert not (tmp_path / "model.pt.part").exists()
+
+def test_http_download_continues_existing_part_file(server, tmp_path):
+    (tmp_path / "model.pt.part").write_bytes(CONTENT[:5000])
+    service = GDownService(str(tmp_path), expected_hashes={"model.pt": DIGEST})
+
+    path = service.download_file_from_url(url_of(server), "model.pt")
+
+    assert path.read_bytes() == CONTENT
+    assert server.ranges == ["bytes=5000-"]
+
+def test_http_download_with_wrong_checksum_is_rejected(server, tmp_path):
+    service = GDownService(str(tmp_path), expected_hashes={"model.pt": "0" * 64})
+
+    assert service.download_file_from_url(url_of(server), "model.pt") is None
+    assert not (tmp_path / "model.pt").exists()
+    assert not (tmp_path / "model.pt.part").exists()
+    assert service.get_cached_file("model.pt") is None
+
+def test_file_url_fetch_resumes_part_file(tmp_path):
+    source = tmp_path / "source.pt"
+    source.write_bytes(CONTENT)
+    part_path = tmp_path / "model.pt.part"
+    part_path.write_bytes(CONTENT[:3000])
+
+    GDownService(str(tmp_path / "cache")).fetch(source.as_uri(), part_path)
+
+    assert part_path.read_bytes() == CONTENT
+
+def test_file_url_download_with_wrong_checksum_is_rejected(tmp_path):
+    source = tmp_path / "source.pt"
+    source.write_bytes(CONTENT)
+    service = GDownService(str(tmp_path / "cache"), expected_hashes={"model.pt": "0" * 64})
+
+    assert service.download_file_from_url(source.as_uri(), "model.pt") is None
+    assert not (tmp_path / "cache" / "model.pt").exists()
+
+def test_cached_file_is_used_without_downloading(server, tmp_path):
+    service = GDownService(str(tmp_path), expected_hashes={"model.pt": DIGEST})
+    service.download_file_from_url(url_of(server), "model.pt")
+
+    assert service.download_file_from_url(url_of(server), "model.pt") == tmp_path / "model.pt"
+    assert server.ranges == [None]
+
+def test_checksums_are_loaded_from_file(tmp_path, monkeypatch):
+    checksums_path = tmp_path / "model_checksums.json"
+    checksums_path.write_text(json.dumps({name: DIGEST.upper() for name in model_config.MODEL_URLS}))
+    monkeypatch.setattr(settings, "MODEL_CHECKSUMS_FILE", str(checksums_path))
+
+    assert model_config.get_model_checksums() == {name: DIGEST for name in model_config.MODEL_URLS}
+
+def test_missing_checksums_are_an_error_when_required(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "MODEL_CHECKSUMS_FILE", str(tmp_path / "missing.json"))
+    monkeypatch.setattr(settings, "MODEL_REQUIRE_CHECKSUMS", True)
+
+    with pytest.raises(ValueError):
+        model_config.get_model_checksums()
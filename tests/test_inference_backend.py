@@ -0,0 +1,56 @@
+import shutil
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("onnx")
+pytest.importorskip("onnxruntime")
+
+from app.models.inference_backend import load_backend, onnx_path_for
+
+ONNX_INPUT = ((1, 4), {"input": {0: "batch"}})
+
+def save_model(path, seed):
+    torch.manual_seed(seed)
+    model = torch.jit.trace(torch.nn.Linear(4, 2).eval(), torch.zeros(1, 4))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    model.save(str(path))
+    return model
+
+def test_onnx_backend_loads_a_refreshed_version(tmp_path):
+    onnx_dir = tmp_path / "onnx"
+    current = tmp_path / "models" / "classification_model.ts"
+    refreshed = tmp_path / "models" / "versions" / "v2" / "classification_model.ts"
+    save_model(current, seed=0)
+    new_model = save_model(refreshed, seed=1)
+
+    load_backend(current, "onnx", onnx_dir=onnx_dir, onnx_input=ONNX_INPUT)
+    backend = load_backend(refreshed, "onnx", onnx_dir=onnx_dir, onnx_input=ONNX_INPUT)
+
+    inputs = torch.randn(3, 4)
+    with torch.no_grad():
+        expected = new_model(inputs)
+    assert torch.allclose(backend(inputs)[0], expected, atol=1e-5)
+    assert onnx_path_for(current, onnx_dir) != onnx_path_for(refreshed, onnx_dir)
+
+def test_promoted_copy_reuses_the_export(tmp_path):
+    onnx_dir = tmp_path / "onnx"
+    version = tmp_path / "models" / "versions" / "v2" / "classification_model.ts"
+    save_model(version, seed=1)
+    load_backend(version, "onnx", onnx_dir=onnx_dir, onnx_input=ONNX_INPUT)
+    export = onnx_path_for(version, onnx_dir)
+    exported_at = export.stat().st_mtime_ns
+
+    promoted = tmp_path / "models" / "classification_model.ts"
+    shutil.copy(version, promoted)
+    load_backend(promoted, "onnx", onnx_dir=onnx_dir, onnx_input=ONNX_INPUT)
+
+    assert list(onnx_dir.iterdir()) == [export]
+    assert export.stat().st_mtime_ns == exported_at
+
+def test_missing_export_without_example_input_is_an_error(tmp_path):
+    model_path = tmp_path / "classification_model.ts"
+    save_model(model_path, seed=0)
+
+    with pytest.raises(FileNotFoundError):
+        load_backend(model_path, "onnx", onnx_dir=tmp_path / "onnx")
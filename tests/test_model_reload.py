@@ -0,0 +1,99 @@
+import asyncio
+from types import SimpleNamespace
+
+from app.services.model_reload import ModelGeneration
+
+class StubComponent:
+    """Stands in for the batcher and the process pool, recording when they are stopped"""
+
+    def __init__(self):
+        self.stopped = 0
+
+    def close(self):
+        self.stopped += 1
+
+    def shutdown(self):
+        self.stopped += 1
+
+def make_generation():
+    batcher, process_pool = StubComponent(), StubComponent()
+    generation = ModelGeneration(
+        "v1",
+        {"classification_model.ts": "cache/models/classification_model.ts"},
+        SimpleNamespace(model=SimpleNamespace(shared_key=None)),
+        SimpleNamespace(replicas=[SimpleNamespace(model=SimpleNamespace(shared_key=None))]),
+        batcher,
+        process_pool
+    )
+    return generation, batcher, process_pool
+
+def test_retire_with_active_requests_defers_close():
+    generation, batcher, process_pool = make_generation()
+    closed = []
+    generation.acquire()
+
+    generation.retire(on_closed=lambda: closed.append(generation.version))
+
+    assert not generation.closed
+    assert (batcher.stopped, process_pool.stopped) == (0, 0)
+    assert closed == []
+
+def test_release_of_last_request_closes_a_retired_generation():
+    generation, batcher, process_pool = make_generation()
+    closed = []
+    generation.acquire()
+    generation.acquire()
+    generation.retire(on_closed=lambda: closed.append(generation.version))
+
+    generation.release()
+    assert not generation.closed
+
+    generation.release()
+    assert generation.closed
+    assert (batcher.stopped, process_pool.stopped) == (1, 1)
+    assert closed == ["v1"]
+
+def test_retire_without_requests_closes_right_away():
+    generation, batcher, _ = make_generation()
+    closed = []
+
+    generation.retire(on_closed=lambda: closed.append(generation.version))
+
+    assert generation.closed
+    assert batcher.stopped == 1
+    assert closed == ["v1"]
+
+def test_close_is_idempotent():
+    generation, batcher, _ = make_generation()
+    closed = []
+    generation.retire(on_closed=lambda: closed.append(generation.version))
+
+    generation.close()
+
+    assert batcher.stopped == 1
+    assert closed == ["v1"]
+
+def test_release_without_retire_keeps_the_generation():
+    generation, batcher, _ = make_generation()
+    with generation.use():
+        pass
+
+    assert not generation.closed
+    assert batcher.stopped == 0
+
+def test_drain_times_out_while_requests_are_active():
+    async def scenario():
+        generation, _, _ = make_generation()
+        generation.acquire()
+        return await generation.drain(0.01)
+
+    assert asyncio.run(scenario()) is False
+
+def test_drain_returns_once_the_last_request_is_released():
+    async def scenario():
+        generation, _, _ = make_generation()
+        generation.acquire()
+        asyncio.get_running_loop().call_later(0.01, generation.release)
+        return await generation.drain(5)
+
+    assert asyncio.run(scenario()) is True